@@ -1,8 +1,15 @@
-__all__ = []
+import importlib
+import importlib.util
 
-try:
-    from . import requests
+__all__ = []
 
+# blindbox.requests (and the HTTP stack behind it) is only imported on first
+# access, so that the CLI does not pay for it at startup.
+if importlib.util.find_spec("requests") is not None:
     __all__ += ["requests"]
-except ImportError:
-    pass
+
+
+def __getattr__(name):
+    if name == "requests":
+        return importlib.import_module(".requests", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,34 @@
-__all__ = ["SecureSession", "post", "get", "patch", "put", "delete", "options", "head"]
+import importlib
+import importlib.util
+
+__all__ = ["SecureSession", "SessionPool", "default_pool", "AttestationCache", "attestation_cache", "JWKSCache", "jwks_cache", "PolicyRegistry", "policy_registry", "LoadBalancedSession", "warmup", "MultipartEncoder", "streaming", "download", "post", "get", "patch", "put", "delete", "options", "head"]
 
 from .secure_session import SecureSession
-from .requests import post, get, patch, put, delete, options, head
\ No newline at end of file
+from .attestation_cache import AttestationCache, attestation_cache
+from .jwks import JWKSCache, jwks_cache
+from .policy import PolicyRegistry, policy_registry
+from .balancer import LoadBalancedSession
+from .pool import SessionPool, default_pool
+from .requests import post, get, patch, put, delete, options, head, streaming, download
+from .multipart import MultipartEncoder
+from .warmup import warmup
+
+# The asyncio client is imported on first access (or by warmup(asynchronous=True)),
+# synchronous users do not pay for the import of httpx.
+_ASYNC = {
+    "AsyncSecureSession": ".async_session",
+    "async_connect": ".async_session",
+    "AsyncSessionPool": ".async_requests",
+    "default_async_pool": ".async_requests",
+    "async_requests": ".async_requests",
+}
+
+if importlib.util.find_spec("httpx") is not None:
+    __all__ += list(_ASYNC)
+
+
+def __getattr__(name):
+    if name in _ASYNC:
+        module = importlib.import_module(_ASYNC[name], __name__)
+        return module if name == "async_requests" else getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,182 @@
+import asyncio
+
+from .async_session import AsyncSecureSession
+from .pool import SessionPool, _policy_key
+from .requests import DEFAULT_ATTESTER, _parse_url
+
+
+class AsyncSessionPool(SessionPool):
+    """A pool of attested AsyncSecureSession instances, with the same
+    policies as SessionPool. Sessions are bound to the event loop which
+    created them, so the loop is part of the pool key."""
+
+    async def session(
+        self,
+        addr: str,
+        cce_file: str = None,
+        attestation_endpoint: str = "sharedeus2.eus2.test.attest.azure.net",
+        debug_mode: bool = False,
+    ) -> AsyncSecureSession:
+        """Return an attested session to the BlindBox, creating it if needed.
+        Please refer to SessionPool.session for documentation."""
+        loop = asyncio.get_running_loop()
+        key = (loop, addr, _policy_key(cce_file), attestation_endpoint, debug_mode)
+        evicted = []
+
+        with self._lock:
+            session = self._lookup(key, evicted)
+            if session is None:
+                key_lock = self._key_locks.setdefault(key, asyncio.Lock())
+
+        if session is None:
+            async with key_lock:
+                with self._lock:
+                    session = self._lookup(key, evicted)
+
+                if session is None:
+                    session = AsyncSecureSession(addr, cce_file, attestation_endpoint, debug_mode)
+                    try:
+                        await session.ensure_attested()
+                    except BaseException:
+                        await session.aclose()
+                        raise
+                    with self._lock:
+                        self._insert(key, session, evicted)
+                        self._key_locks.pop(key, None)
+
+        # Evicted sessions may still be used by other coroutines
+        await self._close(evicted, loop, when_idle=True)
+        return session
+
+    async def aclose(self):
+        """Close every session of the pool."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        await self._close([entry.session for entry in entries], asyncio.get_running_loop())
+
+    def clear(self):
+        raise TypeError("Use 'await pool.aclose()' to close an AsyncSessionPool")
+
+    @staticmethod
+    async def _close(sessions, loop, when_idle=False):
+        for session in sessions:
+            # Sessions of another (possibly closed) event loop cannot be awaited
+            # from this one, their connections are released with the loop.
+            if session._loop is None or session._loop is loop:
+                if when_idle:
+                    await session.aclose_when_idle()
+                else:
+                    await session.aclose()
+
+
+default_async_pool = AsyncSessionPool()
+
+
+async def post(url, cce_policy, attestation_endpoint=None, data=None, json=None, **kwargs):
+    r"""Sends a POST request. Returns :class:`httpx.Response` object.
+    :param url: URL for the new request.
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
+    :param attestation_endpoint: (optional) attestation service uri
+    :param data: (optional) Dictionary to send in the body of the request.
+    :param json: (optional) json to send in the body of the request.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :rtype: httpx.Response
+    """
+
+    root, endpoint = _parse_url(url)
+    attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
+    secure_session = await default_async_pool.session(root, cce_policy, attestation_endpoint)
+    return await secure_session.post(endpoint, data=data, json=json, **kwargs)
+
+
+async def get(url, cce_policy, attestation_endpoint=None, **kwargs):
+    r"""Sends a GET request. Returns :class:`httpx.Response` object.
+    :param url: URL for the new request.
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
+    :param attestation_endpoint: (optional) attestation service uri
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :rtype: httpx.Response
+    """
+
+    root, endpoint = _parse_url(url)
+    attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
+    secure_session = await default_async_pool.session(root, cce_policy, attestation_endpoint)
+    return await secure_session.get(endpoint, **kwargs)
+
+
+async def options(url, cce_policy, attestation_endpoint=None, **kwargs):
+    r"""Sends a OPTIONS request. Returns :class:`httpx.Response` object.
+    :param url: URL for the new request.
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
+    :param attestation_endpoint: (optional) attestation service uri
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :rtype: httpx.Response
+    """
+
+    root, endpoint = _parse_url(url)
+    attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
+    secure_session = await default_async_pool.session(root, cce_policy, attestation_endpoint)
+    return await secure_session.options(endpoint, **kwargs)
+
+
+async def head(url, cce_policy, attestation_endpoint=None, **kwargs):
+    r"""Sends a HEAD request. Returns :class:`httpx.Response` object.
+    :param url: URL for the new request.
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
+    :param attestation_endpoint: (optional) attestation service uri
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :rtype: httpx.Response
+    """
+
+    root, endpoint = _parse_url(url)
+    attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
+    secure_session = await default_async_pool.session(root, cce_policy, attestation_endpoint)
+    return await secure_session.head(endpoint, **kwargs)
+
+
+async def put(url, cce_policy, attestation_endpoint=None, data=None, **kwargs):
+    r"""Sends a PUT request. Returns :class:`httpx.Response` object.
+    :param url: URL for the new request.
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
+    :param attestation_endpoint: (optional) attestation service uri
+    :param data: (optional) Dictionary to send in the body of the request.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :rtype: httpx.Response
+    """
+
+    root, endpoint = _parse_url(url)
+    attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
+    secure_session = await default_async_pool.session(root, cce_policy, attestation_endpoint)
+    return await secure_session.put(endpoint, data=data, **kwargs)
+
+
+async def patch(url, cce_policy, attestation_endpoint=None, data=None, **kwargs):
+    r"""Sends a PATCH request. Returns :class:`httpx.Response` object.
+    :param url: URL for the new request.
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
+    :param attestation_endpoint: (optional) attestation service uri
+    :param data: (optional) Dictionary to send in the body of the request.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :rtype: httpx.Response
+    """
+
+    root, endpoint = _parse_url(url)
+    attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
+    secure_session = await default_async_pool.session(root, cce_policy, attestation_endpoint)
+    return await secure_session.patch(endpoint, data=data, **kwargs)
+
+
+async def delete(url, cce_policy, attestation_endpoint=None, **kwargs):
+    r"""Sends a DELETE request. Returns :class:`httpx.Response` object.
+    :param url: URL for the new request.
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
+    :param attestation_endpoint: (optional) attestation service uri
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :rtype: httpx.Response
+    """
+
+    root, endpoint = _parse_url(url)
+    attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
+    secure_session = await default_async_pool.session(root, cce_policy, attestation_endpoint)
+    return await secure_session.delete(endpoint, **kwargs)
@@ -0,0 +1,295 @@
+import asyncio
+import functools
+import importlib.util
+import time
+import warnings
+
+import httpx
+from requests import exceptions
+
+from .attestation_cache import AttestationVerdict, attestation_cache
+from .jwks import jwks_cache
+from .policy import policy_digest, policy_registry
+from .secure_session import (
+    BlindBoxDebugModeWarning,
+    _check_claims,
+    _new_nonce,
+    _parse_token_response,
+    _refresh_verdict,
+    _revalidate_verdict,
+    _token_header,
+    _token_request,
+)
+
+# HTTP/2 is only negotiated when the optional h2 package is installed
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """The body of a streamed response, calling release once it is closed."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                await release()
+
+
+class AsyncSecureSession(httpx.AsyncClient):
+    """An asyncio counterpart of SecureSession, built on httpx.AsyncClient.
+
+    The BlindBox is attested before the first request is sent, with the same
+    checks as SecureSession. Requests sent concurrently while the attestation
+    is in progress wait for it to complete.
+    """
+
+    def __init__(
+        self,
+        addr: str,
+        cce_file: str = None,
+        attestation_endpoint: str = "sharedeus2.eus2.test.attest.azure.net",
+        debug_mode: bool = False,
+        use_cache: bool = True,
+        http2: bool = True,
+        max_connections: int = 1000,
+        max_keepalive_connections: int = 100,
+        **kwargs,
+    ):
+        """Connect to a BlindBox service.
+        Args:
+            addr (str): The address of the BlindBox service.
+            cce_file (str): The path to the file containing the cce policy (base64 encoded),
+                or its digest ("sha256:<hex digest>").
+            attestation_endpoint (str): The url of the MAA attestation endpoint.
+            debug_mode (bool): Whether to bypass attestation. MUST NOT be used in production.
+            use_cache (bool): Whether a cached attestation verdict can be reused.
+            http2 (bool): Whether to use HTTP/2 when the BlindBox supports it
+                (requires the h2 package).
+            max_connections (int): The maximum number of concurrent connections.
+            max_keepalive_connections (int): The maximum number of idle connections kept open.
+            **kwargs: Optional arguments that ``httpx.AsyncClient`` takes.
+        """
+
+        if addr == None or addr == "":
+            raise exceptions.MissingSchema(
+                "Missing URL for the Secure Session instance"
+            )
+
+        self.jwt = ""
+        self.expires_at = None
+        self.attestation_timings = {}
+        self._addr = addr
+        self._attestation_endpoint = attestation_endpoint
+        self._use_cache = use_cache
+        self._cce_policy = None
+        self._attested = debug_mode
+        # Created by the first coroutine attesting the session: before Python 3.10,
+        # a lock binds to the event loop current when it is created
+        self._attestation_lock = None
+        # Requests in flight, and whether the session is closed once they complete
+        self._in_flight = 0
+        self._close_when_idle = False
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+
+        if debug_mode:
+            warnings.warn(
+                (
+                    "BlindBox is running in debug mode. "
+                    "This mode is provided solely for testing purposes. "
+                    "It MUST NOT be used in production. "
+                    "Attestation is bypassed. "
+                ),
+                BlindBoxDebugModeWarning,
+            )
+        else:
+            if not cce_file:
+                raise exceptions.ContentDecodingError("A cce policy needs to be provided when you are not using the debug mode")
+            start = time.perf_counter()
+            try:
+                self._cce_policy = policy_registry.digest(cce_file)
+            except (OSError, ValueError):
+                raise exceptions.ContentDecodingError("Unable to read cce policy")
+            self._policy_digest_time = time.perf_counter() - start
+
+        kwargs.setdefault(
+            "limits",
+            httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+        )
+        # Requests waiting for a free connection must not time out under load
+        kwargs.setdefault("timeout", httpx.Timeout(30.0, pool=None))
+        super().__init__(base_url=addr, http2=http2 and _HTTP2_AVAILABLE, **kwargs)
+
+    async def __aenter__(self):
+        await super().__aenter__()
+        await self.ensure_attested()
+        return self
+
+    async def ensure_attested(self):
+        """Attest the BlindBox if it has not been attested yet, or if the
+        attestation token has expired."""
+        if self._attested and not self.expired:
+            return
+        if self._attestation_lock is None:
+            self._attestation_lock = asyncio.Lock()
+        async with self._attestation_lock:
+            if self._attested and not self.expired:
+                return
+            timings = {"policy_digest": self._policy_digest_time}
+            await self._attestation(self._cce_policy, self._attestation_endpoint, self._use_cache, timings)
+            self._attested = True
+
+    async def send(self, request, *, stream: bool = False, **kwargs):
+        # Every request (including streamed ones) goes through send. A streamed
+        # request is in flight until its response is closed.
+        self._in_flight += 1
+        try:
+            await self.ensure_attested()
+            response = await super().send(request, stream=stream, **kwargs)
+        except BaseException:
+            await self._release()
+            raise
+        if stream:
+            response.stream = _ReleasingStream(response.stream, self._release)
+        else:
+            await self._release()
+        return response
+
+    async def aclose_when_idle(self):
+        """Close the session once the requests in flight complete, e.g. when it is
+        evicted from a pool while other coroutines still use it. Closing it right
+        away would close their connections too."""
+        self._close_when_idle = True
+        if self._in_flight == 0:
+            await self.aclose()
+
+    async def _release(self):
+        self._in_flight -= 1
+        if self._in_flight == 0 and self._close_when_idle:
+            await self.aclose()
+
+    async def attestation(self, policy, attestation_endpoint, use_cache: bool = True):
+        """Attest the BlindBox. Please refer to SecureSession.attestation for details."""
+
+        start = time.perf_counter()
+        cce_policy = policy_digest(policy)
+        timings = {"policy_digest": time.perf_counter() - start}
+        await self._attestation(cce_policy, attestation_endpoint, use_cache, timings)
+
+    async def _attestation(self, cce_policy, attestation_endpoint, use_cache, timings):
+        total_start = time.perf_counter() - timings.get("policy_digest", 0.0)
+        base_url = self._addr
+        key = (base_url, cce_policy, attestation_endpoint)
+
+        verdict = None
+        if use_cache:
+            start = time.perf_counter()
+            # The verdict may have to be read and verified from disk, which blocks
+            loop = asyncio.get_running_loop()
+            verdict = await loop.run_in_executor(
+                None,
+                functools.partial(
+                    attestation_cache.get,
+                    key,
+                    refresh=lambda: _refresh_verdict(base_url, cce_policy, attestation_endpoint),
+                    revalidate=lambda v: _revalidate_verdict(v, cce_policy, attestation_endpoint),
+                ),
+            )
+            timings["cache"] = time.perf_counter() - start
+
+        if verdict is None:
+            verdict = await _attest_async(self, base_url, cce_policy, attestation_endpoint, timings)
+            if use_cache:
+                attestation_cache.put(key, verdict)
+            print("Attestation validated")
+
+        timings["total"] = time.perf_counter() - total_start
+        self.attestation_timings = timings
+        self.jwt = verdict.token
+        self.expires_at = verdict.expires_at
+
+    @property
+    def expired(self) -> bool:
+        """Whether the attestation token of the session has expired."""
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+
+async def _attest_async(client, base_url, cce_policy, attestation_endpoint, timings=None) -> AttestationVerdict:
+    timings = {} if timings is None else timings
+    nonce = _new_nonce()
+
+    async def request_token():
+        start = time.perf_counter()
+        url, body = _token_request(base_url, attestation_endpoint, nonce)
+        res = await _send_unattested(client, "POST", url, json=body)
+        timings["token"] = time.perf_counter() - start
+        return _parse_token_response(url, res.status_code, res.content)
+
+    async def prefetch():
+        start = time.perf_counter()
+        try:
+            await jwks_cache.prefetch_async(_Unattested(client), f"https://{attestation_endpoint}/certs")
+        except Exception:
+            # The keys are downloaded again, and the error raised, on verification
+            pass
+        timings["jwks"] = time.perf_counter() - start
+
+    maa_token, _ = await asyncio.gather(request_token(), prefetch())
+
+    start = time.perf_counter()
+    jku, kid = _token_header(maa_token, attestation_endpoint)
+    public_key = await jwks_cache.get_key_async(_Unattested(client), jku, kid)
+    payload = _check_claims(maa_token, public_key, cce_policy, nonce)
+    timings["verify"] = time.perf_counter() - start
+    return AttestationVerdict.from_payload(maa_token, payload, nonce)
+
+
+async def _send_unattested(client, method, url, **kwargs):
+    # The requests of the attestation itself must not wait for it to complete
+    request = client.build_request(method, url, **kwargs)
+    return await httpx.AsyncClient.send(client, request)
+
+
+class _Unattested:
+    def __init__(self, client):
+        self._client = client
+
+    async def get(self, url, **kwargs):
+        return await _send_unattested(self._client, "GET", url, **kwargs)
+
+
+async def async_connect(
+    addr: str,
+    cce_file: str,
+    attestation_endpoint: str = "sharedeus2.eus2.test.attest.azure.net",
+    debug_mode: bool = False,
+) -> AsyncSecureSession:
+    """Connect to a BlindBox service and attest it.
+    Args:
+        addr (str): The address of the BlindBox service (such as "enclave.com:8443" or "localhost:8443").
+        cce_file (str): The path to the a file containing the cce_policy (base64 encoded)
+        attestation_endpoint (str): The url of the MAA attestation endpoint
+        debug_mode (bool): Whether to run in debug mode. This mode is provided
+            solely for testing purposes. It MUST NOT be used in production. Attestation is bypassed in this mode.
+            Defaults to False.
+    Returns:
+        AsyncSecureSession: A connection to the BlindBox service.
+    """
+    session = AsyncSecureSession(addr, cce_file, attestation_endpoint, debug_mode)
+    await session.ensure_attested()
+    return session
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class AttestationVerdict:
+    """A successful attestation of a BlindBox, valid until its MAA token expires."""
+
+    def __init__(self, token: str, nonce: dict, issued_at: float, expires_at: float):
+        self.token = token
+        self.nonce = nonce
+        self.issued_at = issued_at
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_payload(cls, token: str, payload: dict, nonce: dict):
+        """Build a verdict from a verified MAA token and its decoded payload."""
+        expires_at = float(payload["exp"])
+        issued_at = float(payload.get("iat", payload.get("nbf", expires_at)))
+        return cls(token, nonce, issued_at, expires_at)
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+    def refresh_at(self, refresh_margin: float) -> float:
+        """The time after which the verdict should be renewed, which is
+        `refresh_margin` (a fraction of the token lifetime) before it expires."""
+        return self.expires_at - refresh_margin * (self.expires_at - self.issued_at)
+
+    def to_dict(self) -> dict:
+        return {
+            "token": self.token,
+            "nonce": self.nonce,
+            "iat": self.issued_at,
+            "exp": self.expires_at,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        return cls(d["token"], d["nonce"], float(d["iat"]), float(d["exp"]))
+
+
+class _CacheEntry:
+    def __init__(self, verdict: AttestationVerdict):
+        self.verdict = verdict
+        self.refreshing = False
+
+
+class AttestationCache:
+    """A cache of attestation verdicts keyed by (enclave address, cce policy digest, attester).
+
+    Verdicts are kept until the expiry (`exp` claim) of their MAA token, and
+    are renewed in a background thread once they are close to expiring, so
+    that new sessions to an enclave that was already attested do not block
+    on the attestation service.
+
+    When a directory is given, verdicts are also persisted on disk to be
+    shared with the other processes (workers) of the host. Since the files
+    can be tampered with, the tokens read from disk are verified again
+    before being used.
+    """
+
+    def __init__(self, directory: str = None, refresh_margin: float = 0.2):
+        """Create an attestation cache.
+        Args:
+            directory (str): (optional) A directory where verdicts are persisted.
+            refresh_margin (float): The fraction of the token lifetime left
+                when the verdict starts being renewed in the background.
+        """
+        self.directory = directory
+        self.refresh_margin = refresh_margin
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, refresh=None, revalidate=None):
+        """Return the valid verdict cached for `key`, or None.
+        Args:
+            key (tuple): The (address, policy digest, attester) of the enclave.
+            refresh (callable): (optional) Returns a new verdict for `key`.
+                It is called in a background thread once the cached verdict
+                is close to expiring.
+            revalidate (callable): (optional) Called with a verdict loaded from
+                disk, it must raise an exception if the verdict is not valid.
+        Returns:
+            AttestationVerdict: The cached verdict, if any.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.verdict.expired:
+                del self._entries[key]
+                entry = None
+
+        if entry is None:
+            verdict = self._load(key)
+            if verdict is None:
+                return None
+            if revalidate is not None:
+                try:
+                    revalidate(verdict)
+                except Exception:
+                    self._remove(key)
+                    return None
+            with self._lock:
+                entry = self._entries.setdefault(key, _CacheEntry(verdict))
+
+        if refresh is not None and time.time() >= entry.verdict.refresh_at(self.refresh_margin):
+            self._refresh_in_background(key, entry, refresh)
+        return entry.verdict
+
+    def put(self, key, verdict: AttestationVerdict):
+        """Store a verdict for `key`, replacing the previous one."""
+        with self._lock:
+            self._entries[key] = _CacheEntry(verdict)
+        self._store(key, verdict)
+
+    def invalidate(self, key):
+        """Drop the verdict cached for `key`."""
+        with self._lock:
+            self._entries.pop(key, None)
+        self._remove(key)
+
+    def clear(self):
+        """Drop every verdict kept in memory. Files on disk are left untouched."""
+        with self._lock:
+            self._entries.clear()
+
+    def _refresh_in_background(self, key, entry, refresh):
+        with self._lock:
+            if entry.refreshing:
+                return
+            entry.refreshing = True
+
+        def run():
+            try:
+                self.put(key, refresh())
+            except Exception:
+                # The current verdict stays valid until it expires; the next
+                # session past that point attests again in the foreground.
+                with self._lock:
+                    entry.refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _path(self, key):
+        name = hashlib.sha256(json.dumps(list(key)).encode()).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "r") as f:
+                verdict = AttestationVerdict.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if verdict.expired:
+            self._remove(key)
+            return None
+        return verdict
+
+    def _store(self, key, verdict):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(verdict.to_dict(), f)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            pass
+
+    def _remove(self, key):
+        if not self.directory:
+            return
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _reset(self):
+        # Refresh threads do not survive fork(), the child renews on its own.
+        self._lock = threading.Lock()
+        for entry in self._entries.values():
+            entry.refreshing = False
+
+
+attestation_cache = AttestationCache(os.environ.get("BLINDBOX_ATTESTATION_CACHE_DIR"))
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=attestation_cache._reset)
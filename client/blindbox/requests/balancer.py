@@ -0,0 +1,279 @@
+import random
+import threading
+import time
+
+from requests import exceptions
+
+from .errors import AttestationException
+from .secure_session import SecureSession
+
+LEAST_OUTSTANDING = "least_outstanding"
+EWMA = "ewma"
+
+
+class NoReplicaAvailable(exceptions.ConnectionError):
+    """
+    This exception is raised when every replica of a LoadBalancedSession
+    has been ejected.
+    """
+    pass
+
+
+class _Replica:
+    def __init__(self, addr: str):
+        self.addr = addr
+        self.session = None
+        self.outstanding = 0
+        self.latency = None
+        self.retry_at = 0.0
+        self.backoff = 0.0
+        self.last_error = None
+
+    @property
+    def available(self) -> bool:
+        return self.session is not None
+
+
+class LoadBalancedSession:
+    """A client balancing requests across several replicas of a BlindBox.
+
+    All the replicas must run under the same cce policy. Each of them is attested
+    with its own SecureSession, and replicas which fail attestation, a health
+    check or a connection are ejected. Ejected replicas are attested again in a
+    background thread, and only rejoin once they pass attestation and the health
+    check. Sessions are re-attested in the background before their token expires,
+    and their replica is ejected if it fails attestation or once the token expires.
+    """
+
+    def __init__(
+        self,
+        addrs,
+        cce_file: str = None,
+        attestation_endpoint: str = "sharedeus2.eus2.test.attest.azure.net",
+        debug_mode: bool = False,
+        strategy: str = LEAST_OUTSTANDING,
+        health_check: str = None,
+        health_check_interval: float = 10.0,
+        max_backoff: float = 60.0,
+        ewma_decay: float = 0.3,
+        reattest_margin: float = 60.0,
+    ):
+        """Connect to the replicas of a BlindBox service.
+        Args:
+            addrs (list): The addresses of the replicas.
+            cce_file (str): The path to the cce policy file shared by the replicas, or its digest.
+            attestation_endpoint (str): The url of the MAA attestation endpoint.
+            debug_mode (bool): Whether to bypass attestation. MUST NOT be used in production.
+            strategy (str): "least_outstanding" sends each request to the replica with the
+                fewest requests in flight, "ewma" to the one with the lowest expected latency
+                (latency EWMA weighted by the requests in flight).
+            health_check (str): (optional) An endpoint which must answer GET requests with a
+                success status for a replica to be used.
+            health_check_interval (float): The delay between two rounds of health checks.
+            max_backoff (float): The maximum delay between two attempts to bring an ejected
+                replica back.
+            ewma_decay (float): The weight of the last sample in the latency EWMA.
+            reattest_margin (float): Replicas are re-attested this many seconds before
+                their token expires.
+        Returns:
+        """
+        if not addrs:
+            raise exceptions.MissingSchema("Missing URLs for the LoadBalancedSession instance")
+        if strategy not in (LEAST_OUTSTANDING, EWMA):
+            raise ValueError(f"Unknown load balancing strategy: {strategy}")
+
+        self.cce_file = cce_file
+        self.attestation_endpoint = attestation_endpoint
+        self.debug_mode = debug_mode
+        self.strategy = strategy
+        self.health_check = health_check
+        self.health_check_interval = health_check_interval
+        self.max_backoff = max_backoff
+        self.ewma_decay = ewma_decay
+        self.reattest_margin = reattest_margin
+
+        self._replicas = [_Replica(addr) for addr in addrs]
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # Replicas are attested concurrently
+        threads = [
+            threading.Thread(target=self._bring_up, args=(replica,), daemon=True)
+            for replica in self._replicas
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if not any(replica.available for replica in self._replicas):
+            errors = [replica.last_error for replica in self._replicas if replica.last_error]
+            raise errors[0] if errors else NoReplicaAvailable("No replica could be attested")
+
+        self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._monitor.start()
+
+    @property
+    def replicas(self):
+        """The addresses of the replicas currently in use."""
+        with self._lock:
+            return [replica.addr for replica in self._replicas if replica.available]
+
+    def request(self, method, endpoint, *args, **kwargs):
+        replica, session = self._acquire()
+        start = time.perf_counter()
+        try:
+            response = session.request(method, endpoint, *args, **kwargs)
+        except (exceptions.ConnectionError, exceptions.Timeout) as e:
+            self._release(replica, None)
+            self._eject(replica, session, e)
+            raise
+        except BaseException:
+            self._release(replica, None)
+            raise
+        self._release(replica, time.perf_counter() - start)
+        return response
+
+    def get(self, endpoint: str = "", **kwargs):
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("GET", endpoint, **kwargs)
+
+    def options(self, endpoint: str = "", **kwargs):
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("OPTIONS", endpoint, **kwargs)
+
+    def head(self, endpoint: str = "", **kwargs):
+        kwargs.setdefault("allow_redirects", False)
+        return self.request("HEAD", endpoint, **kwargs)
+
+    def post(self, endpoint: str = "", data=None, json=None, **kwargs):
+        return self.request("POST", endpoint, data=data, json=json, **kwargs)
+
+    def put(self, endpoint: str = "", data=None, **kwargs):
+        return self.request("PUT", endpoint, data=data, **kwargs)
+
+    def patch(self, endpoint: str = "", data=None, **kwargs):
+        return self.request("PATCH", endpoint, data=data, **kwargs)
+
+    def delete(self, endpoint: str = "", **kwargs):
+        return self.request("DELETE", endpoint, **kwargs)
+
+    def close(self):
+        """Stop the background checks and close the session of every replica."""
+        self._closed.set()
+        self._monitor.join()
+        with self._lock:
+            sessions = [replica.session for replica in self._replicas if replica.session]
+            for replica in self._replicas:
+                replica.session = None
+        for session in sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _acquire(self):
+        with self._lock:
+            candidates = [replica for replica in self._replicas if replica.available]
+            if not candidates:
+                raise NoReplicaAvailable("Every replica of the BlindBox has been ejected")
+
+            if self.strategy == EWMA:
+                # Replicas without latency samples yet are tried first
+                score = lambda r: (r.latency or 0.0) * (r.outstanding + 1)
+            else:
+                score = lambda r: r.outstanding
+            best = min(score(replica) for replica in candidates)
+            replica = random.choice([r for r in candidates if score(r) == best])
+            replica.outstanding += 1
+            return replica, replica.session
+
+    def _release(self, replica, latency):
+        with self._lock:
+            replica.outstanding -= 1
+            if latency is not None:
+                if replica.latency is None:
+                    replica.latency = latency
+                else:
+                    replica.latency += self.ewma_decay * (latency - replica.latency)
+
+    def _eject(self, replica, session, error):
+        with self._lock:
+            # The replica may already have been ejected, or brought back with a new session
+            if replica.session is not session:
+                return
+            replica.session = None
+            replica.latency = None
+            replica.last_error = error
+            replica.backoff = min(self.max_backoff, max(1.0, 2 * replica.backoff))
+            replica.retry_at = time.monotonic() + replica.backoff
+        session.close()
+
+    def _connect(self, addr, use_cache):
+        session = SecureSession(addr, self.cce_file, self.attestation_endpoint, self.debug_mode, use_cache)
+        try:
+            self._check_health(session)
+        except BaseException:
+            session.close()
+            raise
+        return session
+
+    def _check_health(self, session):
+        if self.health_check is not None:
+            session.get(self.health_check, timeout=self.health_check_interval).raise_for_status()
+
+    def _bring_up(self, replica, use_cache=True):
+        """Attest the replica with a new session, returning the error if it fails."""
+        try:
+            session = self._connect(replica.addr, use_cache)
+        except Exception as e:
+            with self._lock:
+                replica.last_error = e
+                # Only ejected replicas back off, the others are ejected by the caller
+                if replica.session is None:
+                    replica.backoff = min(self.max_backoff, max(1.0, 2 * replica.backoff))
+                    replica.retry_at = time.monotonic() + replica.backoff
+            return e
+
+        with self._lock:
+            old, replica.session = replica.session, session
+            replica.backoff = 0.0
+            replica.last_error = None
+        if old is not None:
+            old.close()
+        return None
+
+    def _monitor_loop(self):
+        while not self._closed.wait(self.health_check_interval):
+            for replica in list(self._replicas):
+                if self._closed.is_set():
+                    return
+                with self._lock:
+                    session = replica.session
+                    retry_at = replica.retry_at
+
+                if session is None:
+                    if time.monotonic() >= retry_at:
+                        self._bring_up(replica)
+                    continue
+
+                if session.expires_at is not None and time.time() >= session.expires_at - self.reattest_margin:
+                    # Re-attest while the current session keeps serving requests. The
+                    # cached verdict is the one about to expire, so it is not reused.
+                    error = self._bring_up(replica, use_cache=False)
+                    if error is None:
+                        continue
+                    # A replica failing attestation is not trusted anymore, nor is an
+                    # expired session. After other errors (e.g. a timeout), the session
+                    # serves requests until the next attempt, as long as it is healthy.
+                    if isinstance(error, AttestationException) or session.expired:
+                        self._eject(replica, session, error)
+                        continue
+
+                try:
+                    self._check_health(session)
+                except Exception as e:
+                    self._eject(replica, session, e)
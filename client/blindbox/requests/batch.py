@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from requests import exceptions
+from requests.adapters import HTTPAdapter
+
+# Statuses answered by overloaded or restarting servers, worth retrying
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+# Statuses of requests refused before being processed, which any request can be sent again after
+REFUSED_STATUSES = frozenset([429, 503])
+# Methods whose requests can be sent twice with the effect of sending them once (RFC 9110)
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE"])
+
+# Serializes the growth of the connection pools of the sessions
+_pool_lock = threading.Lock()
+
+
+def _normalize(request):
+    """Return (method, endpoint, kwargs) from a request given as a tuple or a dict."""
+    if isinstance(request, dict):
+        kwargs = dict(request)
+        return kwargs.pop("method", "GET"), kwargs.pop("endpoint", ""), kwargs
+    method, endpoint, *rest = request
+    return method, endpoint, dict(rest[0]) if rest else {}
+
+
+def _ensure_pool_size(session, concurrency):
+    """Make sure the connection pool of the session's adapter can hold `concurrency`
+    keep-alive connections, so that no connection is thrown away between requests.
+
+    Only the pool of a plain HTTPAdapter is grown, in place: the adapter, its mount
+    points and its retry configuration are kept, and the pool is never shrunk, which
+    is harmless for the other users of a shared session. Custom adapters are left as
+    they are."""
+    adapter = session.get_adapter(session.base_url.rstrip("/") + "/")
+    if type(adapter) is not HTTPAdapter or adapter._pool_maxsize >= concurrency:
+        return
+    with _pool_lock:
+        if adapter._pool_maxsize < concurrency:
+            poolmanager = adapter.poolmanager
+            adapter.init_poolmanager(adapter._pool_connections, concurrency, block=adapter._pool_block)
+            # The connections in use are closed once released
+            poolmanager.clear()
+
+
+class _Progress:
+    def __init__(self, callback, total):
+        self.callback = callback
+        self.total = total
+        self.done = 0
+        self._lock = threading.Lock()
+
+    def step(self):
+        if self.callback is None:
+            return
+        with self._lock:
+            self.done += 1
+            self.callback(self.done, self.total)
+
+
+def _send(session, request, retries, backoff, retry_non_idempotent):
+    method, endpoint, kwargs = request
+    # Requests which may have been processed are only sent again if that is safe
+    retry_processed = retry_non_idempotent or method.upper() in IDEMPOTENT_METHODS
+    attempt = 0
+    while True:
+        try:
+            response = session.request(method, endpoint, **kwargs)
+        except exceptions.ConnectTimeout:
+            # The request was not sent
+            if attempt >= retries:
+                raise
+        except (exceptions.ConnectionError, exceptions.Timeout):
+            if not retry_processed or attempt >= retries:
+                raise
+        else:
+            statuses = RETRY_STATUSES if retry_processed else REFUSED_STATUSES
+            if response.status_code not in statuses or attempt >= retries:
+                return response
+            response.close()
+        # Exponential backoff, with jitter so that retries are not synchronized
+        time.sleep(backoff * (2 ** attempt) * (0.5 + random.random()))
+        attempt += 1
+
+
+def run_batch(
+    session, requests, concurrency=8, retries=2, backoff=0.5, progress=None, return_exceptions=False, retry_non_idempotent=False
+):
+    """Send many requests over a SecureSession, `concurrency` at a time.
+    Please refer to SecureSession.batch for documentation.
+    """
+    if concurrency < 1:
+        raise ValueError("The batch concurrency must be at least 1")
+    total = len(requests) if hasattr(requests, "__len__") else None
+    progress = _Progress(progress, total)
+    _ensure_pool_size(session, concurrency)
+
+    results = []
+    pending = {}
+    iterator = iter(requests)
+    error = None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            # The iterable is consumed lazily, at most 2 * concurrency requests being queued
+            while error is None and len(pending) < 2 * concurrency:
+                try:
+                    request = _normalize(next(iterator))
+                except StopIteration:
+                    break
+                pending[executor.submit(_send, session, request, retries, backoff, retry_non_idempotent)] = len(results)
+                results.append(None)
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    if not return_exceptions:
+                        # Stop sending, the requests in flight are still waited for
+                        error = e if error is None else error
+                    results[index] = e
+                progress.step()
+
+    if error is not None:
+        raise error
+    return results
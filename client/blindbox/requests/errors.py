@@ -56,3 +56,10 @@ class MAATokenNotFound(AttestationException):
     is unable to find an MAA token.
     """
     pass
+
+class InvalidToken(AttestationException):
+    """
+    This exception is raised when the attestation token is malformed,
+    badly signed, expired, or lacks one of the expected claims.
+    """
+    pass
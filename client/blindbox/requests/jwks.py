@@ -0,0 +1,161 @@
+import base64
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from .errors import AttestationException
+
+
+def _max_age(headers, default_ttl):
+    """Return how long (in seconds) a response can be reused according to its
+    Cache-Control or Expires headers, or default_ttl when there are none."""
+    cache_control = headers.get("Cache-Control", "")
+    for directive in cache_control.lower().split(","):
+        directive = directive.strip()
+        if directive in ("no-cache", "no-store"):
+            return 0.0
+        if directive.startswith("max-age="):
+            try:
+                return max(0.0, float(directive[len("max-age="):]))
+            except ValueError:
+                pass
+
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            expires = parsedate_to_datetime(expires)
+            date = headers.get("Date")
+            now = parsedate_to_datetime(date) if date else None
+            if now is None:
+                return max(0.0, expires.timestamp() - time.time())
+            return max(0.0, (expires - now).total_seconds())
+        except (TypeError, ValueError):
+            return 0.0
+
+    return default_ttl
+
+
+class _KeySet:
+    def __init__(self, keys, expires_at, etag):
+        self.keys = keys
+        self.expires_at = expires_at
+        self.etag = etag
+        self.fetched_at = time.monotonic()
+
+
+class JWKSCache:
+    """A process-wide cache of the signing keys of the attestation services.
+
+    Key sets are downloaded from their `jku` url, and each certificate is parsed
+    into a public key once. A key set is downloaded again when it gets stale
+    according to the HTTP cache headers of the attestation service, or when a
+    token is signed with a `kid` it does not contain (key rotation).
+    """
+
+    def __init__(self, default_ttl: float = 3600.0, min_refresh_interval: float = 30.0):
+        """Create an empty key cache.
+        Args:
+            default_ttl (float): How long key sets are kept when the response
+                carries no cache headers.
+            min_refresh_interval (float): The minimum delay between two downloads
+                of a key set triggered by an unknown `kid`.
+        """
+        self.default_ttl = default_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._key_sets = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, jku: str, kid: str):
+        """Return the public key `kid` of the key set `jku` if it is cached."""
+        with self._lock:
+            key_set = self._key_sets.get(jku)
+        if key_set is None:
+            return None
+        return key_set.keys.get(kid)
+
+    def needs_refresh(self, jku: str, kid: str = None) -> bool:
+        """Whether the key set `jku` should be downloaded to look up `kid`,
+        or to be fresh if `kid` is None."""
+        with self._lock:
+            key_set = self._key_sets.get(jku)
+        if key_set is None:
+            return True
+        now = time.monotonic()
+        if now >= key_set.expires_at:
+            return True
+        if kid is None:
+            return False
+        return kid not in key_set.keys and now - key_set.fetched_at >= self.min_refresh_interval
+
+    def request_headers(self, jku: str) -> dict:
+        """The headers to send to revalidate the key set `jku`."""
+        with self._lock:
+            key_set = self._key_sets.get(jku)
+        if key_set is not None and key_set.etag:
+            return {"If-None-Match": key_set.etag}
+        return {}
+
+    def update(self, jku: str, status_code: int, headers, jwks: dict = None):
+        """Store the response to a download of the key set `jku`."""
+        expires_at = time.monotonic() + _max_age(headers, self.default_ttl)
+        with self._lock:
+            key_set = self._key_sets.get(jku)
+            if status_code == 304:
+                if key_set is not None:
+                    key_set.expires_at = expires_at
+                    key_set.fetched_at = time.monotonic()
+                return
+
+        from cryptography.x509 import load_der_x509_certificate
+
+        keys = {}
+        for jwk in jwks["keys"]:
+            if "kid" in jwk and jwk.get("x5c"):
+                cert_obj = load_der_x509_certificate(base64.b64decode(jwk["x5c"][0]))
+                keys[jwk["kid"]] = cert_obj.public_key()
+
+        with self._lock:
+            self._key_sets[jku] = _KeySet(keys, expires_at, headers.get("ETag"))
+
+    def get_key(self, http, jku: str, kid: str):
+        """Return the public key `kid` of the key set `jku`, downloading
+        the key set with the requests session `http` if needed."""
+        self.prefetch(http, jku, kid)
+        return self._key_or_raise(jku, kid)
+
+    async def get_key_async(self, client, jku: str, kid: str):
+        """Same as get_key, with an httpx.AsyncClient to download the key set."""
+        await self.prefetch_async(client, jku, kid)
+        return self._key_or_raise(jku, kid)
+
+    def prefetch(self, http, jku: str, kid: str = None):
+        """Download the key set `jku` if it is missing, stale or lacks `kid`."""
+        if self.needs_refresh(jku, kid):
+            res = http.request("GET", jku, headers=self.request_headers(jku))
+            self.update(jku, res.status_code, res.headers, res.json() if res.status_code != 304 else None)
+
+    async def prefetch_async(self, client, jku: str, kid: str = None):
+        """Same as prefetch, with an httpx.AsyncClient to download the key set."""
+        if self.needs_refresh(jku, kid):
+            res = await client.get(jku, headers=self.request_headers(jku))
+            self.update(jku, res.status_code, res.headers, res.json() if res.status_code != 304 else None)
+
+    def _key_or_raise(self, jku, kid):
+        public_key = self.lookup(jku, kid)
+        if public_key is None:
+            raise AttestationException(f"Attestation token signed by an unknown key ({kid})")
+        return public_key
+
+    def clear(self):
+        with self._lock:
+            self._key_sets.clear()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+
+
+jwks_cache = JWKSCache()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=jwks_cache._reset)
@@ -0,0 +1,138 @@
+import os
+import secrets
+
+from requests.utils import super_len
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def iter_file(fileobj, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Read a file object in chunks of at most `chunk_size` bytes."""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+
+
+def _iter_bounded(chunks, chunk_size):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        for i in range(0, len(chunk), chunk_size):
+            yield chunk[i:i + chunk_size]
+
+
+def _to_chunks(value, chunk_size):
+    """Return the length (None if unknown) and the chunks of a part of a multipart body."""
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        return len(value), _iter_bounded([value], chunk_size)
+    if hasattr(value, "read"):
+        try:
+            length = super_len(value) or None
+        except (OSError, ValueError):
+            length = None
+        if length is not None and "b" not in getattr(value, "mode", "b"):
+            # The size on disk of a text file is not the size of its encoded content
+            length = None
+        return length, iter_file(value, chunk_size)
+    # A generator or any other iterable of bytes
+    return None, _iter_bounded(value, chunk_size)
+
+
+class MultipartEncoder:
+    """A multipart/form-data body which is streamed rather than built in memory.
+
+    The fields and files are given as with the `data` and `files` arguments of
+    requests. File values can be bytes, file objects or iterables of bytes (a
+    generator for instance), and are read `chunk_size` bytes at a time while the
+    body is sent. The Content-Length of the body is known when the size of every
+    file is, otherwise the body is sent with chunked transfer encoding.
+    """
+
+    def __init__(self, fields=None, files=None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.boundary = secrets.token_hex(16)
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._parts = []
+        self._consumed = False
+
+        for name, value in _items(fields):
+            values = value if isinstance(value, list) else [value]
+            for v in values:
+                if not isinstance(v, (str, bytes)):
+                    v = str(v)
+                self._add_part(name, v)
+
+        for name, value in _items(files):
+            filename, content_type, headers = None, None, {}
+            if isinstance(value, (tuple, list)):
+                if len(value) == 2:
+                    filename, value = value
+                elif len(value) == 3:
+                    filename, value, content_type = value
+                else:
+                    filename, value, content_type, headers = value
+            else:
+                filename = os.path.basename(getattr(value, "name", "") or name)
+            self._add_part(name, value, filename, content_type, headers)
+
+    def _add_part(self, name, value, filename=None, content_type=None, headers=None):
+        disposition = f'form-data; name="{_quote(name)}"'
+        if filename is not None:
+            disposition += f'; filename="{_quote(filename)}"'
+        lines = [f"--{self.boundary}", f"Content-Disposition: {disposition}"]
+        if content_type is not None:
+            lines.append(f"Content-Type: {content_type}")
+        for header, header_value in (headers or {}).items():
+            lines.append(f"{header}: {header_value}")
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+        length, chunks = _to_chunks(value, self.chunk_size)
+        self._parts.append((head, length, chunks))
+
+    @property
+    def len(self):
+        """The length of the body, None if the size of a file is unknown."""
+        total = len(self._tail)
+        for head, length, _ in self._parts:
+            if length is None:
+                return None
+            total += len(head) + length + 2
+        return total
+
+    @property
+    def _tail(self):
+        return f"--{self.boundary}--\r\n".encode("utf-8")
+
+    def __iter__(self):
+        if self._consumed:
+            raise RuntimeError("A streamed multipart body can only be sent once")
+        self._consumed = True
+        for head, _, chunks in self._parts:
+            yield head
+            yield from chunks
+            yield b"\r\n"
+        yield self._tail
+
+
+def _items(fields):
+    if fields is None:
+        return []
+    if hasattr(fields, "items"):
+        return list(fields.items())
+    return list(fields)
+
+
+# Parameters of the Content-Disposition header are escaped the way browsers (and
+# requests) do it, see the multipart/form-data encoding algorithm of HTML5.
+_PARAM_ESCAPES = {ord('"'): "%22", ord("\\"): "\\\\"}
+_PARAM_ESCAPES.update({c: f"%{c:02X}" for c in range(0x20) if c != 0x1B})
+
+
+def _quote(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return value.translate(_PARAM_ESCAPES)
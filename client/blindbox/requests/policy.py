@@ -0,0 +1,74 @@
+import os
+import re
+import threading
+from typing import Union
+
+DIGEST_PREFIX = "sha256:"
+_HEX_DIGEST = re.compile(r"^[0-9a-fA-F]{64}$")
+
+
+def policy_digest(policy: bytes) -> str:
+    """Return the hex SHA-256 digest of a base64 encoded cce policy,
+    as reported in the hostdata field of the attestation report."""
+    import base64
+    import hashlib
+
+    h = hashlib.new("sha256")
+    h.update(base64.b64decode(policy))
+    return h.hexdigest()
+
+
+class PolicyRegistry:
+    """A process-wide registry of the digests of cce policies.
+
+    A policy file is read and hashed once, and hashed again only when it changes
+    on disk (the path, inode, size and modification time are checked). A policy
+    can also be given directly as its precomputed digest: "sha256:<hex digest>".
+    """
+
+    def __init__(self):
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def digest(self, cce_policy: Union[str, os.PathLike]) -> str:
+        """Return the hex digest of a cce policy.
+        Args:
+            cce_policy (str or os.PathLike): The path to a file containing the cce policy (base64 encoded),
+                or the hex SHA-256 digest of the policy prefixed with "sha256:".
+        Returns:
+            str: The hex SHA-256 digest of the policy.
+        """
+        cce_policy = os.fsdecode(cce_policy)
+        if cce_policy.startswith(DIGEST_PREFIX):
+            digest = cce_policy[len(DIGEST_PREFIX):]
+            if not _HEX_DIGEST.match(digest):
+                raise ValueError(f"Invalid cce policy digest: {cce_policy}")
+            return digest.lower()
+
+        path = os.path.abspath(cce_policy)
+        st = os.stat(path)
+        version = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        with open(path, "rb") as f:
+            digest = policy_digest(f.read())
+        with self._lock:
+            self._digests[path] = (version, digest)
+        return digest
+
+    def clear(self):
+        with self._lock:
+            self._digests.clear()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+
+
+policy_registry = PolicyRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=policy_registry._reset)
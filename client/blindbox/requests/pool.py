@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+
+from .policy import policy_registry
+from .secure_session import SecureSession
+
+
+def _policy_key(cce_file):
+    if not cce_file:
+        return None
+    try:
+        return policy_registry.digest(cce_file)
+    except (OSError, ValueError):
+        # The session creation fails with the appropriate error
+        return None
+
+
+# Pooled sessions are shared by every caller, so they must not keep the cookies
+# set by a response, which would be sent along with the requests of other callers
+_REJECT_ALL_COOKIES = DefaultCookiePolicy(allowed_domains=[])
+
+
+class _PoolEntry:
+    def __init__(self, session: SecureSession, now: float):
+        self.session = session
+        self.created_at = now
+        self.last_used = now
+
+
+class SessionPool:
+    """A process-wide pool of attested SecureSession instances.
+
+    Sessions are keyed by (base URL, cce policy digest, attester), so that the
+    attestation of a BlindBox is performed once and then reused by every
+    request sent to it, instead of being run again for each call. Pooled
+    sessions reject the cookies set by responses, as they are shared by callers.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 32,
+        idle_timeout: float = 300.0,
+        max_age: float = 3600.0,
+    ):
+        """Create an empty session pool.
+        Args:
+            max_size (int): The maximum number of sessions kept in the pool.
+                The least recently used session is closed when it is exceeded.
+            idle_timeout (float): Sessions unused for this many seconds are closed.
+            max_age (float): Sessions older than this many seconds, or whose
+                attestation token has expired, are closed and the BlindBox is
+                attested again on the next request.
+        """
+        if max_size < 1:
+            raise ValueError("The pool max_size must be at least 1")
+
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def session(
+        self,
+        addr: str,
+        cce_file: str = None,
+        attestation_endpoint: str = "sharedeus2.eus2.test.attest.azure.net",
+        debug_mode: bool = False,
+    ) -> SecureSession:
+        """Return an attested session to the BlindBox, creating it if needed.
+        Args:
+            addr (str): The address of the BlindBox service.
+            cce_file (str): The path to the file containing the cce policy (base64 encoded),
+                or its digest ("sha256:<hex digest>").
+            attestation_endpoint (str): The url of the MAA attestation endpoint.
+            debug_mode (bool): Whether to bypass attestation. MUST NOT be used in production.
+        Returns:
+            SecureSession: A session shared with the other users of the pool.
+        """
+        key = (addr, _policy_key(cce_file), attestation_endpoint, debug_mode)
+        evicted = []
+
+        with self._lock:
+            session = self._lookup(key, evicted)
+            if session is None:
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Attest outside of the pool lock, so that a slow BlindBox
+        # does not hold back requests sent to the other ones.
+        if session is None:
+            with key_lock:
+                with self._lock:
+                    session = self._lookup(key, evicted)
+
+                if session is None:
+                    session = SecureSession(addr, cce_file, attestation_endpoint, debug_mode)
+                    session.cookies.set_policy(_REJECT_ALL_COOKIES)
+                    with self._lock:
+                        self._insert(key, session, evicted)
+                        self._key_locks.pop(key, None)
+
+        for old in evicted:
+            old.close()
+        return session
+
+    def clear(self):
+        """Close every session of the pool."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.session.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key, evicted):
+        # Must be called with self._lock held
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry, now):
+            del self._entries[key]
+            evicted.append(entry.session)
+            return None
+        entry.last_used = now
+        self._entries.move_to_end(key)
+        return entry.session
+
+    def _insert(self, key, session, evicted):
+        # Must be called with self._lock held
+        now = time.monotonic()
+        for old_key, entry in list(self._entries.items()):
+            if self._expired(entry, now):
+                del self._entries[old_key]
+                evicted.append(entry.session)
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            evicted.append(previous.session)
+        self._entries[key] = _PoolEntry(session, now)
+
+        while len(self._entries) > self.max_size:
+            _, entry = self._entries.popitem(last=False)
+            evicted.append(entry.session)
+
+    def _expired(self, entry, now):
+        return (
+            now - entry.last_used > self.idle_timeout
+            or now - entry.created_at > self.max_age
+            or entry.session.expired
+        )
+
+    def _reset(self):
+        # Connections inherited through fork() are shared with the parent
+        # process and must not be reused by the child.
+        self._entries = OrderedDict()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+
+default_pool = SessionPool()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=default_pool._reset)
@@ -1,4 +1,6 @@
-from .secure_session import SecureSession
+from contextlib import contextmanager
+from .pool import default_pool
+from .multipart import DEFAULT_CHUNK_SIZE
 from urllib.parse import urlparse
 
 DEFAULT_ATTESTER = "sharedeus2.eus2.test.attest.azure.net"
@@ -12,7 +14,7 @@ def _parse_url(url):
 def post(url, cce_policy, attestation_endpoint=None, data=None, json=None, **kwargs):
     r"""Sends a POST request. Returns :class:`Response` object.
     :param url: URL for the new :class:`Request` object.
-    :param cce_policy: path to file containing cce policy (base64 encoded)
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
     :param attestation_endpoint: (optional) attestation service uri
     :param data: (optional) Dictionary, list of tuples, bytes, or file-like
          object to send in the body of the :class:`Request`.
@@ -23,14 +25,14 @@ def post(url, cce_policy, attestation_endpoint=None, data=None, json=None, **kwa
 
     root, endpoint = _parse_url(url)
     attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
-    with SecureSession(root,cce_policy,attestation_endpoint) as secure_session:
-        return secure_session.post(endpoint, data, json, **kwargs)
+    secure_session = default_pool.session(root, cce_policy, attestation_endpoint)
+    return secure_session.post(endpoint, data, json, **kwargs)
 
 
 def get(url, cce_policy, attestation_endpoint=None, **kwargs):
     r"""Sends a GET request. Returns :class:`Response` object.
     :param url: URL for the new :class:`Request` object.
-    :param cce_policy: path to file containing cce policy (base64 encoded)
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
     :param attestation_endpoint: (optional) attestation service uri
     :param \*\*kwargs: Optional arguments that ``request`` takes.
     :rtype: requests.Response
@@ -38,14 +40,14 @@ def get(url, cce_policy, attestation_endpoint=None, **kwargs):
     
     root, endpoint = _parse_url(url)
     attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
-    with SecureSession(root,cce_policy,attestation_endpoint) as secure_session:
-        return secure_session.get(endpoint, **kwargs)
+    secure_session = default_pool.session(root, cce_policy, attestation_endpoint)
+    return secure_session.get(endpoint, **kwargs)
     
 
 def options(url, cce_policy, attestation_endpoint=None, **kwargs):
     r"""Sends a OPTIONS request. Returns :class:`Response` object.
     :param url: URL for the new :class:`Request` object.
-    :param cce_policy: path to file containing cce policy (base64 encoded)
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
     :param attestation_endpoint: (optional) attestation service uri
     :param \*\*kwargs: Optional arguments that ``request`` takes.
     :rtype: requests.Response
@@ -53,14 +55,14 @@ def options(url, cce_policy, attestation_endpoint=None, **kwargs):
 
     root, endpoint = _parse_url(url)
     attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
-    with SecureSession(root,cce_policy,attestation_endpoint) as secure_session:
-        return secure_session.options(endpoint, **kwargs)
+    secure_session = default_pool.session(root, cce_policy, attestation_endpoint)
+    return secure_session.options(endpoint, **kwargs)
 
 
 def head(url, cce_policy, attestation_endpoint=None, **kwargs):
     r"""Sends a HEAD request. Returns :class:`Response` object.
     :param url: URL for the new :class:`Request` object.
-    :param cce_policy: path to file containing cce policy (base64 encoded)
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
     :param attestation_endpoint: (optional) attestation service uri
     :param \*\*kwargs: Optional arguments that ``request`` takes.
     :rtype: requests.Response
@@ -68,13 +70,13 @@ def head(url, cce_policy, attestation_endpoint=None, **kwargs):
 
     root, endpoint = _parse_url(url)
     attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
-    with SecureSession(root,cce_policy,attestation_endpoint) as secure_session:
-        return secure_session.head(endpoint, **kwargs)
+    secure_session = default_pool.session(root, cce_policy, attestation_endpoint)
+    return secure_session.head(endpoint, **kwargs)
     
 def put(url, cce_policy, attestation_endpoint=None, data=None, **kwargs):
     r"""Sends a PUT request. Returns :class:`Response` object.
     :param url: URL for the new :class:`Request` object.
-    :param cce_policy: path to file containing cce policy (base64 encoded)
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
     :param attestation_endpoint: (optional) attestation service uri
     :param data: (optional) Dictionary, list of tuples, bytes, or file-like
         object to send in the body of the :class:`Request`.
@@ -84,13 +86,13 @@ def put(url, cce_policy, attestation_endpoint=None, data=None, **kwargs):
 
     root, endpoint = _parse_url(url)
     attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
-    with SecureSession(root,cce_policy,attestation_endpoint) as secure_session:
-        return secure_session.put(endpoint, data=data, **kwargs)
+    secure_session = default_pool.session(root, cce_policy, attestation_endpoint)
+    return secure_session.put(endpoint, data=data, **kwargs)
     
 def patch(url, cce_policy, attestation_endpoint=None, data=None, **kwargs):
     r"""Sends a PATCH request. Returns :class:`Response` object.
     :param url: URL for the new :class:`Request` object.
-    :param cce_policy: path to file containing cce policy (base64 encoded)
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
     :param attestation_endpoint: (optional) attestation service uri
     :param data: (optional) Dictionary, list of tuples, bytes, or file-like
         object to send in the body of the :class:`Request`.
@@ -100,13 +102,13 @@ def patch(url, cce_policy, attestation_endpoint=None, data=None, **kwargs):
 
     root, endpoint = _parse_url(url)
     attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
-    with SecureSession(root,cce_policy,attestation_endpoint) as secure_session:
-        return secure_session.patch(endpoint, data=data, **kwargs)
+    secure_session = default_pool.session(root, cce_policy, attestation_endpoint)
+    return secure_session.patch(endpoint, data=data, **kwargs)
     
 def delete(url, cce_policy, attestation_endpoint=None, **kwargs):
     r"""Sends a DELETE request. Returns :class:`Response` object.
     :param url: URL for the new :class:`Request` object.
-    :param cce_policy: path to file containing cce policy (base64 encoded)
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
     :param attestation_endpoint: (optional) attestation service uri
     :param \*\*kwargs: Optional arguments that ``request`` takes.
     :rtype: requests.Response
@@ -114,5 +116,43 @@ def delete(url, cce_policy, attestation_endpoint=None, **kwargs):
 
     root, endpoint = _parse_url(url)
     attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
-    with SecureSession(root,cce_policy,attestation_endpoint) as secure_session:
-        return secure_session.delete(endpoint, **kwargs)
\ No newline at end of file
+    secure_session = default_pool.session(root, cce_policy, attestation_endpoint)
+    return secure_session.delete(endpoint, **kwargs)
+
+
+@contextmanager
+def streaming(method, url, cce_policy, attestation_endpoint=None, **kwargs):
+    r"""Sends a request whose response body is streamed. The response is closed when
+    leaving the context. Read its body with ``response.iter_content(chunk_size)``.
+    :param method: method for the new :class:`Request` object.
+    :param url: URL for the new :class:`Request` object.
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
+    :param attestation_endpoint: (optional) attestation service uri
+    :param \*\*kwargs: Optional arguments that ``request`` takes.
+    :rtype: requests.Response
+    """
+
+    root, endpoint = _parse_url(url)
+    attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
+    secure_session = default_pool.session(root, cce_policy, attestation_endpoint)
+    with secure_session.streaming(method, endpoint, **kwargs) as response:
+        yield response
+
+
+def download(url, cce_policy, fileobj, attestation_endpoint=None, method="GET", chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+    r"""Writes the response body of a request to a file object, ``chunk_size`` bytes at a time.
+    Returns :class:`Response` object.
+    :param url: URL for the new :class:`Request` object.
+    :param cce_policy: path to file containing cce policy (base64 encoded), or its digest ("sha256:<hex digest>")
+    :param fileobj: binary file object the body is written to.
+    :param attestation_endpoint: (optional) attestation service uri
+    :param method: (optional) method for the new :class:`Request` object.
+    :param chunk_size: (optional) maximum number of bytes held in memory.
+    :param \*\*kwargs: Optional arguments that ``request`` takes.
+    :rtype: requests.Response
+    """
+
+    root, endpoint = _parse_url(url)
+    attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
+    secure_session = default_pool.session(root, cce_policy, attestation_endpoint)
+    return secure_session.download(endpoint, fileobj, method, chunk_size, **kwargs)
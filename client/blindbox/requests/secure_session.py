@@ -1,7 +1,15 @@
 from requests import Session, exceptions
+import threading
+import time
 import warnings
+from contextlib import contextmanager
 from urllib.parse import urljoin
+from .batch import run_batch
+from .attestation_cache import AttestationVerdict, attestation_cache
 from .errors import *
+from .jwks import jwks_cache
+from .policy import policy_digest, policy_registry
+from .multipart import DEFAULT_CHUNK_SIZE, MultipartEncoder
 
 class BlindBoxDebugModeWarning(Warning):
     pass
@@ -15,14 +23,16 @@ class SecureSession(Session):
         cce_file: str = None,
         attestation_endpoint: str = "sharedeus2.eus2.test.attest.azure.net",
         debug_mode: bool = False,
+        use_cache: bool = True,
     ):
         """Connect to a BlindBox service.
         Please refer to the connect function for documentation.
         Args:
             addr (str):
-            cce_file (str):
+            cce_file (str): The path to the cce policy file, or its digest ("sha256:<hex digest>").
             attestation_endpoint (str):
             debug_mode (bool):
+            use_cache (bool): Whether a cached attestation verdict can be reused.
         Returns:
         """
 
@@ -33,6 +43,10 @@ class SecureSession(Session):
 
         self.base_url = addr
         self.jwt = ""
+        self.expires_at = None
+        self.attestation_timings = {}
+        # Size of the chunks in which uploaded files are read
+        self.chunk_size = DEFAULT_CHUNK_SIZE
 
         if debug_mode:
             warnings.warn(
@@ -50,12 +64,13 @@ class SecureSession(Session):
         if not debug_mode:
             if not cce_file:
                 raise exceptions.ContentDecodingError("A cce policy needs to be provided when you are not using the debug mode")
+            start = time.perf_counter()
             try:
-                policy = open(cce_file,"rb")
-                policy = policy.read()
-            except:
+                cce_policy = policy_registry.digest(cce_file)
+            except (OSError, TypeError, ValueError):
                 raise exceptions.ContentDecodingError("Unable to read cce policy")
-            self.attestation(policy, attestation_endpoint)
+            timings = {"policy_digest": time.perf_counter() - start}
+            self._attestation(cce_policy, attestation_endpoint, use_cache, timings)
 
     def get(self, endpoint: str = "", **kwargs):
         r"""Sends a GET request. Returns :class:`Response` object.
@@ -141,9 +156,105 @@ class SecureSession(Session):
 
     def request(self, method, endpoint, *args, **kwargs):
         joined_url = urljoin(self.base_url, endpoint)
+        if kwargs.get("files") and _is_form(kwargs.get("data")):
+            # Files are streamed from disk rather than encoded in memory
+            body = MultipartEncoder(kwargs.pop("data", None), kwargs.pop("files"), self.chunk_size)
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers.setdefault("Content-Type", body.content_type)
+            kwargs.update(data=body, headers=headers)
         return super().request(method, joined_url, *args, **kwargs)
 
-    def attestation(self, policy, attestation_endpoint):
+    @contextmanager
+    def streaming(self, method, endpoint, **kwargs):
+        r"""Sends a request whose response body is streamed. The response is closed,
+        and its connection released, when leaving the context.
+
+        Iterate over the body with ``response.iter_content(chunk_size)`` to read at
+        most ``chunk_size`` bytes at a time, or save it with :meth:`download`.
+
+        :param method: method for the new :class:`Request` object.
+        :param endpoint: URL endpoint for the new :class:`Request` object.
+        :param \*\*kwargs: Optional arguments that ``request`` takes.
+        :rtype: requests.Response
+        """
+
+        response = self.request(method, endpoint, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
+
+    def download(self, endpoint: str, fileobj, method: str = "GET", chunk_size: int = DEFAULT_CHUNK_SIZE, **kwargs):
+        r"""Writes the response body of a request to a file object, ``chunk_size`` bytes
+        at a time. Returns the :class:`Response` object, whose body has been consumed.
+
+        :param endpoint: URL endpoint for the new :class:`Request` object.
+        :param fileobj: binary file object the body is written to.
+        :param method: (optional) method for the new :class:`Request` object.
+        :param chunk_size: (optional) maximum number of bytes held in memory.
+        :param \*\*kwargs: Optional arguments that ``request`` takes.
+        :rtype: requests.Response
+        """
+
+        with self.streaming(method, endpoint, **kwargs) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size):
+                fileobj.write(chunk)
+        return response
+
+    def batch(
+        self,
+        requests,
+        concurrency: int = 8,
+        retries: int = 2,
+        backoff: float = 0.5,
+        progress=None,
+        return_exceptions: bool = False,
+        retry_non_idempotent: bool = False,
+    ):
+        """Send many requests to the BlindBox, `concurrency` at a time, over keep-alive connections.
+        Args:
+            requests (iterable): The requests, as (method, endpoint, kwargs) tuples or as
+                dicts of the arguments of `request` ("method", "endpoint" and its kwargs).
+                The iterable is consumed lazily.
+            concurrency (int): The maximum number of requests in flight. The connection pool
+                of the session is grown to keep as many connections alive, unless the
+                session uses a custom adapter.
+            retries (int): How many times a request is sent again after a connection error,
+                a timeout or a 429, 502, 503 or 504 response. Requests with a method which
+                is not idempotent, such as POST, are only sent again when they were not
+                processed: after a connection timeout or a 429 or 503 response.
+            backoff (float): The delay before the first retry, doubled at each attempt.
+            progress (callable): (optional) Called with (done, total) each time a request
+                completes. total is None when the number of requests is unknown.
+            return_exceptions (bool): Whether the exception of a failed request is returned
+                in its slot of the results. Otherwise no new request is sent after a
+                failure, and the exception is raised once the requests in flight complete.
+            retry_non_idempotent (bool): Whether requests which are not idempotent are sent
+                again as the idempotent ones are, when the endpoint tolerates duplicates.
+        Returns:
+            list: The responses, in the order of the requests.
+        """
+        return run_batch(self, requests, concurrency, retries, backoff, progress, return_exceptions, retry_non_idempotent)
+
+    def map(self, method, endpoint, items, **kwargs):
+        """Send the same request once per item, with the item's arguments.
+        For instance `session.map("POST", "/predict", ({"json": row} for row in rows))`.
+        Args:
+            method (str): The method of the requests.
+            endpoint (str): The endpoint of the requests.
+            items (iterable): The kwargs of `request` for each request.
+            **kwargs: The arguments of `batch`.
+        Returns:
+            list: The responses, in the order of the items.
+        """
+        if hasattr(items, "__len__"):
+            requests = _SizedRequests(method, endpoint, items)
+        else:
+            requests = ((method, endpoint, item) for item in items)
+        return self.batch(requests, **kwargs)
+
+    def attestation(self, policy, attestation_endpoint, use_cache: bool = True):
         """
         The attestation is performed as follows:
         1) A nonce is generated.
@@ -152,68 +263,196 @@ class SecureSession(Session):
         4) The token is a JWT which is decoded and validated using certificates from the MAA endpoint.
         5) If the validation of the JWT passes, the attestation report is validated by the MAA.
         6) The values in the attestation report are verified against the expected values.
+
+        Unless use_cache is False, the verdict of a previous attestation of the same
+        blindbox is reused until its token expires (see AttestationCache).
+
+        The keys of the MAA are downloaded while the token is requested. The duration
+        of each step, in seconds, is recorded in the attestation_timings attribute.
         """
 
-        import base64
-        import hashlib
-        import json
-        import jwt
-        import secrets
+        start = time.perf_counter()
+        cce_policy = policy_digest(policy)
+        timings = {"policy_digest": time.perf_counter() - start}
+        self._attestation(cce_policy, attestation_endpoint, use_cache, timings)
+
+    def _attestation(self, cce_policy, attestation_endpoint, use_cache, timings):
+        total_start = time.perf_counter() - timings.get("policy_digest", 0.0)
+        key = (self.base_url, cce_policy, attestation_endpoint)
+        base_url = self.base_url
+
+        verdict = None
+        if use_cache:
+            start = time.perf_counter()
+            verdict = attestation_cache.get(
+                key,
+                refresh=lambda: _refresh_verdict(base_url, cce_policy, attestation_endpoint),
+                revalidate=lambda v: _verify_token(self, v.token, attestation_endpoint, cce_policy, v.nonce),
+            )
+            timings["cache"] = time.perf_counter() - start
+
+        if verdict is None:
+            verdict = _attest(self, self.base_url, cce_policy, attestation_endpoint, timings)
+            if use_cache:
+                attestation_cache.put(key, verdict)
+            print("Attestation validated")
 
-        decoded_policy = base64.b64decode(policy)
-        h = hashlib.new('sha256')
-        h.update(decoded_policy)
-        cce_policy = h.hexdigest()
+        timings["total"] = time.perf_counter() - total_start
+        self.attestation_timings = timings
+        self.jwt = verdict.token
+        self.expires_at = verdict.expires_at
 
-        nonce = {"nonce":secrets.token_hex(16)}
-        b64nonce = base64.b64encode(json.dumps(nonce).encode()).decode()
+    @property
+    def expired(self) -> bool:
+        """Whether the attestation token of the session has expired."""
+        return self.expires_at is not None and time.time() >= self.expires_at
 
-        # Make a request to the attestation service for an MAA token
-        attest_url = ":".join(self.base_url.split(":")[:-1])
-        res = super().request("POST",f"{attest_url}:8080/attest/maa", json={"maa_endpoint":attestation_endpoint,"runtime_data":b64nonce})
-        if res.status_code == 404:
-            raise MAATokenNotFound(f"Failed to obtain MMA token from {attest_url}:8080/attest/maa")
-        maa_token = json.loads(res.content)["token"]
-        header = maa_token.split(".")[0]
 
-        # Ensure header is appropriate length to be base64 decoded
-        if len(header)%4 != 0:
-            header += "="*(len(header)%4)
+class _SizedRequests:
+    """The requests of SecureSession.map, keeping the number of items for progress reports."""
 
-        header = json.loads(base64.b64decode(header))
-        kid = header["kid"]
-        if header["jku"] != f"https://{attestation_endpoint}/certs":
-            raise WrongAttester("Attestation token not generated by expected attester")
+    def __init__(self, method, endpoint, items):
+        self.method, self.endpoint, self.items = method, endpoint, items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return ((self.method, self.endpoint, item) for item in self.items)
 
-        jwt_certs = self.request("GET",header["jku"]).json()
 
-        for iter in jwt_certs["keys"]:
-            if iter["kid"] == kid:
-                x5c = iter["x5c"][0] #Wrap cert as pem
-                x5c = "-----BEGIN CERTIFICATE-----" + x5c + "-----END CERTIFICATE-----"
+def _is_form(data) -> bool:
+    return data is None or isinstance(data, (dict, list, tuple)) or hasattr(data, "items")
 
-        from cryptography.x509 import load_pem_x509_certificate
 
-        cert_obj = load_pem_x509_certificate(x5c.encode())
-        public_key = cert_obj.public_key()
+def _token_request(base_url, attestation_endpoint, nonce):
+    """Return the url and json body of the request for an MAA token."""
+    import base64
+    import json
 
-        # Decodes jwt and validates signature and expiry
+    b64nonce = base64.b64encode(json.dumps(nonce).encode()).decode()
+    attest_url = ":".join(base_url.split(":")[:-1])
+    return f"{attest_url}:8080/attest/maa", {"maa_endpoint":attestation_endpoint,"runtime_data":b64nonce}
+
+
+def _parse_token_response(url, status_code, content):
+    import json
+
+    if status_code == 404:
+        raise MAATokenNotFound(f"Failed to obtain MMA token from {url}")
+    return json.loads(content)["token"]
+
+
+def _request_token(http, base_url, attestation_endpoint, nonce):
+    # Make a request to the attestation service for an MAA token
+    url, body = _token_request(base_url, attestation_endpoint, nonce)
+    res = http.request("POST", url, json=body)
+    return _parse_token_response(url, res.status_code, res.content)
+
+
+def _token_header(maa_token, attestation_endpoint):
+    """Return the (jku, kid) of the key which signed the token."""
+    import base64
+    import json
+
+    header = maa_token.split(".")[0]
+
+    # Ensure header is appropriate length to be base64 decoded
+    if len(header)%4 != 0:
+        header += "="*(len(header)%4)
+
+    try:
+        header = json.loads(base64.b64decode(header))
+        jku, kid = header["jku"], header["kid"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidToken(f"Attestation validation failed (malformed token header: {e!r}). Exiting.") from e
+    if jku != f"https://{attestation_endpoint}/certs":
+        raise WrongAttester("Attestation token not generated by expected attester")
+    return jku, kid
+
+
+def _check_claims(maa_token, public_key, cce_policy, nonce):
+    import jwt
+
+    # Decodes jwt and validates signature and expiry. Tokens which fail these
+    # checks, or lack a claim, are attestation failures like the checks below.
+    try:
         payload = jwt.decode(maa_token,public_key,algorithms=["RS256"],)
+        return _check_payload(payload, cce_policy, nonce)
+    except jwt.PyJWTError as e:
+        raise InvalidToken(f"Attestation validation failed ({e}). Exiting.") from e
+    except KeyError as e:
+        raise InvalidToken(f"Attestation validation failed (missing claim {e}). Exiting.") from e
+
+
+def _check_payload(payload, cce_policy, nonce):
+    # Add further checks for issued at time (iat) and issuer (iss)
+    if payload["x-ms-attestation-type"] != "sevsnpvm":
+        raise NotAnEnclaveError("Attestation validation failed (not sev-snp report). Exiting.")
+    if payload["x-ms-compliance-status"] != "azure-compliant-uvm":
+        raise NonCompliantUvm("Attestation validation failed (non-compliant uvm). Exiting.")
+    if payload["x-ms-sevsnpvm-hostdata"] != cce_policy:
+        raise InvalidEnclaveCode("Attestation validation failed (cce policy mismatch). Exiting.")
+    if payload["x-ms-runtime"] != nonce:
+        raise FalseAttestationReport("Attestation validation failed (nonce mismatch). Exiting.")
+    if payload["x-ms-sevsnpvm-is-debuggable"] == "false":
+        raise DebugMode("Attestation validation failed (enclave is in debug mode). Exiting.")
+
+    return payload
+
+
+def _verify_token(http, maa_token, attestation_endpoint, cce_policy, nonce):
+    jku, kid = _token_header(maa_token, attestation_endpoint)
+    public_key = jwks_cache.get_key(http, jku, kid)
+    return _check_claims(maa_token, public_key, cce_policy, nonce)
+
+
+def _new_nonce():
+    import secrets
+
+    return {"nonce":secrets.token_hex(16)}
+
+
+def _attest(http, base_url, cce_policy, attestation_endpoint, timings=None) -> AttestationVerdict:
+    timings = {} if timings is None else timings
+    nonce = _new_nonce()
+
+    # The signing keys of the expected attester are downloaded while
+    # the BlindBox is requesting its token from the attestation service.
+    def prefetch():
+        start = time.perf_counter()
+        try:
+            jwks_cache.prefetch(http, f"https://{attestation_endpoint}/certs")
+        except Exception:
+            # The keys are downloaded again, and the error raised, on verification
+            pass
+        timings["jwks"] = time.perf_counter() - start
+
+    prefetch_thread = threading.Thread(target=prefetch, daemon=True)
+    prefetch_thread.start()
+
+    start = time.perf_counter()
+    try:
+        maa_token = _request_token(http, base_url, attestation_endpoint, nonce)
+        timings["token"] = time.perf_counter() - start
+    finally:
+        prefetch_thread.join()
+
+    start = time.perf_counter()
+    payload = _verify_token(http, maa_token, attestation_endpoint, cce_policy, nonce)
+    timings["verify"] = time.perf_counter() - start
+    return AttestationVerdict.from_payload(maa_token, payload, nonce)
+
+
+def _refresh_verdict(base_url, cce_policy, attestation_endpoint) -> AttestationVerdict:
+    # Background renewals must not share the connections of a user session
+    with Session() as http:
+        return _attest(http, base_url, cce_policy, attestation_endpoint)
+
 
-        # Add further checks for issued at time (iat) and issuer (iss)
-        if payload["x-ms-attestation-type"] != "sevsnpvm":
-            raise NotAnEnclaveError("Attestation validation failed (not sev-snp report). Exiting.")
-        if payload["x-ms-compliance-status"] != "azure-compliant-uvm":
-            raise NonCompliantUvm("Attestation validation failed (non-compliant uvm). Exiting.")
-        if payload["x-ms-sevsnpvm-hostdata"] != cce_policy:
-            raise InvalidEnclaveCode("Attestation validation failed (cce policy mismatch). Exiting.")
-        if payload["x-ms-runtime"] != nonce:
-            raise FalseAttestationReport("Attestation validation failed (nonce mismatch). Exiting.")
-        if payload["x-ms-sevsnpvm-is-debuggable"] == "false":
-            raise DebugMode("Attestation validation failed (enclave is in debug mode). Exiting.")
-
-        self.jwt = maa_token
-        print("Attestation validated")
+def _revalidate_verdict(verdict, cce_policy, attestation_endpoint):
+    with Session() as http:
+        _verify_token(http, verdict.token, attestation_endpoint, cce_policy, verdict.nonce)
 
 
 def connect(addr: str, cce_file: str, attestation_endpoint: str = "sharedeus2.eus2.test.attest.azure.net", debug_mode: bool = False) -> SecureSession:
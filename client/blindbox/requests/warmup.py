@@ -0,0 +1,45 @@
+import importlib
+
+from .pool import default_pool
+from .requests import DEFAULT_ATTESTER, _parse_url
+
+# The modules imported by the first attestation
+_CRYPTO_MODULES = [
+    "base64",
+    "hashlib",
+    "json",
+    "secrets",
+    "jwt",
+    "cryptography.x509",
+    "cryptography.hazmat.primitives.asymmetric.rsa",
+]
+_ASYNC_MODULES = ["httpx", "h2", "blindbox.requests.async_session", "blindbox.requests.async_requests"]
+
+
+def warmup(urls=(), cce_policy=None, attestation_endpoint=None, asynchronous=False):
+    """Preload what the first request to a BlindBox needs, to do it while a service boots
+    rather than in the latency of its first user request.
+
+    The crypto modules used by the attestation are imported, and the BlindBoxes given in
+    `urls` are attested, their sessions being put in the default pool used by the
+    module-level verbs.
+    Args:
+        urls (list): (optional) The urls of the BlindBoxes to attest.
+        cce_policy (str): The path to the cce policy file of the BlindBoxes, or its digest.
+        attestation_endpoint (str): (optional) The url of the MAA attestation endpoint.
+        asynchronous (bool): Whether to also import the asyncio client and its HTTP stack.
+    """
+    for module in _CRYPTO_MODULES:
+        importlib.import_module(module)
+    if asynchronous:
+        for module in _ASYNC_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                # h2 is optional
+                pass
+
+    attestation_endpoint = attestation_endpoint or DEFAULT_ATTESTER
+    for url in urls:
+        root, _ = _parse_url(url)
+        default_pool.session(root, cce_policy, attestation_endpoint)
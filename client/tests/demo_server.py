@@ -8,6 +8,14 @@ async def get_enclave(request):
     print(text)
     return web.Response(text=text)
 
+@routes.get('/enclave/cookie')
+async def get_cookie(request):
+    text = "[GET] /enclave/cookie : Server response"
+    print(text)
+    response = web.Response(text=text)
+    response.set_cookie("session_id", "secret")
+    return response
+
 @routes.options('/enclave')
 async def options_enclave(request):
     text = "[OPTIONS] /enclave : Server response"
@@ -27,6 +35,42 @@ async def post_predict(request):
     print(text, ": receiving:", data['audio'].filename)
     return web.Response(text=text)
 
+@routes.post('/enclave/upload')
+async def post_upload(request):
+    # Echoes the size of every uploaded part, reading them chunk by chunk
+    reader = await request.multipart()
+    sizes = {}
+    async for part in reader:
+        size = 0
+        while True:
+            chunk = await part.read_chunk()
+            if not chunk:
+                break
+            size += len(chunk)
+        sizes[part.name] = [part.filename, size]
+    return web.json_response({"sizes": sizes, "chunked": request.headers.get("Transfer-Encoding") == "chunked"})
+
+@routes.get('/enclave/download')
+async def get_download(request):
+    size = int(request.query["size"])
+    response = web.StreamResponse()
+    await response.prepare(request)
+    for i in range(0, size, 1 << 20):
+        await response.write(b"x" * min(1 << 20, size - i))
+    await response.write_eof()
+    return response
+
+attempts = {}
+
+@routes.post('/enclave/echo')
+async def post_echo(request):
+    # Fails the first attempt of the requests asking for it
+    data = await request.json()
+    attempts[data["id"]] = attempts.get(data["id"], 0) + 1
+    if data.get("flaky") and attempts[data["id"]] == 1:
+        return web.Response(status=503)
+    return web.json_response({"id": data["id"], "attempts": attempts[data["id"]]})
+
 @routes.put('/enclave')
 async def put_enclave(request):
     data = await request.post()
@@ -0,0 +1,157 @@
+import unittest
+import asyncio
+import base64
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import time
+import warnings
+import httpx
+import jwt
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from blindbox.requests.async_session import AsyncSecureSession
+from blindbox.requests.async_requests import AsyncSessionPool
+from blindbox.requests.errors import InvalidEnclaveCode
+from blindbox.requests.jwks import jwks_cache
+from blindbox.requests.secure_session import BlindBoxDebugModeWarning
+
+
+SERVER_URL = "localhost"
+SERVER_PORT = 8080
+ATTESTER = "sampleAttester.eus.attest.azure.net"
+POLICY = b"package policy"
+
+
+class FakeMAA:
+    """Answers the attestation requests of a session with a signed MAA token."""
+
+    def __init__(self, hostdata):
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "maa")])
+        cert = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(self.key.public_key())
+            .serial_number(1)
+            .not_valid_before(datetime.datetime(2020, 1, 1))
+            .not_valid_after(datetime.datetime(2040, 1, 1))
+            .sign(self.key, hashes.SHA256())
+        )
+        self.x5c = base64.b64encode(cert.public_bytes(serialization.Encoding.DER)).decode()
+        self.hostdata = hostdata
+        self.paths = []
+
+    def __call__(self, request):
+        self.paths.append(request.url.path)
+        if request.url.path == "/attest/maa":
+            body = json.loads(request.content)
+            now = int(time.time())
+            payload = {
+                "x-ms-attestation-type": "sevsnpvm",
+                "x-ms-compliance-status": "azure-compliant-uvm",
+                "x-ms-sevsnpvm-hostdata": self.hostdata,
+                "x-ms-runtime": json.loads(base64.b64decode(body["runtime_data"])),
+                "x-ms-sevsnpvm-is-debuggable": False,
+                "iat": now,
+                "exp": now + 3600,
+            }
+            headers = {"kid": "k1", "jku": f"https://{body['maa_endpoint']}/certs"}
+            token = jwt.encode(payload, self.key, algorithm="RS256", headers=headers)
+            return httpx.Response(200, json={"token": token})
+        if request.url.path == "/certs":
+            return httpx.Response(200, json={"keys": [{"kid": "k1", "x5c": [self.x5c]}]})
+        return httpx.Response(200, text="[GET] /enclave : Server response")
+
+
+class TestBlindBoxAsyncSecureSession(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        warnings.simplefilter("ignore", BlindBoxDebugModeWarning)
+        jwks_cache.clear()
+        fd, self.policy_file = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as f:
+            f.write(base64.b64encode(POLICY))
+
+    def tearDown(self):
+        os.remove(self.policy_file)
+
+    async def test_get_method(self):
+        async with AsyncSecureSession(f"http://{SERVER_URL}:{SERVER_PORT}", debug_mode=True) as session:
+            response = await session.get("/enclave")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.text, "[GET] /enclave : Server response")
+
+    async def test_attestation(self):
+        maa = FakeMAA(hashlib.sha256(POLICY).hexdigest())
+        session = AsyncSecureSession(
+            "http://enclave:8000", self.policy_file, ATTESTER,
+            use_cache=False, transport=httpx.MockTransport(maa),
+        )
+        async with session:
+            self.assertNotEqual(session.jwt, "")
+            self.assertFalse(session.expired)
+            for step in ("policy_digest", "token", "jwks", "verify", "total"):
+                self.assertIn(step, session.attestation_timings)
+            response = await session.get("/enclave")
+            self.assertEqual(response.status_code, 200)
+        # The keys are downloaded while the token is requested
+        self.assertCountEqual(maa.paths[:2], ["/attest/maa", "/certs"])
+        self.assertEqual(maa.paths[2:], ["/enclave"])
+
+    async def test_attestation_policy_mismatch(self):
+        maa = FakeMAA("0" * 64)
+        session = AsyncSecureSession(
+            "http://enclave:8000", self.policy_file, ATTESTER,
+            use_cache=False, transport=httpx.MockTransport(maa),
+        )
+        with self.assertRaises(InvalidEnclaveCode):
+            await session.get("/enclave")
+        # Nothing is sent to an enclave which failed attestation
+        self.assertNotIn("/enclave", maa.paths)
+        await session.aclose()
+
+    async def test_pool(self):
+        pool = AsyncSessionPool()
+        a = await pool.session(f"http://{SERVER_URL}:{SERVER_PORT}", debug_mode=True)
+        self.assertIs(await pool.session(f"http://{SERVER_URL}:{SERVER_PORT}", debug_mode=True), a)
+        await pool.aclose()
+        self.assertEqual(len(pool), 0)
+
+    async def test_evicted_session_is_closed_when_idle(self):
+        pool = AsyncSessionPool(max_size=1)
+        a = await pool.session(f"http://{SERVER_URL}:{SERVER_PORT}", debug_mode=True)
+        async with a.stream("GET", "/enclave") as response:
+            # a is evicted while its request is in flight
+            b = await pool.session(f"http://127.0.0.1:{SERVER_PORT}", debug_mode=True)
+            self.assertIsNot(a, b)
+            self.assertFalse(a.is_closed)
+            self.assertEqual(await response.aread(), b"[GET] /enclave : Server response")
+        self.assertTrue(a.is_closed)
+        self.assertFalse(b.is_closed)
+        await pool.aclose()
+
+    def test_session_created_outside_event_loop(self):
+        maa = FakeMAA(hashlib.sha256(POLICY).hexdigest())
+        session = AsyncSecureSession(
+            "http://enclave:8000", self.policy_file, ATTESTER,
+            use_cache=False, transport=httpx.MockTransport(maa),
+        )
+
+        async def attest():
+            # The second request waits for the attestation lock, which must belong
+            # to this loop
+            responses = await asyncio.gather(session.get("/enclave"), session.get("/enclave"))
+            await session.aclose()
+            return responses
+
+        for response in asyncio.run(attest()):
+            self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import tempfile
+import threading
+import time
+from blindbox.requests.attestation_cache import AttestationCache, AttestationVerdict
+
+
+KEY = ("http://localhost:8080", "0" * 64, "sampleAttester.eus.attest.azure.net")
+
+
+def make_verdict(lifetime=60.0, age=0.0, token="token"):
+    now = time.time()
+    return AttestationVerdict(token, {"nonce": "00"}, now - age, now - age + lifetime)
+
+
+class TestBlindBoxAttestationCache(unittest.TestCase):
+    def test_put_get(self):
+        cache = AttestationCache()
+        self.assertIsNone(cache.get(KEY))
+        verdict = make_verdict()
+        cache.put(KEY, verdict)
+        self.assertIs(cache.get(KEY), verdict)
+        cache.invalidate(KEY)
+        self.assertIsNone(cache.get(KEY))
+
+    def test_expired_verdict(self):
+        cache = AttestationCache()
+        cache.put(KEY, make_verdict(lifetime=1.0, age=2.0))
+        self.assertIsNone(cache.get(KEY))
+
+    def test_from_payload(self):
+        verdict = AttestationVerdict.from_payload("token", {"iat": 100, "exp": 200}, {"nonce": "00"})
+        self.assertEqual(verdict.issued_at, 100.0)
+        self.assertEqual(verdict.expires_at, 200.0)
+        self.assertEqual(verdict.refresh_at(0.2), 180.0)
+
+    def test_background_refresh(self):
+        cache = AttestationCache(refresh_margin=0.2)
+        old = make_verdict(lifetime=10.0, age=9.0)
+        new = make_verdict(token="new")
+        refreshed = threading.Event()
+
+        def refresh():
+            refreshed.set()
+            return new
+
+        cache.put(KEY, old)
+        # The old verdict is still valid and returned without blocking
+        self.assertIs(cache.get(KEY, refresh=refresh), old)
+        self.assertTrue(refreshed.wait(5))
+        for _ in range(100):
+            if cache.get(KEY) is new:
+                break
+            time.sleep(0.01)
+        self.assertIs(cache.get(KEY), new)
+
+    def test_no_refresh_before_margin(self):
+        cache = AttestationCache(refresh_margin=0.2)
+        verdict = make_verdict(lifetime=10.0, age=1.0)
+        refreshed = threading.Event()
+
+        def refresh():
+            refreshed.set()
+            return make_verdict(token="new")
+
+        cache.put(KEY, verdict)
+        self.assertIs(cache.get(KEY, refresh=refresh), verdict)
+        # The refresh would run in a background thread
+        self.assertFalse(refreshed.wait(0.2))
+
+    def test_disk_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            verdict = make_verdict()
+            AttestationCache(directory).put(KEY, verdict)
+
+            loaded = AttestationCache(directory).get(KEY, revalidate=lambda v: None)
+            self.assertEqual(loaded.token, verdict.token)
+            self.assertEqual(loaded.expires_at, verdict.expires_at)
+
+            def reject(v):
+                raise ValueError("invalid token")
+
+            self.assertIsNone(AttestationCache(directory).get(KEY, revalidate=reject))
+            # Rejected verdicts are removed from disk
+            self.assertIsNone(AttestationCache(directory).get(KEY))
+
+
+if __name__ == '__main__':
+    unittest.main()
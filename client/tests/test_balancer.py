@@ -0,0 +1,104 @@
+import time
+import unittest
+import warnings
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from requests.exceptions import ConnectionError, Timeout
+from blindbox.requests.balancer import LoadBalancedSession, NoReplicaAvailable
+from blindbox.requests.errors import InvalidEnclaveCode, InvalidToken
+from blindbox.requests.secure_session import BlindBoxDebugModeWarning, _check_claims
+
+
+SERVER_PORT = 8080
+REPLICAS = [f"http://localhost:{SERVER_PORT}", f"http://127.0.0.1:{SERVER_PORT}"]
+DEAD_REPLICA = "http://127.0.0.1:1"
+
+
+class TestBlindBoxLoadBalancedSession(unittest.TestCase):
+    def setUp(self):
+        warnings.simplefilter("ignore", BlindBoxDebugModeWarning)
+
+    def test_requests_are_balanced(self):
+        # With ewma, the replicas without latency samples are tried first, so that
+        # every replica is used (least_outstanding picks at random between ties)
+        with LoadBalancedSession(REPLICAS, debug_mode=True, strategy="ewma") as session:
+            self.assertCountEqual(session.replicas, REPLICAS)
+            for _ in range(4):
+                response = session.get("/enclave")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.text, "[GET] /enclave : Server response")
+            for replica in session._replicas:
+                self.assertIsNotNone(replica.latency)
+
+    def test_unhealthy_replica_is_not_used(self):
+        with LoadBalancedSession(REPLICAS + [DEAD_REPLICA], debug_mode=True, health_check="/enclave") as session:
+            self.assertCountEqual(session.replicas, REPLICAS)
+            for _ in range(4):
+                self.assertEqual(session.get("/enclave").status_code, 200)
+
+    def test_replica_is_ejected_on_connection_error(self):
+        with LoadBalancedSession([DEAD_REPLICA], debug_mode=True, strategy="ewma") as session:
+            with self.assertRaises(ConnectionError):
+                session.get("/enclave")
+            self.assertEqual(session.replicas, [])
+            with self.assertRaises(NoReplicaAvailable):
+                session.get("/enclave")
+
+    def test_replica_failing_reattestation_is_ejected(self):
+        with LoadBalancedSession(REPLICAS[:1], debug_mode=True, health_check_interval=0.05) as session:
+            def connect(addr, use_cache):
+                raise InvalidEnclaveCode("cce policy mismatch")
+
+            session._connect = connect
+            session._replicas[0].session.expires_at = time.time() - 1
+            time.sleep(0.5)
+            self.assertEqual(session.replicas, [])
+            self.assertIsInstance(session._replicas[0].last_error, InvalidEnclaveCode)
+            with self.assertRaises(NoReplicaAvailable):
+                session.get("/enclave")
+
+    def test_replica_with_badly_signed_token_is_ejected(self):
+        signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        attester_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        token = jwt.encode({"x-ms-attestation-type": "sevsnpvm"}, signing_key, algorithm="RS256")
+
+        with LoadBalancedSession(REPLICAS[:1], debug_mode=True, health_check_interval=0.05) as session:
+            def connect(addr, use_cache):
+                _check_claims(token, attester_key.public_key(), "0" * 64, {"nonce": "00"})
+
+            session._connect = connect
+            # The current token is still valid
+            session._replicas[0].session.expires_at = time.time() + 30
+            time.sleep(0.5)
+            self.assertEqual(session.replicas, [])
+            self.assertIsInstance(session._replicas[0].last_error, InvalidToken)
+
+    def test_replica_stays_healthy_when_reattestation_times_out(self):
+        with LoadBalancedSession(REPLICAS[:1], debug_mode=True, health_check="/enclave", health_check_interval=0.05) as session:
+            checks = []
+
+            def connect(addr, use_cache):
+                raise Timeout("attestation timed out")
+
+            def check_health(replica_session):
+                checks.append(replica_session)
+
+            session._connect = connect
+            session._check_health = check_health
+            session._replicas[0].session.expires_at = time.time() + 30
+            time.sleep(0.5)
+            self.assertEqual(session.replicas, REPLICAS[:1])
+            self.assertTrue(checks)
+            self.assertEqual(session.get("/enclave").status_code, 200)
+
+    def test_no_replica_can_be_attested(self):
+        with self.assertRaises(ConnectionError):
+            LoadBalancedSession([DEAD_REPLICA], debug_mode=True, health_check="/enclave")
+
+    def test_invalid_strategy(self):
+        with self.assertRaises(ValueError):
+            LoadBalancedSession(REPLICAS, debug_mode=True, strategy="round_robin")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import base64
+import datetime
+from blindbox.requests.errors import AttestationException
+from blindbox.requests.jwks import JWKSCache, _max_age
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+JKU = "https://sampleAttester.eus.attest.azure.net/certs"
+
+
+def make_jwk(kid):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, kid)])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(1)
+        .not_valid_before(datetime.datetime(2020, 1, 1))
+        .not_valid_after(datetime.datetime(2040, 1, 1))
+        .sign(key, hashes.SHA256())
+    )
+    der = cert.public_bytes(serialization.Encoding.DER)
+    return {"kid": kid, "x5c": [base64.b64encode(der).decode()]}
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeHttp:
+    def __init__(self, keys, headers=None):
+        self.keys = keys
+        self.headers = headers or {}
+        self.requests = []
+
+    def request(self, method, url, headers=None):
+        self.requests.append((method, url, headers))
+        return FakeResponse(200, self.headers, {"keys": self.keys})
+
+
+class TestBlindBoxJWKSCache(unittest.TestCase):
+    def test_max_age(self):
+        self.assertEqual(_max_age({"Cache-Control": "public, max-age=600"}, 10), 600)
+        self.assertEqual(_max_age({"Cache-Control": "no-store"}, 10), 0)
+        self.assertEqual(
+            _max_age(
+                {
+                    "Date": "Mon, 01 Jan 2024 00:00:00 GMT",
+                    "Expires": "Mon, 01 Jan 2024 01:00:00 GMT",
+                },
+                10,
+            ),
+            3600,
+        )
+        self.assertEqual(_max_age({}, 10), 10)
+
+    def test_keys_are_downloaded_once(self):
+        cache = JWKSCache()
+        http = FakeHttp([make_jwk("k1"), make_jwk("k2")])
+        k1 = cache.get_key(http, JKU, "k1")
+        self.assertIs(cache.get_key(http, JKU, "k1"), k1)
+        cache.get_key(http, JKU, "k2")
+        self.assertEqual(len(http.requests), 1)
+
+    def test_stale_key_set_is_downloaded_again(self):
+        cache = JWKSCache()
+        http = FakeHttp([make_jwk("k1")], {"Cache-Control": "max-age=0", "ETag": '"v1"'})
+        cache.get_key(http, JKU, "k1")
+        cache.get_key(http, JKU, "k1")
+        self.assertEqual(len(http.requests), 2)
+        self.assertEqual(http.requests[1][2], {"If-None-Match": '"v1"'})
+
+    def test_unknown_kid(self):
+        cache = JWKSCache(min_refresh_interval=0)
+        http = FakeHttp([make_jwk("k1")])
+        cache.get_key(http, JKU, "k1")
+
+        # Key rotation: the unknown kid triggers a new download
+        http.keys = [make_jwk("k2")]
+        cache.get_key(http, JKU, "k2")
+        self.assertEqual(len(http.requests), 2)
+
+        with self.assertRaises(AttestationException):
+            cache.get_key(http, JKU, "k3")
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        cache = JWKSCache(min_refresh_interval=60)
+        http = FakeHttp([make_jwk("k1")])
+        cache.get_key(http, JKU, "k1")
+        with self.assertRaises(AttestationException):
+            cache.get_key(http, JKU, "k2")
+        self.assertEqual(len(http.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import base64
+import hashlib
+import os
+import pathlib
+import tempfile
+from unittest.mock import patch
+from blindbox.requests import policy
+from blindbox.requests.policy import PolicyRegistry
+
+
+POLICY = b"package policy"
+DIGEST = hashlib.sha256(POLICY).hexdigest()
+
+
+class TestBlindBoxPolicyRegistry(unittest.TestCase):
+    def setUp(self):
+        fd, self.policy_file = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as f:
+            f.write(base64.b64encode(POLICY))
+
+    def tearDown(self):
+        os.remove(self.policy_file)
+
+    def test_digest(self):
+        registry = PolicyRegistry()
+        self.assertEqual(registry.digest(self.policy_file), DIGEST)
+
+    def test_path_like(self):
+        registry = PolicyRegistry()
+        self.assertEqual(registry.digest(pathlib.Path(self.policy_file)), DIGEST)
+        with patch.object(policy, "policy_digest", wraps=policy.policy_digest) as digest:
+            registry.digest(self.policy_file)
+            registry.digest(os.fsencode(self.policy_file))
+            self.assertEqual(digest.call_count, 0)
+
+    def test_policy_is_hashed_once(self):
+        registry = PolicyRegistry()
+        with patch.object(policy, "policy_digest", wraps=policy.policy_digest) as digest:
+            registry.digest(self.policy_file)
+            registry.digest(self.policy_file)
+            self.assertEqual(digest.call_count, 1)
+
+    def test_modified_policy_is_hashed_again(self):
+        registry = PolicyRegistry()
+        registry.digest(self.policy_file)
+        with open(self.policy_file, "wb") as f:
+            f.write(base64.b64encode(b"another policy"))
+        os.utime(self.policy_file, ns=(0, 0))
+        self.assertEqual(registry.digest(self.policy_file), hashlib.sha256(b"another policy").hexdigest())
+
+    def test_precomputed_digest(self):
+        registry = PolicyRegistry()
+        self.assertEqual(registry.digest(f"sha256:{DIGEST.upper()}"), DIGEST)
+        with self.assertRaises(ValueError):
+            registry.digest("sha256:1234")
+
+    def test_missing_file(self):
+        with self.assertRaises(OSError):
+            PolicyRegistry().digest("./missing_cce_policy.txt")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import time
+import warnings
+from blindbox.requests.pool import SessionPool
+from blindbox.requests.secure_session import SecureSession, BlindBoxDebugModeWarning
+
+
+SERVER_URL = "localhost"
+SERVER_PORT = 8080
+
+
+class TestBlindBoxSessionPool(unittest.TestCase):
+    def setUp(self):
+        warnings.simplefilter("ignore", BlindBoxDebugModeWarning)
+
+    def test_session_is_reused(self):
+        pool = SessionPool()
+        session = pool.session(f"http://{SERVER_URL}:{SERVER_PORT}", debug_mode=True)
+        self.assertIsInstance(session, SecureSession)
+        self.assertIs(pool.session(f"http://{SERVER_URL}:{SERVER_PORT}", debug_mode=True), session)
+        self.assertEqual(len(pool), 1)
+
+        response = session.get("/enclave")
+        self.assertEqual(response.status_code, 200)
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+
+    def test_cookies_are_not_shared(self):
+        pool = SessionPool()
+        session = pool.session(f"http://{SERVER_URL}:{SERVER_PORT}", debug_mode=True)
+        response = session.get("/enclave/cookie")
+        self.assertEqual(response.cookies.get("session_id"), "secret")
+        self.assertEqual(len(session.cookies), 0)
+        pool.clear()
+
+    def test_sessions_are_keyed_by_attester(self):
+        pool = SessionPool()
+        a = pool.session("https://example.com", None, "a.attest.azure.net", debug_mode=True)
+        b = pool.session("https://example.com", None, "b.attest.azure.net", debug_mode=True)
+        self.assertIsNot(a, b)
+        self.assertEqual(len(pool), 2)
+
+    def test_max_size(self):
+        pool = SessionPool(max_size=2)
+        a = pool.session("https://a.example.com", debug_mode=True)
+        pool.session("https://b.example.com", debug_mode=True)
+        pool.session("https://a.example.com", debug_mode=True)
+        pool.session("https://c.example.com", debug_mode=True)
+        self.assertEqual(len(pool), 2)
+        # b was the least recently used session
+        self.assertIs(pool.session("https://a.example.com", debug_mode=True), a)
+        self.assertEqual(len(pool), 2)
+
+    def test_idle_eviction(self):
+        pool = SessionPool(idle_timeout=0.05)
+        a = pool.session("https://example.com", debug_mode=True)
+        time.sleep(0.1)
+        self.assertIsNot(pool.session("https://example.com", debug_mode=True), a)
+
+    def test_max_age(self):
+        pool = SessionPool(idle_timeout=10, max_age=0.05)
+        a = pool.session("https://example.com", debug_mode=True)
+        time.sleep(0.1)
+        self.assertIsNot(pool.session("https://example.com", debug_mode=True), a)
+
+    def test_invalid_max_size(self):
+        with self.assertRaises(ValueError):
+            SessionPool(max_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
 import unittest
+import subprocess
+import sys
 from coverage import coverage
 from blindbox.requests.requests import _parse_url
 
@@ -18,6 +20,14 @@ class TestBlindBoxRequests(unittest.TestCase):
         self.assertEqual(root, "http://localhost:8000")
         self.assertEqual(endpoint, "")
 
+    def test_lazy_import(self):
+        code = (
+            "import sys, blindbox; assert 'requests' not in sys.modules; "
+            "from blindbox import requests; assert 'jwt' not in sys.modules and 'httpx' not in sys.modules; "
+            "requests.warmup(); assert 'jwt' in sys.modules and 'cryptography.x509' in sys.modules"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
+
     '''
     def test_post(self):
         with open(TEST_FILE, "rb") as file:
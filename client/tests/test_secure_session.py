@@ -1,8 +1,14 @@
 import unittest
+import io
+import os
+import uuid
 from coverage import coverage
 import warnings
 from blindbox.requests.secure_session import SecureSession, connect, BlindBoxDebugModeWarning
-from requests.exceptions import ContentDecodingError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ContentDecodingError
+from unittest.mock import patch
+from urllib3.util.retry import Retry
 
 
 SERVER_URL = "localhost"
@@ -45,6 +51,91 @@ class TestBlindBoxSecureSession(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.text, "[POST] /enclave/predict : Server response")
 
+    def test_streamed_upload(self):
+        with SecureSession("http://localhost:8080", debug_mode=True) as session:
+            with open(TEST_FILE, "rb") as file:
+                response = session.post("/enclave/upload", data={"lang": "en"}, files={"audio": file})
+            self.assertEqual(response.json()["sizes"]["audio"], ["test.wav", os.path.getsize(TEST_FILE)])
+            self.assertEqual(response.json()["sizes"]["lang"], [None, 2])
+            self.assertFalse(response.json()["chunked"])
+
+            # Generators have no known size and are sent with chunked transfer encoding
+            chunks = (b"x" * 1000 for _ in range(100))
+            response = session.post("/enclave/upload", files={"audio": ("test.wav", chunks)})
+            self.assertEqual(response.json()["sizes"]["audio"], ["test.wav", 100000])
+            self.assertTrue(response.json()["chunked"])
+
+    def test_streamed_download(self):
+        size = 5 * 1024 * 1024 + 3
+        with SecureSession("http://localhost:8080", debug_mode=True) as session:
+            with session.streaming("GET", "/enclave/download", params={"size": size}) as response:
+                chunks = list(response.iter_content(64 * 1024))
+            self.assertEqual(sum(len(chunk) for chunk in chunks), size)
+            self.assertLessEqual(max(len(chunk) for chunk in chunks), 64 * 1024)
+
+            output = io.BytesIO()
+            session.download("/enclave/download", output, params={"size": size})
+            self.assertEqual(len(output.getvalue()), size)
+
+    def test_map(self):
+        run = uuid.uuid4().hex
+        items = [{"json": {"id": f"{run}-{i}", "flaky": i % 3 == 0}} for i in range(20)]
+        progress = []
+        with SecureSession("http://localhost:8080", debug_mode=True) as session:
+            responses = session.map(
+                "POST", "/enclave/echo", items, concurrency=4, backoff=0.01,
+                progress=lambda done, total: progress.append((done, total)),
+            )
+        self.assertEqual([r.json()["id"] for r in responses], [f"{run}-{i}" for i in range(20)])
+        # The requests answered with a 503 are retried
+        self.assertEqual([r.json()["attempts"] for r in responses], [2 if i % 3 == 0 else 1 for i in range(20)])
+        self.assertEqual(progress[-1], (20, 20))
+
+    def test_batch_errors(self):
+        with SecureSession("http://127.0.0.1:1", debug_mode=True) as session:
+            requests = [("GET", "/enclave", {})] * 3
+            results = session.batch(requests, retries=1, backoff=0.01, return_exceptions=True)
+            self.assertEqual(len(results), 3)
+            for result in results:
+                self.assertIsInstance(result, ConnectionError)
+            with self.assertRaises(ConnectionError):
+                session.batch(iter(requests), retries=0)
+
+    def test_batch_retries_idempotent_requests(self):
+        with SecureSession("http://127.0.0.1:1", debug_mode=True) as session:
+            for method, retry_non_idempotent, calls in [
+                ("GET", False, 2),
+                ("POST", False, 1),
+                ("POST", True, 2),
+            ]:
+                with patch.object(session, "request", side_effect=ConnectionError()) as request:
+                    results = session.batch(
+                        [(method, "/enclave", {})], retries=1, backoff=0.01, return_exceptions=True,
+                        retry_non_idempotent=retry_non_idempotent,
+                    )
+                self.assertIsInstance(results[0], ConnectionError)
+                self.assertEqual(request.call_count, calls)
+
+    def test_batch_keeps_adapters(self):
+        class CustomAdapter(HTTPAdapter):
+            pass
+
+        with SecureSession("http://localhost:8080", debug_mode=True) as session:
+            adapter = HTTPAdapter(max_retries=Retry(total=3))
+            session.mount("http://localhost:8080/", adapter)
+            session.batch([("GET", "/enclave", {})] * 4, concurrency=16)
+            # The pool of the adapter is grown, its configuration is kept
+            self.assertIs(session.get_adapter("http://localhost:8080/enclave"), adapter)
+            self.assertEqual(adapter.max_retries.total, 3)
+            self.assertEqual(adapter._pool_maxsize, 16)
+
+            custom = CustomAdapter(pool_maxsize=2)
+            session.mount("http://localhost:8080/", custom)
+            responses = session.batch([("GET", "/enclave", {})] * 4, concurrency=16)
+            self.assertEqual([r.status_code for r in responses], [200] * 4)
+            self.assertIs(session.get_adapter("http://localhost:8080/enclave"), custom)
+            self.assertEqual(custom._pool_maxsize, 2)
+
     def test_put_method(self):
         with SecureSession("http://localhost:8080", debug_mode=True) as session:
             with open(TEST_FILE, "rb") as file:
@@ -0,0 +1,303 @@
+import asyncio
+import struct
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, BinaryIO, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
+
+
+# Number of frames decoded at once from the files decoded by soundfile
+BLOCK_SIZE = 65536
+# Uploads which are not streamed WAV files are spooled to disk above this size
+SPOOL_MAX_SIZE = 8 * 2**20
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# The size of the chunks of streamed WAV files, whose length is not known
+WAV_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+class _ByteStream:
+    """A buffer over an async iterator of chunks of bytes."""
+
+    def __init__(self, chunks: AsyncIterator[bytes]) -> None:
+        self.chunks = chunks.__aiter__()
+        self.buffer = bytearray()
+        self.eof = False
+
+    async def fill(self, n: int) -> bool:
+        while len(self.buffer) < n and not self.eof:
+            try:
+                self.buffer += await self.chunks.__anext__()
+            except StopAsyncIteration:
+                self.eof = True
+        return len(self.buffer) >= n
+
+    async def peek(self, n: int) -> bytes:
+        await self.fill(n)
+        return bytes(self.buffer[:n])
+
+    async def read(self, n: int) -> bytes:
+        if not await self.fill(n):
+            raise ValueError("Unexpected end of stream")
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def read_some(self, multiple: int, limit: int) -> bytes:
+        """Read at most limit bytes, as many as received, in a multiple of multiple
+        bytes. An empty result means the end of the stream."""
+        await self.fill(multiple)
+        n = min(len(self.buffer), limit)
+        n -= n % multiple
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def spool(self) -> BinaryIO:
+        """Write the rest of the stream in a temporary file."""
+        file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        file.write(self.buffer)
+        self.buffer = bytearray()
+        async for chunk in self.chunks:
+            file.write(chunk)
+        file.seek(0)
+        return file
+
+
+async def _multipart_file(request: Request) -> AsyncIterator[bytes]:
+    """Yield the content of the audio file of a multipart form as it is received:
+    the first part named "audio" or with a file name. The rest of the form is not
+    read."""
+    _, options = parse_options_header(request.headers["content-type"])
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise ValueError("Multipart form without boundary")
+
+    header_field = bytearray()
+    header_value = bytearray()
+    headers = {}
+    # The state of the audio part: None before it, True in it and False after it
+    in_audio: Optional[bool] = None
+    chunks = []
+
+    def on_part_begin() -> None:
+        headers.clear()
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        header_field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        header_value.extend(data[start:end])
+
+    def on_header_end() -> None:
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished() -> None:
+        nonlocal in_audio
+        _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+        if in_audio is None and (disposition.get(b"name") == b"audio" or b"filename" in disposition):
+            in_audio = True
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        if in_audio:
+            chunks.append(data[start:end])
+
+    def on_part_end() -> None:
+        nonlocal in_audio
+        if in_audio:
+            in_audio = False
+
+    parser = MultipartParser(
+        boundary,
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        },
+    )
+    async for chunk in request.stream():
+        parser.write(chunk)
+        for data in chunks:
+            yield data
+        chunks.clear()
+        if in_audio is False:
+            return
+    if in_audio is None:
+        raise HTTPException(status_code=400, detail="No audio file in the form")
+    raise ValueError("Unexpected end of stream")
+
+
+def _pcm_to_float32(data: bytes, audio_format: int, bits: int, channels: int) -> np.ndarray:
+    if audio_format == WAVE_FORMAT_IEEE_FLOAT:
+        x = np.frombuffer(data, dtype="<f4" if bits == 32 else "<f8").astype(np.float32)
+    elif bits == 8:
+        x = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif bits == 16:
+        x = np.frombuffer(data, dtype="<i2").astype(np.float32) / 2**15
+    elif bits == 24:
+        b = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        # Sign extended from 24 to 32 bits
+        x = ((b[:, 0] << 8 | b[:, 1] << 16 | b[:, 2] << 24) >> 8).astype(np.float32) / 2**23
+    else:
+        x = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2**31
+    return x.reshape(-1, channels)
+
+
+async def _wav_blocks(stream: _ByteStream) -> AsyncIterator[Tuple[np.ndarray, int]]:
+    """Decode a WAV file as it is received, yielding (frames, sample rate)."""
+    riff, _, wave = struct.unpack("<4sI4s", await stream.read(12))
+    if riff != b"RIFF" or wave != b"WAVE":
+        raise ValueError("Not a WAV file")
+
+    fmt = None
+    while True:
+        chunk_id, size = struct.unpack("<4sI", await stream.read(8))
+        if chunk_id == b"data":
+            data_size = size
+            break
+        # Chunks are padded to an even size
+        data = await stream.read(size + size % 2)
+        if chunk_id == b"fmt ":
+            fmt = data[:size]
+    if fmt is None or len(fmt) < 16:
+        raise ValueError("WAV file without format")
+
+    audio_format, channels, rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if audio_format == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        audio_format = struct.unpack("<H", fmt[24:26])[0]
+    if (
+        audio_format not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT)
+        or bits not in (8, 16, 24, 32, 64)
+        or (audio_format == WAVE_FORMAT_PCM and bits == 64)
+        or (audio_format == WAVE_FORMAT_IEEE_FLOAT and bits not in (32, 64))
+        or block_align != channels * bits // 8
+        or channels == 0
+    ):
+        raise ValueError("Unsupported WAV encoding")
+
+    # Streamed WAV files leave the size of the data chunk empty or at its maximum,
+    # their data ending with the stream. Otherwise, the chunks after the data are
+    # not decoded.
+    remaining = None
+    if data_size not in (0, WAV_UNKNOWN_SIZE):
+        remaining = data_size - data_size % block_align
+    while remaining is None or remaining > 0:
+        limit = BLOCK_SIZE * block_align
+        if remaining is not None:
+            limit = min(limit, remaining)
+        data = await stream.read_some(block_align, limit)
+        if not data:
+            return
+        if remaining is not None:
+            remaining -= len(data)
+        yield _pcm_to_float32(data, audio_format, bits, channels), rate
+
+
+async def _soundfile_blocks(file: BinaryIO) -> AsyncIterator[Tuple[np.ndarray, int]]:
+    """Decode a file in any format supported by soundfile, one block at a time."""
+    with sf.SoundFile(file) as f:
+        while True:
+            block = await asyncio.to_thread(f.read, BLOCK_SIZE, dtype="float32", always_2d=True)
+            if not len(block):
+                return
+            yield block, f.samplerate
+
+
+class _Resampler:
+    def __init__(self, in_rate: int, out_rate: int) -> None:
+        self.stream = None
+        if in_rate != out_rate:
+            import soxr
+
+            self.stream = soxr.ResampleStream(in_rate, out_rate, 1, dtype="float32")
+
+    def __call__(self, x: np.ndarray, last: bool = False) -> np.ndarray:
+        if self.stream is None:
+            return x
+        return self.stream.resample_chunk(x, last=last)
+
+
+async def _resampled(
+    blocks: AsyncIterator[Tuple[np.ndarray, int]], sample_rate: int
+) -> AsyncIterator[np.ndarray]:
+    """Downmix the blocks to mono and resample them to sample_rate."""
+    resampler: Optional[_Resampler] = None
+    async for block, rate in blocks:
+        if resampler is None:
+            resampler = _Resampler(rate, sample_rate)
+        yield resampler(np.ascontiguousarray(block.mean(axis=1, dtype=np.float32)))
+    if resampler is not None:
+        yield resampler(np.zeros(0, dtype=np.float32), last=True)
+
+
+async def _windowed(
+    samples: AsyncIterator[np.ndarray], size: int, overlap: int = 0
+) -> AsyncIterator[np.ndarray]:
+    """Group the samples in windows of size samples, each window starting with
+    the last overlap samples of the previous one."""
+    window = np.empty(size, dtype=np.float32)
+    filled = 0
+    # Whether the window has samples which are not in the previous one
+    fresh = False
+    async for x in samples:
+        while len(x):
+            n = min(size - filled, len(x))
+            window[filled : filled + n] = x[:n]
+            filled += n
+            fresh = True
+            x = x[n:]
+            if filled == size:
+                yield window
+                window = np.concatenate([window[size - overlap :], np.empty(size - overlap, dtype=np.float32)])
+                filled = overlap
+                fresh = False
+    if fresh:
+        yield window[:filled]
+
+
+async def audio_windows(
+    request: Request,
+    sample_rate: int = 16000,
+    window_s: float = 30.0,
+    overlap_s: float = 0.0,
+) -> AsyncIterator[np.ndarray]:
+    """Decode the audio file of the request as it is received, and yield it as mono
+    float32 windows of window_s seconds at sample_rate, the last one being shorter.
+    Consecutive windows share overlap_s seconds.
+
+    The file is either the body of the request, or the first file of a multipart
+    form. WAV files are decoded while they are uploaded, other formats once they
+    are uploaded, one block at a time. The memory used thus does not grow with the
+    duration of the audio, beyond the windows not yet consumed.
+    """
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            stream = _ByteStream(_multipart_file(request))
+        else:
+            stream = _ByteStream(request.stream())
+        if await stream.peek(4) == b"RIFF":
+            blocks = _wav_blocks(stream)
+        else:
+            blocks = _soundfile_blocks(await stream.spool())
+
+        size = int(window_s * sample_rate)
+        overlap = int(overlap_s * sample_rate)
+        if not 0 <= overlap < size:
+            raise ValueError("The overlap must be shorter than the window")
+        async for window in _windowed(_resampled(blocks, sample_rate), size, overlap):
+            yield window
+    except (ValueError, struct.error, RuntimeError):
+        raise HTTPException(
+            status_code=400, detail="Could not deserialize data: not an audio file"
+        )
@@ -0,0 +1,138 @@
+import math
+from collections import deque
+from typing import Deque
+
+
+class AdaptiveBatchPolicy:
+    """Chooses the batch size and the batching delay of a BatchRunner from load.
+
+    The policy measures the arrival rate of requests and models the duration of a
+    batch as a fixed cost plus a cost per input, both fitted on the batches run so
+    far. It then targets the smallest batch that keeps up with the arrival rate,
+    and waits for it at most as long as the p99 latency SLO allows once the
+    queueing and inference times are accounted for. Under light load requests are
+    thus run as soon as they arrive, and under heavy load batches grow up to
+    max_batch_size. When the measured p99 latency exceeds the SLO anyway, the
+    delay is scaled down until it is met again.
+    """
+
+    def __init__(
+        self,
+        slo_ms: float,
+        min_batch_size: int = 1,
+        decay: float = 0.1,
+        headroom: float = 1.2,
+        window: int = 1000,
+    ) -> None:
+        """
+        Args:
+            slo_ms: The target p99 latency of a request, from submission to result.
+            min_batch_size: The smallest target batch size.
+            decay: The weight of the last sample in the moving averages.
+            headroom: The throughput targeted, relative to the arrival rate.
+            window: The number of latencies the p99 latency is measured on.
+        """
+        self.slo = slo_ms / 1000
+        self.min_batch_size = min_batch_size
+        self.decay = decay
+        self.headroom = headroom
+        self.max_batch_size = 1
+        self.max_latency = self.slo
+
+        # Moving average of the time between two arrivals
+        self.interarrival = None
+        self.last_arrival = None
+        # Moving averages of (size, duration, size^2, size * duration) of the
+        # batches, to fit duration = fixed_cost + item_cost * size
+        self.moments = None
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.scale = 1.0
+
+    def bind(self, max_batch_size: int, max_latency_ms: float) -> None:
+        """Set the bounds of the runner the policy is used by."""
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+
+    def ewma(self, average, sample):
+        return sample if average is None else average + self.decay * (sample - average)
+
+    def observe_arrival(self, now: float) -> None:
+        if self.last_arrival is not None:
+            self.interarrival = self.ewma(self.interarrival, now - self.last_arrival)
+        self.last_arrival = now
+
+    def observe_batch(self, size: int, duration: float) -> None:
+        sample = (size, duration, size * size, size * duration)
+        if self.moments is None:
+            self.moments = sample
+        else:
+            self.moments = tuple(self.ewma(m, s) for m, s in zip(self.moments, sample))
+
+    def observe_latency(self, latency: float) -> None:
+        self.latencies.append(latency)
+        # Re-evaluated every 1% of the window, on the p99 of the window
+        if len(self.latencies) % max(1, self.latencies.maxlen // 100) == 0:
+            if self.p99() > self.slo:
+                self.scale = max(0.05, self.scale * 0.8)
+            else:
+                self.scale = min(1.0, self.scale * 1.05)
+
+    def p99(self) -> float:
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] if latencies else 0.0
+
+    @property
+    def arrival_rate(self) -> float:
+        if not self.interarrival:
+            return 0.0
+        return 1 / self.interarrival
+
+    def costs(self):
+        """The fixed and per-input costs of a batch, in seconds."""
+        if self.moments is None:
+            return 0.0, 0.0
+        size, duration, size2, size_duration = self.moments
+        variance = size2 - size * size
+        if variance <= 1e-9:
+            # All the batches had the same size, the cost is attributed to the inputs
+            return 0.0, duration / max(size, 1)
+        item_cost = max(0.0, (size_duration - size * duration) / variance)
+        return max(0.0, duration - item_cost * size), item_cost
+
+    def batch_duration(self, size: int) -> float:
+        fixed_cost, item_cost = self.costs()
+        return fixed_cost + item_cost * size
+
+    @property
+    def batch_size(self) -> int:
+        """The batch size at which a batch is run without waiting."""
+        rate = self.arrival_rate * self.headroom
+        fixed_cost, item_cost = self.costs()
+        if rate * item_cost >= 1:
+            # The model can not keep up, batches are as large as possible
+            return self.max_batch_size
+        # The smallest size whose throughput, size / duration(size), keeps up
+        size = math.ceil(rate * fixed_cost / (1 - rate * item_cost))
+        return max(self.min_batch_size, min(self.max_batch_size, size))
+
+    @property
+    def max_wait(self) -> float:
+        """How long the oldest request of a batch smaller than batch_size waits."""
+        size = self.batch_size
+        rate = self.arrival_rate
+        if size <= 1 or rate <= 0:
+            return 0.0
+        # A request waits for its batch to fill up, for the batch in progress, then
+        # for its own batch to run
+        budget = self.slo - 2 * self.batch_duration(size)
+        fill_time = (size - 1) / rate
+        return max(0.0, min(fill_time, budget, self.max_latency)) * self.scale
+
+    @property
+    def max_pending(self) -> int:
+        """How many requests can wait while still being served within the SLO."""
+        duration = self.batch_duration(self.max_batch_size)
+        if duration <= 0:
+            return 2 * self.max_batch_size
+        batches = max(2, int(self.slo / duration))
+        return batches * self.max_batch_size
@@ -1,15 +1,152 @@
 import asyncio
+import hashlib
+import heapq
+import itertools
+import math
+import os
 from asyncio import Future
-from asyncio.queues import Queue
-from typing import Callable, Generic, TypeVar, Tuple, List
+from collections import Counter
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, Set, TypeVar, Tuple, List
 
+from batch_policy import AdaptiveBatchPolicy
 from collators import Collator
+from metrics import BatchRunnerMetrics
 
 
 T = TypeVar("T")
 U = TypeVar("U")
 
 
+# A batch is run this long before the earliest deadline of its requests, on top of
+# its expected duration, to account for the latency of timers and locks
+DEADLINE_SLACK = 0.005
+
+# Priorities of the requests, the lowest value being served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+
+class DeadlineExceeded(Exception):
+    """The request could not be run before its deadline."""
+
+    pass
+
+
+class RunnerStopped(Exception):
+    """The runner is draining or stopped, and does not accept requests anymore."""
+
+    pass
+
+
+class _Bucket(Generic[T, U]):
+    """The pending requests of a bucket, in priority order, then in submission order."""
+
+    def __init__(self) -> None:
+        # (priority, sequence number, deadline, (input, future, submission time))
+        self.heap: List[Tuple[int, int, float, Tuple[T, Future[U], float]]] = []
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def push(self, priority: int, seq: int, deadline: float, entry: Tuple[T, Future[U], float]) -> None:
+        heapq.heappush(self.heap, (priority, seq, deadline, entry))
+
+    def pop(self) -> Tuple[float, Tuple[T, Future[U], float]]:
+        _, _, deadline, entry = heapq.heappop(self.heap)
+        return deadline, entry
+
+    @property
+    def priority(self) -> int:
+        return self.heap[0][0]
+
+    @property
+    def oldest(self) -> float:
+        return min(entry[2] for _, _, _, entry in self.heap)
+
+    @property
+    def earliest_deadline(self) -> float:
+        return min(deadline for _, _, deadline, _ in self.heap)
+
+
+# The run_fn of a worker process of a BatchRunner
+_worker_run_fn: Optional[Callable[[Any], Any]] = None
+
+
+def _init_worker(
+    worker_init: Optional[Callable[[], Callable[[T], U]]],
+    run_fn: Optional[Callable[[T], U]],
+    num_threads: int,
+) -> None:
+    global _worker_run_fn
+    import torch
+
+    # The cores are split between the workers instead of being oversubscribed
+    torch.set_num_threads(num_threads)
+    _worker_run_fn = worker_init() if worker_init is not None else run_fn
+
+
+def _run_in_worker(inputs: T) -> U:
+    return _share_memory(_worker_run_fn(inputs))
+
+
+def _worker_ready() -> int:
+    return os.getpid()
+
+
+def _share_memory(x: Any) -> Any:
+    """Move the tensors of x to shared memory, so that they are passed to the other
+    process as a handle on the shared segment rather than being copied through a pipe."""
+    import torch
+
+    if torch.is_tensor(x):
+        return x.share_memory_()
+    if isinstance(x, (list, tuple)):
+        return type(x)(_share_memory(v) for v in x)
+    if isinstance(x, dict):
+        return {k: _share_memory(v) for k, v in x.items()}
+    return x
+
+
+def _blames_input(e: Exception) -> bool:
+    """Whether the failure of a batch may be caused by one of its inputs, rather than
+    by the runner or the resources of the model, which would fail its halves too."""
+    if isinstance(e, (BrokenProcessPool, CancelledError, MemoryError)):
+        return False
+    # torch.cuda.OutOfMemoryError, and the allocation failures of the CPU allocator
+    message = str(e).lower()
+    return not (isinstance(e, RuntimeError) and ("out of memory" in message or "not enough memory" in message))
+
+
+def _content_key(x: Any, h: Optional[Any] = None) -> bytes:
+    """A hash of the content of x, its tensors and arrays included, with their
+    dtypes and shapes."""
+    import numpy as np
+    import torch
+
+    root = h is None
+    if root:
+        h = hashlib.blake2b(digest_size=16)
+    if torch.is_tensor(x):
+        x = x.detach().cpu().numpy()
+    if isinstance(x, np.ndarray):
+        h.update(f"{x.dtype.str}{x.shape}".encode())
+        h.update(np.ascontiguousarray(x))
+    elif isinstance(x, (list, tuple)):
+        h.update(f"{type(x).__name__}{len(x)}".encode())
+        for v in x:
+            _content_key(v, h)
+    elif isinstance(x, dict):
+        h.update(f"dict{len(x)}".encode())
+        for k in sorted(x):
+            h.update(repr(k).encode())
+            _content_key(x[k], h)
+    else:
+        h.update(repr(x).encode())
+    return h.digest() if root else b""
+
+
 class BatchRunner(Generic[T, U]):
     def __init__(
         self,
@@ -17,60 +154,517 @@ class BatchRunner(Generic[T, U]):
         max_batch_size: int,
         max_latency_ms: int,
         collator: Collator[T],
+        pipeline_depth: int = 1,
+        workers: int = 0,
+        worker_init: Optional[Callable[[], Callable[[T], U]]] = None,
+        policy: Optional[AdaptiveBatchPolicy] = None,
+        isolate_failures: bool = False,
+        name: str = "batch_runner",
+        tracer: Optional[Any] = None,
+        coalesce: bool = False,
     ) -> None:
-        self.queue: Queue[Tuple[T, Future[U], float]] = Queue(
-            maxsize=2 * max_batch_size
-        )
+        # Pending requests, grouped by the bucket of their input: only inputs of
+        # the same bucket are batched together
+        self.buckets: Dict[Hashable, _Bucket[T, U]] = {}
+        self.num_pending = 0
+        self.seq = itertools.count()
+        # Moving average of the duration of a batch, in seconds
+        self.batch_duration = 0.0
         self.run_fn = run_fn
         self.max_batch_size = max_batch_size
         self.max_latency_ms = max_latency_ms
         self.collator = collator
+        # With a policy, the batch size and the batching delay adapt to the load,
+        # max_batch_size and max_latency_ms being upper bounds
+        self.policy = policy
+        if policy is not None:
+            policy.bind(max_batch_size, max_latency_ms)
+        # With a depth above 1, batches are collated, run and uncollated by three
+        # concurrent stages, up to pipeline_depth batches waiting between two stages
+        self.pipeline_depth = pipeline_depth
+        # With workers > 0, up to `workers` batches run at the same time, each in
+        # one of `workers` processes holding a replica of the model. The replica
+        # is created by worker_init in the worker (e.g. by loading the model), or
+        # run_fn is pickled and sent to the workers.
+        self.workers = workers
+        self.worker_init = worker_init
+        self.process_pool: Optional[ProcessPoolExecutor] = None
+        self.main_task: Optional[asyncio.Task] = None
+        self.tasks: Set[asyncio.Task] = set()
+        # Requests are accepted until the runner is drained, and the futures of
+        # the requests accepted are tracked until they are resolved
+        self.accepting = True
+        self.futures: Set[Future[U]] = set()
+        # With isolate_failures, a failed batch is split in two halves which are run
+        # again, until the inputs making it fail are isolated: one poison input only
+        # fails its own request instead of the whole batch
+        self.isolate_failures = isolate_failures
+        # Counters and histograms of the runner, exported with the label runner=name
+        self.name = name
+        self.metrics = BatchRunnerMetrics(self, name)
+        # With an OpenTelemetry tracer, each request is traced by a span from its
+        # submission to its result, with an event when its batch is dispatched
+        # and one when its batch is computed
+        self.tracer = tracer
+        self.spans: Dict[Future[U], Any] = {}
+        # With coalesce, concurrent requests of identical inputs share one request,
+        # keyed by a hash of the content of the input
+        self.coalesce = coalesce
+        self.in_flight: Dict[bytes, Tuple[asyncio.Task, List[int]]] = {}
+
+        # The scheduler sleeps on not_empty until a request arrives, then until the
+        # batch is full or its deadline is reached. Submitters sleep on not_full
+        # while max_pending requests are waiting, and are admitted by priority: the
+        # priorities of the sleeping submitters are counted in `waiting`.
+        self.waiting: Counter = Counter()
+        lock = asyncio.Lock()
+        self.not_empty = asyncio.Condition(lock)
+        self.not_full = asyncio.Condition(lock)
 
-    async def submit(self, input: T) -> U:
+    @property
+    def batch_size(self) -> int:
+        """The size at which a batch is run without waiting for its deadline."""
+        return self.policy.batch_size if self.policy else self.max_batch_size
+
+    @property
+    def max_wait(self) -> float:
+        """How long the oldest request of a batch waits for it to fill up, in seconds."""
+        return self.policy.max_wait if self.policy else self.max_latency_ms / 1000
+
+    @property
+    def max_pending(self) -> int:
+        return self.policy.max_pending if self.policy else 2 * self.max_batch_size
+
+    async def submit(
+        self,
+        input: T,
+        priority: int = PRIORITY_INTERACTIVE,
+        deadline: Optional[float] = None,
+    ) -> U:
+        """Run input in the next batch of its bucket and return its output.
+
+        Batches are filled with the requests of lowest priority value first, and so is
+        the queue once max_pending requests wait in it: the waiting submitters of the
+        most urgent priority are admitted first. A request whose deadline, in the time
+        of the event loop (loop.time()), passes before it is run fails with
+        DeadlineExceeded instead of taking a slot in a batch.
+
+        With coalesce, a request whose input is identical to the one of a request in
+        flight waits for the output of the latter, with its priority and deadline.
+        """
+        if not self.coalesce:
+            return await self.run_request(input, priority, deadline)
+
+        # Hashing large tensors would block the event loop
+        key = await asyncio.to_thread(_content_key, input)
+        if key in self.in_flight:
+            self.metrics.coalesced.inc()
+            task, waiters = self.in_flight[key]
+        else:
+            task = asyncio.ensure_future(self.run_request(input, priority, deadline))
+            waiters = [0]
+            self.in_flight[key] = (task, waiters)
+            task.add_done_callback(lambda _: self.forget(key, task))
+        waiters[0] += 1
+        try:
+            # The request is shared, one waiter giving up does not cancel it
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if waiters[0] == 1:
+                # The last waiter gave up, the next identical input is run anew
+                self.forget(key, task)
+                task.cancel()
+            raise
+        finally:
+            waiters[0] -= 1
+
+    def forget(self, key: bytes, task: asyncio.Task) -> None:
+        if key in self.in_flight and self.in_flight[key][0] is task:
+            del self.in_flight[key]
+
+    async def run_request(
+        self,
+        input: T,
+        priority: int = PRIORITY_INTERACTIVE,
+        deadline: Optional[float] = None,
+    ) -> U:
         loop = asyncio.get_running_loop()
         fut = loop.create_future()
-        await self.queue.put((input, fut, loop.time()))
-        return await fut
+        key = self.collator.bucket(input)
+        start = loop.time()
+        self.metrics.requests.inc()
+        if not self.accepting:
+            self.metrics.rejected.inc()
+            raise RunnerStopped()
+        if deadline is None:
+            deadline = math.inf
+        elif deadline <= start:
+            self.metrics.deadline_exceeded.inc()
+            raise DeadlineExceeded()
+        if self.policy:
+            self.policy.observe_arrival(start)
+        async with self.not_empty:
+            self.waiting[priority] += 1
+            try:
+                await asyncio.wait_for(
+                    self.not_full.wait_for(lambda: self.admissible(priority)),
+                    None if deadline == math.inf else deadline - loop.time(),
+                )
+            except asyncio.TimeoutError:
+                self.metrics.deadline_exceeded.inc()
+                raise DeadlineExceeded()
+            finally:
+                self.waiting[priority] -= 1
+                if not self.waiting[priority]:
+                    del self.waiting[priority]
+                    # The submitters of the next priority may be admitted now
+                    self.admit()
+            if not self.accepting:
+                self.metrics.rejected.inc()
+                raise RunnerStopped()
+            self.futures.add(fut)
+            if self.tracer is not None:
+                self.spans[fut] = self.tracer.start_span(
+                    f"{self.name}.submit", attributes={"priority": priority}
+                )
+            bucket = self.buckets.setdefault(key, _Bucket())
+            bucket.push(priority, next(self.seq), deadline, (input, fut, loop.time()))
+            self.num_pending += 1
+            # Only wake the scheduler when it has something new to do: start the
+            # deadline of a batch, fire a full one, or fire one before a deadline
+            if (
+                self.num_pending == 1
+                or len(bucket) >= self.batch_size
+                or deadline < math.inf
+            ):
+                self.not_empty.notify()
+        try:
+            result = await fut
+        except BaseException as e:
+            span = self.spans.get(fut)
+            if span is not None:
+                span.record_exception(e)
+            raise
+        finally:
+            self.futures.discard(fut)
+            span = self.spans.pop(fut, None)
+            if span is not None:
+                span.end()
+        latency = loop.time() - start
+        self.metrics.latency_seconds.observe(latency)
+        if self.policy:
+            self.policy.observe_latency(latency)
+        return result
 
-    async def main_loop(self):
-        loop = asyncio.get_running_loop()
+    def admissible(self, priority: int) -> bool:
+        """Whether a submitter of priority may queue its request: there is room for
+        it, and no submitter of a more urgent priority is waiting for room."""
+        if not self.accepting:
+            return True
+        return self.num_pending < self.max_pending and priority <= min(self.waiting)
 
-        while True:
-            if not self.queue.empty():
-                _, _, first_task_time = self.queue._queue[0]
-                latency_ms = int((loop.time() - first_task_time) * 1000)
-                if (
-                    self.queue.qsize() >= self.max_batch_size
-                    or latency_ms > self.max_latency_ms
-                ):
-                    batch_size = min(self.queue.qsize(), self.max_batch_size)
-                    inputs_list: List[T] = []
-                    futures: List[Future[U]] = []
-                    for _ in range(batch_size):
-                        input, future, _ = self.queue.get_nowait()
-                        inputs_list.append(input)
-                        futures.append(future)
-                    inputs = self.collator.collate(inputs_list)
+    def admit(self) -> None:
+        """Wake the submitters which may be admitted. Must be called with the lock held."""
+        room = self.max_pending - self.num_pending
+        if room <= 0 or not self.waiting:
+            return
+        if len(self.waiting) == 1:
+            # The first submitters woken up are the first ones admitted
+            self.not_full.notify(room)
+        else:
+            # Only the submitters of the most urgent priority are admitted, the
+            # others going back to sleep
+            self.not_full.notify_all()
+
+    def fire_time(self, bucket: _Bucket[T, U]) -> float:
+        """When a batch of the bucket is run: once it is full, once its oldest request
+        has waited max_wait, or in time for its earliest deadline. While the runner
+        drains, batches are run without waiting."""
+        if len(bucket) >= self.batch_size or not self.accepting:
+            return -math.inf
+        duration = self.policy.batch_duration(len(bucket)) if self.policy else self.batch_duration
+        return min(
+            bucket.oldest + self.max_wait,
+            bucket.earliest_deadline - duration - DEADLINE_SLACK,
+        )
 
+    async def next_batch(self) -> List[Tuple[T, Future[U], float]]:
+        loop = asyncio.get_running_loop()
+
+        async with self.not_empty:
+            while True:
+                await self.not_empty.wait_for(lambda: self.num_pending > 0)
+                while True:
+                    now = loop.time()
+                    fire_times = {key: self.fire_time(bucket) for key, bucket in self.buckets.items()}
+                    ready = [key for key, t in fire_times.items() if t <= now]
+                    if ready:
+                        # The bucket with the most urgent request, then the oldest one
+                        key = min(ready, key=lambda k: (self.buckets[k].priority, self.buckets[k].oldest))
+                        break
                     try:
-                        outputs = await asyncio.to_thread(self.run_fn, inputs)
-                        outputs_list = self.collator.uncollate(outputs)
-                        for output, future in zip(outputs_list, futures):
-                            future.set_result(output)
-                    except BaseException as e:
-                        err_msg = f"{e}"[:256]
-                        print(f"Could not process batch:\n{err_msg}")
-
-                        for future in futures:
-                            future.set_exception(Exception("Could not process batch"))
-
-                else:
-                    # Relinquish control to the event loop
-                    await asyncio.sleep(0.01)
+                        await asyncio.wait_for(self.not_empty.wait(), min(fire_times.values()) - now)
+                    except asyncio.TimeoutError:
+                        pass
+
+                bucket = self.buckets[key]
+                batch = []
+                while bucket and len(batch) < self.max_batch_size:
+                    deadline, entry = bucket.pop()
+                    self.num_pending -= 1
+                    # The submitter may have given up (e.g. client disconnection)
+                    if entry[1].done():
+                        continue
+                    if deadline <= now:
+                        self.metrics.deadline_exceeded.inc()
+                        entry[1].set_exception(DeadlineExceeded())
+                        continue
+                    batch.append(entry)
+                if not bucket:
+                    del self.buckets[key]
+                self.admit()
+                for _, future, submitted in batch:
+                    self.metrics.wait_seconds.observe(now - submitted)
+                    self.trace(future, "dispatched", {"batch_size": len(batch)})
+                if batch:
+                    return batch
+
+    async def run_batch(self, batch: List[Tuple[T, Future[U], float]]) -> None:
+        futures: List[Future[U]] = [future for _, future, _ in batch]
+
+        try:
+            inputs = self.collator.collate([input for input, _, _ in batch])
+            outputs = await self.run_model(inputs, len(batch))
+            self.resolve(futures, self.collator.uncollate(outputs))
+        except Exception as e:
+            await self.recover(batch, e)
+        except BaseException as e:
+            self.fail(futures, e)
+            raise
+
+    async def recover(self, batch: List[Tuple[T, Future[U], float]], e: Exception) -> None:
+        """Handle the failure of a batch, bisecting it with isolate_failures unless the
+        error can not be blamed on its inputs."""
+        self.metrics.failed_batches.inc()
+        # Requests which gave up are not run again
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not self.isolate_failures or len(batch) <= 1 or not _blames_input(e):
+            if self.isolate_failures and len(batch) == 1 and _blames_input(e):
+                self.metrics.poison_inputs.inc()
+            self.fail([future for _, future, _ in batch], e)
+            return
+
+        self.metrics.retried_batches.inc(2)
+        middle = len(batch) // 2
+        await self.run_batch(batch[:middle])
+        await self.run_batch(batch[middle:])
+
+    async def run_model(self, inputs: T, size: int, executor: Optional[ThreadPoolExecutor] = None) -> U:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            if self.process_pool is not None:
+                # Copying a large batch would block the event loop
+                inputs = await asyncio.to_thread(_share_memory, inputs)
+                pool = self.process_pool
+                try:
+                    outputs = await loop.run_in_executor(pool, _run_in_worker, inputs)
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed when out of memory): the batches it
+                    # ran fail, and the next ones run in a new pool
+                    if self.process_pool is pool:
+                        self.restart_workers()
+                    raise
+            elif executor is None:
+                outputs = await asyncio.to_thread(self.run_fn, inputs)
             else:
-                # Relinquish control to the event loop
-                await asyncio.sleep(0.01)
+                outputs = await loop.run_in_executor(executor, self.run_fn, inputs)
+        finally:
+            # Failed batches are measured too
+            duration = loop.time() - start
+            self.metrics.batches.inc()
+            self.metrics.batch_size.observe(size)
+            self.metrics.inference_seconds.observe(duration)
+        self.batch_duration += 0.2 * (duration - self.batch_duration)
+        if self.policy:
+            self.policy.observe_batch(size, duration)
+        return outputs
 
-    def run(self):
+    def resolve(self, futures: List[Future[U]], outputs_list: List[U]) -> None:
+        for output, future in zip(outputs_list, futures):
+            if not future.done():
+                self.trace(future, "computed")
+                future.set_result(output)
+
+    def trace(self, future: Future[U], event: str, attributes: Optional[Dict[str, Any]] = None) -> None:
+        """Add an event to the span of the request of future, if it is traced."""
+        span = self.spans.get(future)
+        if span is not None:
+            span.add_event(event, attributes or {})
+
+    def fail(self, futures: List[Future[U]], e: BaseException) -> None:
+        # e.g. the requests of a batch cancelled by stop were already rejected
+        futures = [future for future in futures if not future.done()]
+        if not futures:
+            return
+        err_msg = f"{e}"[:256]
+        print(f"Could not process batch:\n{err_msg}")
+
+        for future in futures:
+            future.set_exception(Exception("Could not process batch"))
+
+    async def collate_stage(self, executor: ThreadPoolExecutor, out: asyncio.Queue):
         loop = asyncio.get_running_loop()
-        loop.create_task(self.main_loop())
+
+        while True:
+            batch = await self.next_batch()
+            inputs_list = [input for input, _, _ in batch]
+            try:
+                inputs = await loop.run_in_executor(executor, self.collator.collate, inputs_list)
+            except Exception as e:
+                # Recovered off the pipeline, so that the next batches are not delayed
+                self.spawn(self.recover(batch, e))
+                continue
+            await out.put((batch, inputs))
+
+    async def run_stage(self, executor: ThreadPoolExecutor, inp: asyncio.Queue, out: asyncio.Queue):
+        async def run(batch, inputs):
+            try:
+                outputs = await self.run_model(inputs, len(batch), executor)
+            except Exception as e:
+                await self.recover(batch, e)
+                return
+            await out.put((batch, outputs))
+
+        slots = asyncio.Semaphore(max(1, self.workers))
+        while True:
+            await slots.acquire()
+            batch, inputs = await inp.get()
+            self.spawn(run(batch, inputs), slots)
+
+    def spawn(self, coro, slots: Optional[asyncio.Semaphore] = None) -> None:
+        """Run coro in a task, releasing one of the slots once it is done."""
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+
+        def done(task):
+            self.tasks.discard(task)
+            if slots is not None:
+                slots.release()
+
+        task.add_done_callback(done)
+
+    def new_process_pool(self) -> ProcessPoolExecutor:
+        import torch.multiprocessing as mp
+
+        # The workers are spawned, as forking a process running torch threads is unsafe
+        num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.worker_init, None if self.worker_init else self.run_fn, num_threads),
+        )
+
+    async def start_workers(self) -> None:
+        self.process_pool = self.new_process_pool()
+        # Start every worker now, rather than loading a model replica in the
+        # latency of the first requests
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self.process_pool, _worker_ready) for _ in range(self.workers))
+        )
+
+    def restart_workers(self) -> None:
+        """Replace a broken pool of workers, starting the new workers in the background."""
+        print("A worker of the batch runner died, restarting the workers")
+        broken, self.process_pool = self.process_pool, self.new_process_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.spawn(self.warm_workers(self.process_pool))
+
+    async def warm_workers(self, pool: ProcessPoolExecutor) -> None:
+        loop = asyncio.get_running_loop()
+        # A failure shows in the next batch
+        await asyncio.gather(
+            *(loop.run_in_executor(pool, _worker_ready) for _ in range(self.workers)),
+            return_exceptions=True,
+        )
+
+    async def uncollate_stage(self, executor: ThreadPoolExecutor, inp: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch, outputs = await inp.get()
+            try:
+                outputs_list = await loop.run_in_executor(executor, self.collator.uncollate, outputs)
+            except Exception as e:
+                self.spawn(self.recover(batch, e))
+                continue
+            self.resolve([future for _, future, _ in batch], outputs_list)
+
+    async def main_loop(self):
+        if self.workers > 0:
+            await self.start_workers()
+
+        if self.pipeline_depth <= 1:
+            slots = asyncio.Semaphore(max(1, self.workers))
+            while True:
+                # A batch is only formed once it can run, so that it is as large as possible
+                await slots.acquire()
+                batch = await self.next_batch()
+                self.spawn(self.run_batch(batch), slots)
+
+        # Each stage has its own thread, so the model never waits for the
+        # collation of the next batch or the fan-out of the previous one
+        collated: asyncio.Queue = asyncio.Queue(maxsize=self.pipeline_depth)
+        computed: asyncio.Queue = asyncio.Queue(maxsize=self.pipeline_depth)
+        executors = [ThreadPoolExecutor(max_workers=1) for _ in range(3)]
+        try:
+            await asyncio.gather(
+                self.collate_stage(executors[0], collated),
+                self.run_stage(executors[1], collated, computed),
+                self.uncollate_stage(executors[2], computed),
+            )
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=False)
+
+    def start(self) -> asyncio.Task:
+        """Start the scheduler in the running event loop, e.g. from a startup hook."""
+        self.accepting = True
+        self.main_task = asyncio.get_running_loop().create_task(self.main_loop())
+        return self.main_task
+
+    def run(self):
+        self.start()
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting requests and run the pending ones, for up to timeout seconds.
+
+        New requests, and the requests waiting for room in the queue, fail with
+        RunnerStopped. So do the requests which were not run once timeout is reached.
+        """
+        self.accepting = False
+        async with self.not_empty:
+            self.not_full.notify_all()
+            # The pending batches are run without waiting for them to fill up
+            self.not_empty.notify()
+        if self.futures:
+            await asyncio.wait(set(self.futures), timeout=timeout)
+        for future in list(self.futures):
+            if not future.done():
+                future.set_exception(RunnerStopped())
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """Drain the runner, then stop its scheduler, its stages and its workers."""
+        await self.drain(timeout)
+        tasks = list(self.tasks)
+        if self.main_task is not None:
+            tasks.append(self.main_task)
+            self.main_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = None
@@ -0,0 +1,149 @@
+"""Microbenchmark of the BatchRunner scheduler.
+
+Compares the event-driven scheduler of batch_runner.py, sequential, pipelined
+and with an adaptive batching policy, with the previous implementation, which polled its queue every 10 ms.
+The model and the collator are replaced by sleeps, so only the scheduling
+overhead is measured: the latency of each request (p50/p99) under Poisson
+arrivals, and the CPU burnt while the runner is idle.
+
+    python bench_batch_runner.py --rate 200 --requests 2000
+    python bench_batch_runner.py --rate 1500 --batch-ms 10 --collate-ms 4
+    python bench_batch_runner.py --rate 50 --max-latency-ms 200 --slo-ms 100
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from asyncio.queues import Queue
+from typing import List
+
+from batch_policy import AdaptiveBatchPolicy
+from batch_runner import BatchRunner
+from collators import Collator
+
+
+class ListCollator(Collator[list]):
+    def __init__(self, cost_ms: float = 0.0) -> None:
+        super().__init__()
+        self.cost_ms = cost_ms
+
+    def collate(self, inputs: List[list]) -> list:
+        time.sleep(self.cost_ms / 1000)
+        return inputs
+
+    def uncollate(self, input: list) -> List[list]:
+        time.sleep(self.cost_ms / 1000)
+        return input
+
+
+class PollingBatchRunner:
+    """The previous scheduler, polling the queue every 10 ms."""
+
+    def __init__(self, run_fn, max_batch_size, max_latency_ms, collator) -> None:
+        self.queue = Queue(maxsize=2 * max_batch_size)
+        self.run_fn = run_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency_ms = max_latency_ms
+        self.collator = collator
+
+    async def submit(self, input):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        await self.queue.put((input, fut, loop.time()))
+        return await fut
+
+    async def main_loop(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            if not self.queue.empty():
+                _, _, first_task_time = self.queue._queue[0]
+                latency_ms = int((loop.time() - first_task_time) * 1000)
+                if (
+                    self.queue.qsize() >= self.max_batch_size
+                    or latency_ms > self.max_latency_ms
+                ):
+                    batch_size = min(self.queue.qsize(), self.max_batch_size)
+                    batch = [self.queue.get_nowait() for _ in range(batch_size)]
+                    inputs = self.collator.collate([input for input, _, _ in batch])
+                    outputs = await asyncio.to_thread(self.run_fn, inputs)
+                    for output, (_, future, _) in zip(self.collator.uncollate(outputs), batch):
+                        future.set_result(output)
+                else:
+                    await asyncio.sleep(0.01)
+            else:
+                await asyncio.sleep(0.01)
+
+    def run(self):
+        loop = asyncio.get_running_loop()
+        loop.create_task(self.main_loop())
+
+
+def percentile(samples: List[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+async def bench(make_runner, args) -> dict:
+    def run_fn(inputs):
+        time.sleep((args.batch_ms + args.item_ms * len(inputs)) / 1000)
+        return inputs
+
+    runner = make_runner(run_fn, args.max_batch_size, args.max_latency_ms, ListCollator(args.collate_ms))
+    runner.run()
+    loop = asyncio.get_running_loop()
+
+    async def request(i):
+        start = loop.time()
+        await runner.submit(i)
+        return loop.time() - start
+
+    tasks = []
+    for i in range(args.requests):
+        tasks.append(asyncio.create_task(request(i)))
+        await asyncio.sleep(random.expovariate(args.rate))
+    latencies = await asyncio.gather(*tasks)
+
+    cpu = time.process_time()
+    await asyncio.sleep(args.idle)
+    idle_cpu = (time.process_time() - cpu) / args.idle
+
+    return {
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "mean": statistics.mean(latencies) * 1000,
+        "idle_cpu": idle_cpu * 100,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=200.0, help="Requests per second")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-latency-ms", type=int, default=20)
+    parser.add_argument("--batch-ms", type=float, default=5.0, help="Duration of a batch")
+    parser.add_argument("--item-ms", type=float, default=0.0, help="Duration of a batch per input")
+    parser.add_argument("--slo-ms", type=float, default=50.0, help="p99 latency SLO of the adaptive policy")
+    parser.add_argument("--collate-ms", type=float, default=0.0, help="Duration of collate and uncollate")
+    parser.add_argument("--pipeline-depth", type=int, default=2)
+    parser.add_argument("--idle", type=float, default=2.0, help="Seconds of idle CPU measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'scheduler':<10} {'p50 (ms)':>10} {'p99 (ms)':>10} {'mean (ms)':>10} {'idle CPU %':>11}")
+    runners = {
+        "polling": PollingBatchRunner,
+        "event": BatchRunner,
+        "pipeline": lambda *a: BatchRunner(*a, pipeline_depth=args.pipeline_depth),
+        "adaptive": lambda *a: BatchRunner(*a, policy=AdaptiveBatchPolicy(args.slo_ms)),
+    }
+    for name, make_runner in runners.items():
+        random.seed(args.seed)
+        r = asyncio.run(bench(make_runner, args))
+        print(f"{name:<10} {r['p50']:>10.2f} {r['p99']:>10.2f} {r['mean']:>10.2f} {r['idle_cpu']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
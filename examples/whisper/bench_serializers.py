@@ -0,0 +1,84 @@
+"""Microbenchmark of ArraySerializer.
+
+Compares the zero-copy .npy path of serializers.py with the previous
+implementation, which copied the array through BytesIO buffers. For arrays of
+several sizes, it measures the latency of deserialize and serialize, and the
+bytes they copy, counted as the peak of the memory allocated while they run
+(the array itself not included, as it is allocated by the model).
+
+    python bench_serializers.py
+    python bench_serializers.py --sizes-mb 1 16 256 --repeat 5
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+from io import BytesIO
+from typing import Callable, List
+
+import numpy as np
+
+from serializers import ArraySerializer
+
+
+class LegacyArraySerializer:
+    """The previous implementation, copying the data through BytesIO buffers."""
+
+    def serialize(self, value: np.ndarray) -> bytes:
+        buff = BytesIO()
+        np.save(buff, value)
+        buff.seek(0)
+        return buff.read()
+
+    def deserialize(self, data: bytes) -> np.ndarray:
+        buff = BytesIO()
+        buff.write(data)
+        buff.seek(0)
+        return np.load(buff)
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict:
+    durations: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+        del result
+
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return {"ms": statistics.median(durations) * 1000, "copied": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 16, 128])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    serializers = {"legacy": LegacyArraySerializer(), "zero-copy": ArraySerializer()}
+    print(f"{'size (MB)':>9} {'serializer':<10} {'op':<12} {'ms':>9} {'copied (MB)':>12}")
+    for size_mb in args.sizes_mb:
+        x = np.random.rand(int(size_mb * 2**20) // 8)
+        data = LegacyArraySerializer().serialize(x)
+        for name, serializer in serializers.items():
+            ops = {
+                "deserialize": lambda: serializer.deserialize(data),
+                # The parts of the zero-copy serializer are sent as they are
+                "serialize": (
+                    (lambda: serializer.serialize_parts(x))
+                    if isinstance(serializer, ArraySerializer)
+                    else (lambda: serializer.serialize(x))
+                ),
+            }
+            for op, fn in ops.items():
+                r = measure(fn, args.repeat)
+                print(f"{size_mb:>9g} {name:<10} {op:<12} {r['ms']:>9.3f} {r['copied'] / 2**20:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
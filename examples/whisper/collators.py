@@ -1,11 +1,15 @@
 import torch
-from typing import Generic, TypeVar, List
+from typing import Dict, Generic, Hashable, TypeVar, List
 
 
 T = TypeVar("T")
 
 
 class Collator(Generic[T]):
+    def bucket(self, input: T) -> Hashable:
+        """Inputs are only batched with inputs of the same bucket."""
+        return None
+
     def collate(self, inputs: List[T]) -> T:
         raise NotImplementedError()
 
@@ -23,3 +27,67 @@ class TorchCollator(Collator[T]):
 
     def uncollate(self, input: T) -> List[T]:
         return [x if self.stack else x.unsqueeze(0) for x in input]
+
+
+class WaveformCollator(Collator[torch.Tensor]):
+    """Batches waveforms of different lengths, e.g. audio windows before feature
+    extraction.
+
+    Inputs are 1-D arrays or tensors of samples. They are zero-padded, or truncated,
+    to n_samples and collated to a (batch, n_samples) float32 tensor. The outputs,
+    e.g. (batch, n_mels, n_frames) features, are uncollated to (1, n_mels, n_frames)
+    tensors, the shape of the input_features of whisper.
+    """
+
+    def __init__(self, n_samples: int) -> None:
+        super().__init__()
+        self.n_samples = n_samples
+
+    def collate(self, inputs: List[torch.Tensor]) -> torch.Tensor:
+        waveforms = torch.zeros((len(inputs), self.n_samples), dtype=torch.float32)
+        for i, x in enumerate(inputs):
+            x = torch.as_tensor(x).reshape(-1)[: self.n_samples]
+            waveforms[i, : len(x)] = x
+        return waveforms
+
+    def uncollate(self, input: torch.Tensor) -> List[torch.Tensor]:
+        return [x.unsqueeze(0) for x in input]
+
+
+class BucketingCollator(Collator[torch.Tensor]):
+    """Batches token sequences of different lengths, e.g. LLM prompts.
+
+    Inputs are (1, length) tensors of token ids. They are bucketed by length, by
+    steps of bucket_width tokens, so that a batch wastes little compute on padding.
+    The sequences of a batch are left-padded to the same length, for generation,
+    and collated to the input_ids and attention_mask arguments of the model.
+    """
+
+    def __init__(self, pad_token_id: int, bucket_width: int = 16) -> None:
+        super().__init__()
+        self.pad_token_id = pad_token_id
+        self.bucket_width = bucket_width
+
+    def bucket(self, input: torch.Tensor) -> Hashable:
+        return (input.shape[-1] + self.bucket_width - 1) // self.bucket_width
+
+    def collate(self, inputs: List[torch.Tensor]) -> Dict[str, torch.Tensor]:
+        length = max(x.shape[-1] for x in inputs)
+        input_ids = torch.full(
+            (len(inputs), length), self.pad_token_id, dtype=inputs[0].dtype
+        )
+        attention_mask = torch.zeros((len(inputs), length), dtype=torch.long)
+        for i, x in enumerate(inputs):
+            n = x.shape[-1]
+            input_ids[i, length - n :] = x.reshape(-1)
+            attention_mask[i, length - n :] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+    def uncollate(self, input: torch.Tensor) -> List[torch.Tensor]:
+        # The left padding is removed from the generated sequences
+        outputs = []
+        for x in input:
+            tokens = (x != self.pad_token_id).nonzero()
+            start = tokens[0].item() if len(tokens) > 0 else len(x)
+            outputs.append(x[start:].unsqueeze(0))
+        return outputs
@@ -0,0 +1,39 @@
+import numpy as np
+import torch
+
+
+class LogMelExtractor:
+    """The log-mel features of whisper, computed for a batch of waveforms at once.
+
+    It is equivalent to the WhisperFeatureExtractor whose parameters and mel filters
+    it uses, which computes the features of one waveform at a time with numpy, but
+    computes the STFT and the mel projection of the whole batch with torch. Inputs
+    are (batch, n_samples) tensors of waveforms, already padded or truncated to
+    n_samples, and outputs (batch, feature_size, n_samples // hop_length) tensors.
+    """
+
+    def __init__(self, feature_extractor) -> None:
+        self.n_samples = feature_extractor.n_samples
+        self.n_fft = feature_extractor.n_fft
+        self.hop_length = feature_extractor.hop_length
+        filters = torch.tensor(np.asarray(feature_extractor.mel_filters), dtype=torch.float32)
+        # The filters are (n_mels, n_freqs) in some versions of transformers, and
+        # (n_freqs, n_mels) in others
+        self.mel_filters = filters if filters.shape[0] == feature_extractor.feature_size else filters.T
+        self.window = torch.hann_window(self.n_fft)
+
+    @torch.no_grad()
+    def __call__(self, waveforms: torch.Tensor) -> torch.Tensor:
+        stft = torch.stft(
+            waveforms.float(),
+            self.n_fft,
+            self.hop_length,
+            window=self.window,
+            return_complex=True,
+        )
+        magnitudes = stft[..., :-1].abs() ** 2
+        log_spec = torch.clamp(self.mel_filters @ magnitudes, min=1e-10).log10()
+        # The dynamic range of the features of each waveform is limited to 80 dB
+        max_val = log_spec.amax(dim=(1, 2), keepdim=True)
+        log_spec = torch.maximum(log_spec, max_val - 8.0)
+        return (log_spec + 4.0) / 4.0
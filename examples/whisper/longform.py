@@ -0,0 +1,81 @@
+import asyncio
+import re
+from difflib import SequenceMatcher
+from typing import AsyncIterator, Awaitable, Callable, List
+
+import numpy as np
+
+
+# Whisper transcribes 30 s of audio at most. Longer audio is split in windows of
+# WINDOW_S seconds, two consecutive windows sharing OVERLAP_S seconds so that a
+# word cut at the end of a window is whole at the start of the next one.
+WINDOW_S = 30.0
+OVERLAP_S = 5.0
+# How many words, at the end of a transcript and at the start of the next one, are
+# searched for the words of the overlap
+MAX_OVERLAP_WORDS = 48
+# How many words the transcripts of an overlap must have in common to be merged
+MIN_MATCH_WORDS = 2
+# How many windows of a request are transcribed at once. The next windows are not
+# decoded until one of them is transcribed, so that a long upload does not queue
+# all its windows at once, ahead of the other requests.
+MAX_WINDOWS_IN_FLIGHT = 4
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def stitch(transcripts: List[str]) -> str:
+    """Join the transcripts of overlapping windows, keeping the words of their
+    overlaps once.
+
+    The overlap of two transcripts is found as the longest run of words common to
+    the end of the first and the start of the second, ignoring case and punctuation.
+    The transcripts are cut in the middle of that run, so that each keeps the words
+    it transcribed furthest from the edges of its window. Transcripts without such
+    a run in common are concatenated.
+    """
+    words: List[str] = []
+    for transcript in transcripts:
+        current = transcript.split()
+        tail = [_normalize(w) for w in words[-MAX_OVERLAP_WORDS:]]
+        head = [_normalize(w) for w in current[:MAX_OVERLAP_WORDS]]
+        match = SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(
+            0, len(tail), 0, len(head)
+        )
+        if match.size >= MIN_MATCH_WORDS:
+            middle = match.size // 2
+            words = words[: len(words) - len(tail) + match.a + middle]
+            current = current[match.b + middle :]
+        words.extend(current)
+    return " ".join(words)
+
+
+async def transcribe_long(
+    windows: AsyncIterator[np.ndarray],
+    transcribe: Callable[[np.ndarray], Awaitable[str]],
+    max_in_flight: int = MAX_WINDOWS_IN_FLIGHT,
+) -> str:
+    """Transcribe overlapping windows of audio and stitch their transcripts.
+
+    Each window is submitted as soon as it is decoded, while the next ones are still
+    being uploaded, so that the windows of a clip run in the same batches, along with
+    the other requests. The latency of a long clip thus grows with the throughput of
+    the model rather than with its duration. Up to max_in_flight windows are
+    transcribed at once, decoding pausing until one of them is done.
+    """
+    in_flight = asyncio.Semaphore(max_in_flight)
+    tasks = []
+    try:
+        async for window in windows:
+            await in_flight.acquire()
+            task = asyncio.ensure_future(transcribe(window))
+            task.add_done_callback(lambda _: in_flight.release())
+            tasks.append(task)
+        transcripts = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return stitch(transcripts)
@@ -0,0 +1,190 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Sequence, Tuple
+
+
+# Buckets of the histograms of durations, in seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Buckets of the histograms of batch sizes
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: Tuple[Sequence[str], Sequence[str]]) -> List[str]:
+        return [f"{name}_total{_format_labels(*labels)} {_format_value(self.value)}"]
+
+
+class Gauge:
+    """A gauge whose value is read from a callback when the metrics are collected."""
+
+    def __init__(self, fn: Callable[[], float]) -> None:
+        self.fn = fn
+
+    def samples(self, name: str, labels: Tuple[Sequence[str], Sequence[str]]) -> List[str]:
+        return [f"{name}{_format_labels(*labels)} {_format_value(self.fn())}"]
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def samples(self, name: str, labels: Tuple[Sequence[str], Sequence[str]]) -> List[str]:
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{name}_bucket{_format_labels(*labels, extra=le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(*labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(*labels)} {cumulative}")
+        return lines
+
+
+class MetricFamily:
+    """A metric and its children, one per combination of label values."""
+
+    def __init__(self, name: str, help: str, kind: str, labelnames: Sequence[str], factory) -> None:
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *labelvalues: str, **kwargs):
+        labelvalues = tuple(labelvalues) or tuple(kwargs[name] for name in self.labelnames)
+        with self._lock:
+            if labelvalues not in self.children:
+                self.children[labelvalues] = self.factory()
+            return self.children[labelvalues]
+
+    def set_child(self, child, *labelvalues: str) -> None:
+        with self._lock:
+            self.children[tuple(labelvalues)] = child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = list(self.children.items())
+        for labelvalues, child in children:
+            lines.extend(child.samples(self.name, (self.labelnames, labelvalues)))
+        return lines
+
+
+class Registry:
+    """The metrics of a process, rendered in the Prometheus text exposition format."""
+
+    def __init__(self) -> None:
+        self.families: Dict[str, MetricFamily] = {}
+        self._lock = threading.Lock()
+
+    def _family(self, name, help, kind, labelnames, factory) -> MetricFamily:
+        with self._lock:
+            if name not in self.families:
+                self.families[name] = MetricFamily(name, help, kind, labelnames, factory)
+            return self.families[name]
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._family(name, help, "counter", labelnames, Counter)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._family(name, help, "gauge", labelnames, None)
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS
+    ) -> MetricFamily:
+        return self._family(name, help, "histogram", labelnames, lambda: Histogram(buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            families = list(self.families.values())
+        lines = []
+        for family in families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class BatchRunnerMetrics:
+    """The metrics of a BatchRunner, labelled with the name of the runner."""
+
+    def __init__(self, runner, name: str, registry: Registry = registry) -> None:
+        labels = ("runner",)
+        registry.gauge(
+            "batch_runner_queue_depth", "Number of requests waiting for a batch.", labels
+        ).set_child(Gauge(lambda: runner.num_pending), name)
+        self.requests = registry.counter(
+            "batch_runner_requests", "Number of submitted requests.", labels
+        ).labels(name)
+        self.coalesced = registry.counter(
+            "batch_runner_coalesced", "Number of requests sharing the request of an identical input.", labels
+        ).labels(name)
+        self.rejected = registry.counter(
+            "batch_runner_rejected", "Number of requests rejected while draining.", labels
+        ).labels(name)
+        self.batches = registry.counter(
+            "batch_runner_batches", "Number of batches run, retries included.", labels
+        ).labels(name)
+        self.failed_batches = registry.counter(
+            "batch_runner_failed_batches", "Number of batches which failed.", labels
+        ).labels(name)
+        self.retried_batches = registry.counter(
+            "batch_runner_retried_batches", "Number of halves of failed batches run again.", labels
+        ).labels(name)
+        self.poison_inputs = registry.counter(
+            "batch_runner_poison_inputs", "Number of inputs isolated as failing their batch.", labels
+        ).labels(name)
+        self.deadline_exceeded = registry.counter(
+            "batch_runner_deadline_exceeded", "Number of requests dropped past their deadline.", labels
+        ).labels(name)
+        self.batch_size = registry.histogram(
+            "batch_runner_batch_size", "Number of requests per batch.", labels, SIZE_BUCKETS
+        ).labels(name)
+        self.wait_seconds = registry.histogram(
+            "batch_runner_wait_seconds", "Time from submission to dispatch in a batch.", labels
+        ).labels(name)
+        self.inference_seconds = registry.histogram(
+            "batch_runner_inference_seconds", "Duration of run_fn per batch.", labels
+        ).labels(name)
+        self.latency_seconds = registry.histogram(
+            "batch_runner_latency_seconds", "Time from submission to result.", labels
+        ).labels(name)
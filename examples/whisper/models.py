@@ -0,0 +1,23 @@
+from typing import Callable
+
+import torch
+from transformers import WhisperForConditionalGeneration
+
+from model_store import load_from_store
+
+
+STT = "openai/whisper-tiny.en"
+MODEL_STORE_ADDR = "172.17.0.1"
+
+
+def load_whisper() -> Callable[[torch.Tensor], torch.Tensor]:
+    """Load the whisper model and return its run_fn. Used as the worker_init of the
+    whisper BatchRunner, each worker process loading its own replica of the model."""
+    whisper_model = load_from_store(STT, WhisperForConditionalGeneration, MODEL_STORE_ADDR)
+    whisper_model.eval()
+
+    def run_whisper(x: torch.Tensor) -> torch.Tensor:
+        # Up to the 448 tokens whisper decodes, so that no 30 s window is truncated
+        return whisper_model.generate(x, max_length=448)
+
+    return run_whisper
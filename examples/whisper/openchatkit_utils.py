@@ -9,10 +9,23 @@ class StopWordsCriteria(StoppingCriteria):
         self._partial_result = ""
         self._stream_buffer = ""
         self._stream_callback = stream_callback
+        # The partial results of the other sequences of a batch
+        self._batch_results = None
 
     def __call__(
         self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
     ) -> bool:
+        if input_ids.shape[0] > 1:
+            # A batch stops once every sequence has generated a stop word
+            if self._batch_results is None:
+                self._batch_results = [""] * input_ids.shape[0]
+            done = True
+            for i, token in enumerate(input_ids[:, -1]):
+                if not any(w in self._batch_results[i] for w in self._stop_words):
+                    self._batch_results[i] += self._tokenizer.decode(token)
+                    done = done and any(w in self._batch_results[i] for w in self._stop_words)
+            return done
+
         first = not self._partial_result
         text = self._tokenizer.decode(input_ids[0, -1])
         self._partial_result += text
@@ -31,3 +44,10 @@ class StopWordsCriteria(StoppingCriteria):
             self._stream_callback(self._stream_buffer + text)
             self._stream_buffer = ""
         return False
+
+
+def cut_after_stop_words(text: str, stop_words) -> str:
+    """Cut a completion after its first stop word. In a batch, a sequence goes on
+    generating after its stop word until the other sequences reach theirs."""
+    ends = [text.index(w) + len(w) for w in stop_words if w in text]
+    return text[: min(ends)] if ends else text
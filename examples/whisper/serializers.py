@@ -1,5 +1,9 @@
+import warnings
 from typing import (
+    AsyncIterator,
     Callable,
+    Dict,
+    List,
     Tuple,
     Annotated,
     Type,
@@ -11,11 +15,27 @@ from typing import (
 )
 import numpy as np
 import torch
-from fastapi import File, HTTPException
+from fastapi import File, HTTPException, Request
 from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
 from io import BytesIO
 import soundfile as sf
 
+from audio_stream import audio_windows
+from wire_formats import (
+    ENCODINGS,
+    FORMATS,
+    MAX_DECOMPRESSED_SIZE,
+    DecompressedSizeError,
+    NpyFormat,
+    TorchFormat,
+    WireFormat,
+    media_type,
+    negotiate_encoding,
+    negotiate_format,
+)
+
 
 T = TypeVar("T")
 
@@ -28,19 +48,57 @@ class Serializer(Generic[T]):
         raise NotImplementedError()
 
 
+def _formats(torch_format: bool) -> Dict[str, WireFormat]:
+    """The wire formats of the arrays of an endpoint: torch.save pickles only for the
+    endpoints of tensors, as they are unpickled."""
+    if torch_format:
+        return FORMATS
+    return {k: v for k, v in FORMATS.items() if not isinstance(v, TorchFormat)}
+
+
 class ArraySerializer(Serializer[T]):
-    def __init__(self, torch_format: bool = False) -> None:
+    """Serializes arrays, or tensors with torch_format, in one of the wire formats.
+
+    The format is given by its media type, .npy files being used by default, or
+    torch.save pickles with torch_format, which are accepted only then. The data
+    can be compressed with one of the ENCODINGS of wire_formats.
+    """
+
+    def __init__(
+        self,
+        torch_format: bool = False,
+        media_type: Optional[str] = None,
+        content_encoding: Optional[str] = None,
+    ) -> None:
         super().__init__()
         self.torch_format = torch_format
+        if media_type in (None, "application/octet-stream"):
+            media_type = TorchFormat.media_type if torch_format else NpyFormat.media_type
+        formats = _formats(torch_format)
+        if media_type not in formats:
+            raise HTTPException(status_code=415, detail=f"Unsupported media type {media_type}")
+        self.format = formats[media_type]
+        if content_encoding in (None, "identity"):
+            content_encoding = None
+        elif content_encoding not in ENCODINGS:
+            raise HTTPException(status_code=415, detail=f"Unsupported encoding {content_encoding}")
+        self.content_encoding = content_encoding
 
     def serialize(self, value: T) -> bytes:
-        buff = BytesIO()
-        if self.torch_format:
-            torch.save(value, buff)
-        else:
-            np.save(buff, value)
-        buff.seek(0)
-        return buff.read()
+        return b"".join(self.serialize_parts(value))
+
+    def serialize_parts(self, value: T) -> List[Union[bytes, memoryview]]:
+        """Serialize value in parts, to be sent one after the other.
+
+        Arrays of plain data are serialized as a header followed by a view of their
+        memory, which is thus never copied when they are C-contiguous, unless the
+        data is compressed.
+        """
+        parts = self.format.encode(value)
+        if self.content_encoding is not None:
+            compress, _ = ENCODINGS[self.content_encoding]
+            return [compress(b"".join(parts))]
+        return parts
 
     def deserialize(
         self,
@@ -48,22 +106,31 @@ class ArraySerializer(Serializer[T]):
         dtype: Optional[Union[torch.dtype, Type]] = None,
         size: Optional[Tuple[int, ...]] = None,
     ) -> T:
-        buff = BytesIO()
-        buff.write(data)
-        buff.seek(0)
-
         try:
-            x = torch.load(buff) if self.torch_format else np.load(buff)
+            if self.content_encoding is not None:
+                _, decompress = ENCODINGS[self.content_encoding]
+                data = decompress(data, MAX_DECOMPRESSED_SIZE)
+            # Arrays of plain data are wrapped without being copied, the array, or
+            # the tensor, being a read-only view of the request body
+            x = self.format.decode(data)
+            if isinstance(x, np.ndarray) and self.torch_format:
+                with warnings.catch_warnings():
+                    warnings.filterwarnings("ignore", message=".*not writable.*")
+                    x = torch.from_numpy(x)
+            elif torch.is_tensor(x) and not self.torch_format:
+                x = x.numpy()
+        except DecompressedSizeError:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Data larger than {MAX_DECOMPRESSED_SIZE} bytes once decompressed",
+            )
         except:
             raise HTTPException(
                 status_code=400,
-                detail=f"Could not deserialize data: not a {'torch' if self.torch_format else 'numpy'} file",
+                detail=f"Could not deserialize data: not a {self.format.name} file",
             )
 
-        if self._get_generic_type() is not None and not isinstance(
-            x, self._get_generic_type()
-        ):
-            print(type(x))
+        if not isinstance(x, torch.Tensor if self.torch_format else np.ndarray):
             raise HTTPException(
                 status_code=400,
                 detail=f"Not a {'torch tensor' if self.torch_format else 'numpy array'}",
@@ -76,8 +143,8 @@ class ArraySerializer(Serializer[T]):
             )
 
         if size is not None and not (
-            len(x.size()) == len(size)
-            and all([a == b or b == -1 for a, b in zip(x.size(), size)])
+            len(x.shape) == len(size)
+            and all([a == b or b == -1 for a, b in zip(x.shape, size)])
         ):
             raise HTTPException(
                 status_code=400,
@@ -122,19 +189,112 @@ class AudioSerializer(Serializer[T]):
         return x
 
 
+class PartsResponse(Response):
+    """A response whose body is sent in parts, without joining them in one buffer."""
+
+    def __init__(
+        self,
+        parts: List[Union[bytes, memoryview]],
+        media_type: str = "application/octet-stream",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.parts = parts
+        length = sum(memoryview(part).nbytes for part in parts)
+        super().__init__(
+            content=b"",
+            media_type=media_type,
+            headers={**(headers or {}), "content-length": str(length)},
+        )
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        for i, part in enumerate(self.parts):
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": part,
+                    "more_body": i < len(self.parts) - 1,
+                }
+            )
+        if not self.parts:
+            await send({"type": "http.response.body", "body": b""})
+        if self.background is not None:
+            await self.background()
+
+
+async def read_array(
+    request: Request,
+    dtype: Optional[Union[torch.dtype, Type]] = None,
+    size: Optional[Tuple[int, ...]] = None,
+    torch_format: bool = False,
+) -> Tuple[T, ArraySerializer]:
+    """Deserialize the array of a request, and return it with the serializer of the
+    response.
+
+    The array is either the body of the request, or the first file of a multipart
+    form. Its format is given by its Content-Type, and its compression by its
+    Content-Encoding. The format of the response is negotiated from the Accept
+    header, the format of the request being used by default, and its compression
+    from the Accept-Encoding header.
+    """
+    if media_type(request.headers.get("content-type")) == "multipart/form-data":
+        form = await request.form()
+        upload = next((v for v in form.values() if isinstance(v, UploadFile)), None)
+        if upload is None:
+            raise HTTPException(status_code=400, detail="No file in the form")
+        data = await upload.read()
+        headers = upload.headers
+    else:
+        data = await request.body()
+        headers = request.headers
+    serializer = ArraySerializer(
+        torch_format=torch_format,
+        media_type=media_type(headers.get("content-type")),
+        content_encoding=headers.get("content-encoding"),
+    )
+    x = serializer.deserialize(data, dtype, size)
+
+    format = negotiate_format(
+        request.headers.get("accept"), serializer.format, _formats(torch_format)
+    )
+    if format is None:
+        raise HTTPException(status_code=406, detail="No acceptable media type")
+    response_serializer = ArraySerializer(
+        torch_format=torch_format,
+        media_type=format.media_type,
+        content_encoding=negotiate_encoding(request.headers.get("accept-encoding")),
+    )
+    return x, response_serializer
+
+
+def array_response(serializer: ArraySerializer, value: T) -> PartsResponse:
+    headers = {"vary": "Accept, Accept-Encoding"}
+    if serializer.content_encoding is not None:
+        headers["content-encoding"] = serializer.content_encoding
+    return PartsResponse(
+        serializer.serialize_parts(value),
+        media_type=serializer.format.media_type,
+        headers=headers,
+    )
+
+
 def array_endpoint(
     dtype: Optional[Union[torch.dtype, Type]] = None,
     size: Optional[Tuple[int, ...]] = None,
     torch_format: bool = False,
-) -> Callable[[Callable[[T], T]], Callable[[Annotated[bytes, File()]], Response]]:
-    def inner(f: Callable[[T], T]) -> Callable[[Annotated[bytes, File()]], Response]:
-        def g(data: Annotated[bytes, File()]) -> Response:
-            serializer = ArraySerializer(torch_format=torch_format)
-            x = serializer.deserialize(data, dtype, size)
-            y = f(x)
-            return Response(
-                content=serializer.serialize(y), media_type="application/octet-stream"
-            )
+) -> Callable[[Callable[[T], T]], Callable[[Request], Coroutine[Response, None, None]]]:
+    def inner(f: Callable[[T], T]) -> Callable[[Request], Coroutine[Response, None, None]]:
+        async def g(request: Request) -> Response:
+            x, serializer = await read_array(request, dtype, size, torch_format)
+            # f is run in a thread, as it would be as a synchronous endpoint
+            y = await run_in_threadpool(f, x)
+            return array_response(serializer, y)
 
         return g
 
@@ -147,18 +307,15 @@ def async_array_endpoint(
     torch_format: bool = False,
 ) -> Callable[
     [Callable[[T], Coroutine[T, None, None]]],
-    Callable[[Annotated[bytes, File()]], Coroutine[Response, None, None]],
+    Callable[[Request], Coroutine[Response, None, None]],
 ]:
     def inner(
         f: Callable[[T], Coroutine[T, None, None]]
-    ) -> Callable[[Annotated[bytes, File()]], Coroutine[Response, None, None]]:
-        async def g(data: Annotated[bytes, File()]) -> Response:
-            serializer = ArraySerializer(torch_format=torch_format)
-            x = serializer.deserialize(data, dtype, size)
+    ) -> Callable[[Request], Coroutine[Response, None, None]]:
+        async def g(request: Request) -> Response:
+            x, serializer = await read_array(request, dtype, size, torch_format)
             y = await f(x)
-            return Response(
-                content=serializer.serialize(y), media_type="application/octet-stream"
-            )
+            return array_response(serializer, y)
 
         return g
 
@@ -200,3 +357,26 @@ def async_speech_to_text_endpoint(
         return g
 
     return inner
+
+
+def async_streaming_speech_to_text_endpoint(
+    sample_rate: int = 16000,
+    window_s: float = 30.0,
+    overlap_s: float = 0.0,
+) -> Callable[
+    [Callable[[AsyncIterator[np.ndarray], Request], Coroutine[str, None, None]]],
+    Callable[[Request], Coroutine[str, None, None]],
+]:
+    """Like async_speech_to_text_endpoint, but f is given the audio as an async
+    iterator of float32 windows of window_s seconds, overlapping by overlap_s seconds,
+    decoded as it is uploaded, and the request (e.g. to read its headers)."""
+
+    def inner(
+        f: Callable[[AsyncIterator[np.ndarray], Request], Coroutine[str, None, None]]
+    ) -> Callable[[Request], Coroutine[str, None, None]]:
+        async def g(request: Request) -> str:
+            return await f(audio_windows(request, sample_rate, window_s, overlap_s), request)
+
+        return g
+
+    return inner
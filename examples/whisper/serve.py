@@ -0,0 +1,56 @@
+import asyncio
+import math
+import os
+import signal
+from types import FrameType
+from typing import Optional
+
+import uvicorn
+
+
+# Must match DRAIN_TIMEOUT_S of server.py, which reads the same variable
+DRAIN_TIMEOUT_S = float(os.environ.get("DRAIN_TIMEOUT_S", "30"))
+
+
+class DrainingServer(uvicorn.Server):
+    """A uvicorn server which drains the runners of the app on SIGTERM.
+
+    uvicorn only runs the shutdown hooks of the app once every connection is
+    closed, that is once the queues of the runners are already empty. On SIGTERM,
+    the runners are drained first, while the server still accepts connections: new
+    requests are answered with 503, and the queued ones are run for up to
+    DRAIN_TIMEOUT_S seconds. uvicorn then shuts down as usual. A second signal, or
+    SIGINT, exits without draining.
+    """
+
+    def __init__(self, config: uvicorn.Config) -> None:
+        super().__init__(config)
+        self.draining: Optional[asyncio.Task] = None
+
+    def handle_exit(self, sig: int, frame: Optional[FrameType]) -> None:
+        if sig != signal.SIGTERM or self.draining is not None:
+            super().handle_exit(sig, frame)
+            return
+
+        # The app is imported once the server is started, so that the workers
+        # spawned by its runners do not import it again with this module
+        from server import drain_runners
+
+        self.draining = asyncio.ensure_future(drain_runners())
+        self.draining.add_done_callback(lambda _: super(DrainingServer, self).handle_exit(sig, frame))
+
+
+def main() -> None:
+    config = uvicorn.Config(
+        "server:app",
+        host="0.0.0.0",
+        port=80,
+        # The requests are run by the time the runners are drained, only their
+        # responses are left to send
+        timeout_graceful_shutdown=math.ceil(DRAIN_TIMEOUT_S),
+    )
+    DrainingServer(config).run()
+
+
+if __name__ == "__main__":
+    main()
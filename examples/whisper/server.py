@@ -1,54 +1,175 @@
+import asyncio
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     WhisperProcessor,
-    WhisperForConditionalGeneration,
     StoppingCriteriaList,
 )
 import numpy as np
 import torch
 import requests
 import os
-
-from batch_runner import BatchRunner
-from collators import TorchCollator
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from batch_policy import AdaptiveBatchPolicy
+from batch_runner import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    BatchRunner,
+    DeadlineExceeded,
+    RunnerStopped,
+)
+from collators import BucketingCollator, TorchCollator, WaveformCollator
+from features import LogMelExtractor
+from longform import OVERLAP_S, WINDOW_S, transcribe_long
 from messages import PredictionMsg
+from metrics import registry
 from model_store import load_from_store
-from openchatkit_utils import StopWordsCriteria
-from serializers import async_speech_to_text_endpoint
+from models import STT, MODEL_STORE_ADDR, load_whisper
+from openchatkit_utils import StopWordsCriteria, cut_after_stop_words
+from serializers import async_streaming_speech_to_text_endpoint
 
 
 OPENCHATKIT_ENABLED = os.environ.get("OPENCHATKIT_ENABLED", None) == "true"
 NITRIDING_PROXY_ENABLED = os.environ.get("NITRIDING_PROXY_ENABLED", None) == "true"
+# Number of worker processes running whisper, 0 to run it in the server process
+WHISPER_WORKERS = int(os.environ.get("WHISPER_WORKERS", "0"))
+# p99 latency targets, the batch sizes and delays adapt to the load to meet them
+WHISPER_SLO_MS = float(os.environ.get("WHISPER_SLO_MS", "2000"))
+OPENCHATKIT_SLO_MS = float(os.environ.get("OPENCHATKIT_SLO_MS", "30000"))
+# How long the queued requests are given to complete when the server shuts down
+DRAIN_TIMEOUT_S = float(os.environ.get("DRAIN_TIMEOUT_S", "30"))
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", None) == "true"
+
+# Requests are traced when OpenTelemetry is installed and configured
+tracer = None
+if TRACING_ENABLED:
+    try:
+        from opentelemetry import trace
+
+        tracer = trace.get_tracer("whisper.server")
+    except ImportError:
+        print("Warning: TRACING_ENABLED is set but opentelemetry is not installed")
 
 
-STT = "openai/whisper-tiny.en"
 LLM = "togethercomputer/Pythia-Chat-Base-7B"
-MODEL_STORE_ADDR = "172.17.0.1"
 # LLM = "togethercomputer/GPT-NeoXT-Chat-Base-20B"
 
 
 app = FastAPI()
 
-whisper_processor = load_from_store(STT, WhisperProcessor, MODEL_STORE_ADDR)
 
-whisper_model = load_from_store(STT, WhisperForConditionalGeneration, MODEL_STORE_ADDR)
-whisper_model.eval()
+@app.exception_handler(RunnerStopped)
+async def runner_stopped_handler(request: Request, exc: RunnerStopped) -> JSONResponse:
+    # The clients retry on another replica, or on this one once it restarted
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The server is shutting down"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded) -> JSONResponse:
+    return JSONResponse(
+        status_code=504,
+        content={"detail": "The request could not be served before its deadline"},
+    )
+
+
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "bulk": PRIORITY_BULK}
+
 
+def request_options(request: Request) -> Tuple[int, Optional[float]]:
+    """The priority and the deadline of the model requests run for a request.
 
-def run_whisper(x: torch.Tensor) -> torch.Tensor:
-    return whisper_model.generate(x, max_length=128)
+    The priority is given by the X-Priority header, "interactive" (the default) or
+    "bulk": bulk requests (e.g. batch jobs) are served after the interactive ones.
+    The X-Timeout-Ms header gives how long the client waits for the response: the
+    model requests not run by then fail, and the request is answered with 504.
+    """
+    priority = request.headers.get("x-priority", "interactive").strip().lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority {priority}")
+    deadline = None
+    timeout_ms = request.headers.get("x-timeout-ms")
+    if timeout_ms is not None:
+        try:
+            deadline = asyncio.get_running_loop().time() + float(timeout_ms) / 1000
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Timeout-Ms must be a number")
+    return PRIORITIES[priority], deadline
 
 
+whisper_processor = load_from_store(STT, WhisperProcessor, MODEL_STORE_ADDR)
+
+# The log-mel features of the queued waveforms are computed in batches, off the
+# event loop, and fed to the whisper runner
+log_mel_extractor = LogMelExtractor(whisper_processor.feature_extractor)
+features_runner = BatchRunner(
+    log_mel_extractor,
+    max_batch_size=16,
+    max_latency_ms=10,
+    collator=WaveformCollator(log_mel_extractor.n_samples),
+    pipeline_depth=2,
+    isolate_failures=True,
+    name="whisper_features",
+    tracer=tracer,
+    coalesce=True,
+)
+app.on_event("startup")(features_runner.start)
+
+# With workers, each worker process loads its own replica of the model
 whisper_runner = BatchRunner(
-    run_whisper,
+    load_whisper() if WHISPER_WORKERS == 0 else None,
     max_batch_size=256,
     max_latency_ms=200,
     collator=TorchCollator(),
+    pipeline_depth=2,
+    workers=WHISPER_WORKERS,
+    worker_init=load_whisper,
+    policy=AdaptiveBatchPolicy(slo_ms=WHISPER_SLO_MS),
+    isolate_failures=True,
+    name="whisper",
+    tracer=tracer,
+    # Duplicate uploads, to either endpoint, are transcribed once
+    coalesce=True,
 )
-app.on_event("startup")(whisper_runner.run)
+app.on_event("startup")(whisper_runner.start)
+
+
+# The runners, in the order they are drained: the features being extracted are
+# drained into the whisper runner, and the transcriptions into the LLM
+runners = [features_runner, whisper_runner]
+
+
+async def drain_runners():
+    """Stop accepting requests, answered with 503 from then on, and run the queued
+    ones. Called on SIGTERM by serve.py, while the server still serves requests."""
+    for runner in runners:
+        await runner.drain(DRAIN_TIMEOUT_S)
+
+
+@app.on_event("shutdown")
+async def stop_runners():
+    # Without serve.py, the runners are only drained here, once uvicorn has waited
+    # for the requests in flight
+    for runner in runners:
+        await runner.stop(DRAIN_TIMEOUT_S)
+
+
+async def transcribe(
+    x: np.ndarray, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None
+) -> str:
+    input_features = await features_runner.submit(x, priority, deadline)
+    predicted_ids = await whisper_runner.submit(input_features, priority, deadline)
+    transcription = whisper_processor.batch_decode(
+        predicted_ids, skip_special_tokens=True
+    )
+    return transcription[0]
 
 
 if OPENCHATKIT_ENABLED:
@@ -57,12 +178,12 @@ if OPENCHATKIT_ENABLED:
     open_chat_kit_model = load_from_store(LLM, AutoModelForCausalLM, MODEL_STORE_ADDR)
     open_chat_kit_model.eval()
 
-    def run_open_chat_kit(x: torch.Tensor) -> torch.Tensor:
+    def run_open_chat_kit(x: Dict[str, torch.Tensor]) -> torch.Tensor:
         open_chat_kit_stop_criteria = StopWordsCriteria(
             open_chat_kit_tokenizer, ["<human>"], None
         )
         return open_chat_kit_model.generate(
-            x,
+            **x,
             max_new_tokens=128,
             temperature=0.7,
             top_p=0.7,
@@ -72,13 +193,32 @@ if OPENCHATKIT_ENABLED:
             stopping_criteria=StoppingCriteriaList([open_chat_kit_stop_criteria]),
         )
 
+    # Prompts are batched with prompts of similar lengths, padded to the same length
     open_chat_kit_runner = BatchRunner(
         run_open_chat_kit,
-        max_batch_size=2,
+        max_batch_size=8,
         max_latency_ms=1000,
-        collator=TorchCollator(),
+        collator=BucketingCollator(open_chat_kit_tokenizer.eos_token_id),
+        policy=AdaptiveBatchPolicy(slo_ms=OPENCHATKIT_SLO_MS),
+        isolate_failures=True,
+        name="open_chat_kit",
+        tracer=tracer,
     )
-    app.on_event("startup")(open_chat_kit_runner.run)
+
+    async def open_chat_kit_generate(
+        prompt: str, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None
+    ) -> str:
+        input_ids = open_chat_kit_tokenizer(prompt, return_tensors="pt").input_ids
+        predicted_ids = await open_chat_kit_runner.submit(input_ids, priority, deadline)
+        prompt_length = input_ids.shape[1]
+        prompt, completion = open_chat_kit_tokenizer.batch_decode(
+            [predicted_ids[0, :prompt_length], predicted_ids[0, prompt_length:]],
+            skip_special_tokens=True,
+        )
+        return prompt + cut_after_stop_words(completion, ["<human>"])
+
+    app.on_event("startup")(open_chat_kit_runner.start)
+    runners.append(open_chat_kit_runner)
 
 
 if NITRIDING_PROXY_ENABLED:
@@ -92,52 +232,42 @@ if NITRIDING_PROXY_ENABLED:
 if OPENCHATKIT_ENABLED:
 
     @app.post("/open-chat-kit/predict")
-    async def predict(msg: PredictionMsg) -> str:
-        input_ids = open_chat_kit_tokenizer(
-            msg.input_text, return_tensors="pt"
-        ).input_ids
-        predicted_ids = await open_chat_kit_runner.submit(input_ids)
-        transcription = open_chat_kit_tokenizer.batch_decode(
-            predicted_ids, skip_special_tokens=True
-        )
-        return transcription[0]
+    async def predict(msg: PredictionMsg, request: Request) -> str:
+        return await open_chat_kit_generate(msg.input_text, *request_options(request))
 
 
-@app.post("/whisper/predict")
-@async_speech_to_text_endpoint(sample_rate=16000)
-async def predict(x: np.ndarray) -> str:
-    input_features = whisper_processor(
-        x, sampling_rate=16000, return_tensors="pt"
-    ).input_features
-    predicted_ids = await whisper_runner.submit(input_features)
-    transcription = whisper_processor.batch_decode(
-        predicted_ids, skip_special_tokens=True
+@app.get("/metrics")
+def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4"
     )
-    return transcription[0]
+
+
+@app.post("/whisper/predict")
+@async_streaming_speech_to_text_endpoint(
+    sample_rate=16000, window_s=WINDOW_S, overlap_s=OVERLAP_S
+)
+async def predict(windows: AsyncIterator[np.ndarray], request: Request) -> str:
+    priority, deadline = request_options(request)
+    return await transcribe_long(windows, lambda x: transcribe(x, priority, deadline))
 
 
 if OPENCHATKIT_ENABLED:
 
     @app.post("/audio-summarization-pipeline/predict")
-    @async_speech_to_text_endpoint(sample_rate=16000)
-    async def predict(x: np.ndarray) -> str:
-        input_features = whisper_processor(
-            x, sampling_rate=16000, return_tensors="pt"
-        ).input_features
-        predicted_ids = await whisper_runner.submit(input_features)
-        transcription = whisper_processor.batch_decode(
-            predicted_ids, skip_special_tokens=True
-        )
-        input_ids = open_chat_kit_tokenizer(
-            f"<human>: {transcription[0]}\n\nSummarize the above into a single sentence.\n<bot>:",
-            return_tensors="pt",
-        ).input_ids
-        predicted_ids = await open_chat_kit_runner.submit(input_ids)
-        transcription = open_chat_kit_tokenizer.batch_decode(
-            predicted_ids, skip_special_tokens=True
+    @async_streaming_speech_to_text_endpoint(
+        sample_rate=16000, window_s=WINDOW_S, overlap_s=OVERLAP_S
+    )
+    async def predict(windows: AsyncIterator[np.ndarray], request: Request) -> str:
+        priority, deadline = request_options(request)
+        transcription = await transcribe_long(windows, lambda x: transcribe(x, priority, deadline))
+        return await open_chat_kit_generate(
+            f"<human>: {transcription}\n\nSummarize the above into a single sentence.\n<bot>:",
+            priority,
+            deadline,
         )
-        return transcription[0]
 
 
 if __name__ == "__main__":
+    # The runners are not drained on SIGTERM, see serve.py
     uvicorn.run(app, host="0.0.0.0", port=80)
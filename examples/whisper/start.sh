@@ -11,7 +11,10 @@ if [ "$NITRIDING_PROXY_ENABLED" = "true" ]; then
     sleep 1
 fi
 
-python /server.py
+# The app is served by serve.py rather than by running server.py as __main__: worker
+# processes are spawned, and would otherwise import the whole server again. serve.py
+# drains the queued requests on SIGTERM, before uvicorn waits for the connections.
+cd / && python serve.py
 
 # Keep runing if server fails
 count=1
@@ -0,0 +1,131 @@
+import asyncio
+import io
+import struct
+import unittest
+
+import numpy as np
+import soundfile as sf
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from audio_stream import WAV_UNKNOWN_SIZE, _ByteStream, _wav_blocks, _windowed, audio_windows
+
+RATE = 16000
+
+
+def wav(x: np.ndarray, rate: int = RATE, subtype: str = "PCM_16", format: str = "WAV") -> bytes:
+    buff = io.BytesIO()
+    sf.write(buff, x, rate, format=format, subtype=subtype)
+    return buff.getvalue()
+
+
+async def chunks(data: bytes, size: int = 1000):
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+async def decode(data: bytes) -> np.ndarray:
+    blocks = [block async for block, _ in _wav_blocks(_ByteStream(chunks(data)))]
+    return np.concatenate(blocks)
+
+
+async def collect(iterator) -> list:
+    return [x async for x in iterator]
+
+
+class TestWavDecoding(unittest.TestCase):
+    def setUp(self):
+        self.x = np.random.default_rng(0).uniform(-0.5, 0.5, (RATE, 2)).astype(np.float32)
+
+    def test_subtypes(self):
+        for subtype, atol in [("PCM_U8", 1 / 64), ("PCM_16", 1e-4), ("PCM_24", 1e-6), ("PCM_32", 1e-6), ("FLOAT", 0), ("DOUBLE", 0)]:
+            y = asyncio.run(decode(wav(self.x, subtype=subtype)))
+            self.assertEqual(y.shape, self.x.shape, subtype)
+            np.testing.assert_allclose(y, self.x, atol=atol, err_msg=subtype)
+
+    def test_streamed_wav_of_unknown_size(self):
+        data = bytearray(wav(self.x))
+        data_chunk = data.index(b"data")
+        for size in (0, WAV_UNKNOWN_SIZE):
+            struct.pack_into("<I", data, 4, size)
+            struct.pack_into("<I", data, data_chunk + 4, size)
+            self.assertEqual(asyncio.run(decode(bytes(data))).shape, self.x.shape)
+
+    def test_chunks_after_data_are_not_decoded(self):
+        info = b"INFOISFT" + struct.pack("<I", 6) + b"Lavf\0\0"
+        data = wav(self.x) + b"LIST" + struct.pack("<I", len(info)) + info
+        self.assertEqual(asyncio.run(decode(data)).shape, self.x.shape)
+
+    def test_invalid(self):
+        for data in [b"RIFF\0\0\0\0AVI LIST", wav(self.x, subtype="ULAW"), wav(self.x)[:30]]:
+            with self.assertRaises(ValueError):
+                asyncio.run(decode(data))
+
+
+class TestWindows(unittest.TestCase):
+    def windows(self, n: int, size: int, overlap: int, chunk: int = 7):
+        samples = np.arange(n, dtype=np.float32)
+
+        async def blocks():
+            for i in range(0, n, chunk):
+                yield samples[i : i + chunk]
+
+        return [w.tolist() for w in asyncio.run(collect(_windowed(blocks(), size, overlap)))]
+
+    def test_windows(self):
+        self.assertEqual(self.windows(10, 4, 0), [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        self.assertEqual(self.windows(8, 4, 0), [[0, 1, 2, 3], [4, 5, 6, 7]])
+
+    def test_overlapping_windows(self):
+        self.assertEqual(self.windows(10, 4, 1), [[0, 1, 2, 3], [3, 4, 5, 6], [6, 7, 8, 9]])
+        # No window holds only the overlap of the previous one
+        self.assertEqual(self.windows(7, 4, 1), [[0, 1, 2, 3], [3, 4, 5, 6]])
+        self.assertEqual(self.windows(0, 4, 1), [])
+
+
+class TestAudioWindows(unittest.TestCase):
+    def setUp(self):
+        app = FastAPI()
+
+        @app.post("/windows")
+        async def windows(request: Request):
+            lengths = []
+            async for window in audio_windows(request, window_s=1.0, overlap_s=0.25):
+                self.assertEqual(window.dtype, np.float32)
+                lengths.append(len(window))
+            return lengths
+
+        self.client = TestClient(app)
+        self.x = np.random.default_rng(0).uniform(-0.5, 0.5, int(2.6 * RATE)).astype(np.float32)
+
+    def test_wav_body(self):
+        response = self.client.post("/windows", content=wav(self.x))
+        self.assertEqual(response.json(), [16000, 16000, 16000, 5600])
+
+    def test_resampled_stereo(self):
+        stereo = np.stack([self.x[::2], self.x[::2]], axis=1)
+        lengths = self.client.post("/windows", content=wav(stereo, rate=RATE // 2)).json()
+        # Resampled to RATE, without the overlaps of the windows
+        self.assertEqual(sum(lengths) - (len(lengths) - 1) * 4000, len(self.x))
+
+    def test_other_format(self):
+        response = self.client.post("/windows", content=wav(self.x, format="FLAC", subtype="PCM_16"))
+        self.assertEqual(response.json(), [16000, 16000, 16000, 5600])
+
+    def test_multipart(self):
+        for data in [wav(self.x), wav(self.x, format="FLAC", subtype="PCM_16")]:
+            response = self.client.post("/windows", data={"language": "en"}, files={"audio": ("audio", data)})
+            self.assertEqual(response.json(), [16000, 16000, 16000, 5600])
+
+    def test_multipart_without_file(self):
+        response = self.client.post("/windows", files={"language": (None, "en")})
+        self.assertEqual(response.status_code, 400)
+
+    def test_not_audio(self):
+        for data in [b"not audio", b"RIFF" + bytes(100)]:
+            response = self.client.post("/windows", content=data)
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
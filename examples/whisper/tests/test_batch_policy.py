@@ -0,0 +1,54 @@
+import unittest
+
+from batch_policy import AdaptiveBatchPolicy
+
+
+def policy_with_load(interarrival: float, fixed_cost: float, item_cost: float) -> AdaptiveBatchPolicy:
+    """A policy which observed requests arriving every interarrival seconds, and
+    batches of 1 to 8 inputs lasting fixed_cost + item_cost * size seconds."""
+    policy = AdaptiveBatchPolicy(slo_ms=100)
+    policy.bind(max_batch_size=16, max_latency_ms=50)
+    for i in range(100):
+        policy.observe_arrival(i * interarrival)
+    for size in range(1, 9):
+        policy.observe_batch(size, fixed_cost + item_cost * size)
+    return policy
+
+
+class TestAdaptiveBatchPolicy(unittest.TestCase):
+    def test_costs_are_fitted(self):
+        policy = policy_with_load(0.01, 0.004, 0.001)
+        fixed_cost, item_cost = policy.costs()
+        self.assertAlmostEqual(fixed_cost, 0.004)
+        self.assertAlmostEqual(item_cost, 0.001)
+
+    def test_light_load_is_not_batched(self):
+        policy = policy_with_load(1.0, 0.004, 0.001)
+        self.assertEqual(policy.batch_size, 1)
+        self.assertEqual(policy.max_wait, 0.0)
+
+    def test_batch_keeps_up_with_arrivals(self):
+        # 1000 requests per second, a batch of n inputs runs 4 + n ms
+        policy = policy_with_load(0.001, 0.004, 0.001)
+        self.assertEqual(policy.batch_size, 16)
+        policy = policy_with_load(0.002, 0.004, 0.001)
+        size = policy.batch_size
+        # The smallest batch whose throughput is above 1.2 * 500 requests per second
+        self.assertGreaterEqual(size / policy.batch_duration(size), 600)
+        self.assertLess((size - 1) / policy.batch_duration(size - 1), 600)
+        self.assertGreater(policy.max_wait, 0)
+        self.assertLessEqual(policy.max_wait, 0.05)
+
+    def test_delay_is_scaled_down_above_the_slo(self):
+        policy = policy_with_load(0.002, 0.004, 0.001)
+        max_wait = policy.max_wait
+        for _ in range(100):
+            policy.observe_latency(0.5)
+        self.assertLess(policy.max_wait, max_wait)
+        for _ in range(3000):
+            policy.observe_latency(0.01)
+        self.assertEqual(policy.max_wait, max_wait)
+
+
+if __name__ == '__main__':
+    unittest.main()
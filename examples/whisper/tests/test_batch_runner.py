@@ -0,0 +1,287 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+from typing import List
+from unittest.mock import patch
+
+import torch
+
+from batch_runner import PRIORITY_BULK, PRIORITY_INTERACTIVE, BatchRunner, DeadlineExceeded, RunnerStopped
+from collators import Collator
+
+
+class ListCollator(Collator[list]):
+    def collate(self, inputs: List[int]) -> List[int]:
+        return list(inputs)
+
+    def uncollate(self, input: List[int]) -> List[int]:
+        return input
+
+
+def double(inputs: List[int]) -> List[int]:
+    return [2 * x for x in inputs]
+
+
+def exit_on_negative(inputs: List[int]) -> List[int]:
+    # Kills the worker process running the batch
+    if any(x < 0 for x in inputs):
+        os._exit(1)
+    return double(inputs)
+
+
+class BatchRunnerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.runners = []
+        # The inputs of each batch run, in order
+        self.batches = []
+        # Set to let the batches run by self.blocking_run_fn complete
+        self.release = threading.Event()
+
+    async def asyncTearDown(self):
+        self.release.set()
+        for runner in self.runners:
+            await runner.stop(timeout=1)
+
+    def runner(self, run_fn=None, max_batch_size=4, max_latency_ms=20, **kwargs) -> BatchRunner:
+        runner = BatchRunner(
+            run_fn or self.recording_run_fn, max_batch_size, max_latency_ms, ListCollator(), name=self.id(), **kwargs
+        )
+        runner.start()
+        self.runners.append(runner)
+        return runner
+
+    def recording_run_fn(self, inputs: List[int]) -> List[int]:
+        self.batches.append(list(inputs))
+        return double(inputs)
+
+    def blocking_run_fn(self, inputs: List[int]) -> List[int]:
+        self.batches.append(list(inputs))
+        self.release.wait(5)
+        return double(inputs)
+
+    async def wait_for_batches(self, n: int) -> None:
+        """Wait until n batches started running."""
+        while len(self.batches) < n:
+            await asyncio.sleep(0.001)
+
+
+class TestBatchRunner(BatchRunnerTestCase):
+    async def test_full_batches_are_run(self):
+        runner = self.runner(max_batch_size=4, max_latency_ms=10000)
+        outputs = await asyncio.wait_for(asyncio.gather(*(runner.submit(i) for i in range(8))), 5)
+        self.assertEqual(outputs, [2 * i for i in range(8)])
+        self.assertEqual(self.batches, [[0, 1, 2, 3], [4, 5, 6, 7]])
+
+    async def test_partial_batch_is_run_after_max_latency(self):
+        runner = self.runner(max_batch_size=4, max_latency_ms=50)
+        start = time.perf_counter()
+        self.assertEqual(await runner.submit(1), 2)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.045)
+        self.assertEqual(self.batches, [[1]])
+
+    async def test_buckets_are_batched_separately(self):
+        class ParityCollator(ListCollator):
+            def bucket(self, input: int):
+                return input % 2
+
+        runner = BatchRunner(self.recording_run_fn, 4, 10000, ParityCollator(), name=self.id())
+        runner.start()
+        self.runners.append(runner)
+        outputs = await asyncio.wait_for(asyncio.gather(*(runner.submit(i) for i in range(8))), 5)
+        self.assertEqual(outputs, [2 * i for i in range(8)])
+        self.assertEqual(sorted(self.batches), [[0, 2, 4, 6], [1, 3, 5, 7]])
+
+    async def test_pipelined(self):
+        runner = self.runner(pipeline_depth=2)
+        outputs = await asyncio.wait_for(asyncio.gather(*(runner.submit(i) for i in range(20))), 5)
+        self.assertEqual(outputs, [2 * i for i in range(20)])
+
+    async def test_workers(self):
+        runner = self.runner(double, workers=2)
+        outputs = await asyncio.wait_for(asyncio.gather(*(runner.submit(i) for i in range(20))), 60)
+        self.assertEqual(outputs, [2 * i for i in range(20)])
+        self.assertIsNotNone(runner.process_pool)
+
+    async def test_broken_worker_fails_its_batch_only(self):
+        runner = self.runner(exit_on_negative, workers=1)
+        with self.assertRaises(Exception):
+            await asyncio.wait_for(runner.submit(-1), 60)
+        # The next batches run in a new pool of workers
+        self.assertEqual(await asyncio.wait_for(runner.submit(3), 60), 6)
+
+
+class TestBatchRunnerPriorities(BatchRunnerTestCase):
+    async def test_interactive_requests_are_admitted_first(self):
+        # Up to max_pending = 2 requests are queued
+        runner = self.runner(self.blocking_run_fn, max_batch_size=1)
+        tasks = [asyncio.ensure_future(runner.submit(0))]
+        await self.wait_for_batches(1)
+        for i in (1, 2, 3):
+            tasks.append(asyncio.ensure_future(runner.submit(i, priority=PRIORITY_BULK)))
+            await asyncio.sleep(0.01)
+        tasks.append(asyncio.ensure_future(runner.submit(4, priority=PRIORITY_INTERACTIVE)))
+        await asyncio.sleep(0.01)
+        self.release.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        # The bulk request 3 waits for room in the queue, the interactive one
+        # overtakes it and the bulk request 2 queued before it
+        self.assertEqual(self.batches, [[0], [1], [4], [2], [3]])
+
+    async def test_past_deadline(self):
+        runner = self.runner()
+        with self.assertRaises(DeadlineExceeded):
+            await runner.submit(1, deadline=asyncio.get_running_loop().time())
+        self.assertEqual(self.batches, [])
+
+    async def test_deadline_passed_in_queue(self):
+        runner = self.runner(self.blocking_run_fn, max_batch_size=1)
+        blocker = asyncio.ensure_future(runner.submit(0))
+        await self.wait_for_batches(1)
+        task = asyncio.ensure_future(runner.submit(1, deadline=asyncio.get_running_loop().time() + 0.05))
+        await asyncio.sleep(0.1)
+        self.release.set()
+        self.assertEqual(await blocker, 0)
+        with self.assertRaises(DeadlineExceeded):
+            await asyncio.wait_for(task, 5)
+        # The request is not run once its deadline passed
+        self.assertEqual(self.batches, [[0]])
+
+    async def test_deadline_runs_batch_early(self):
+        runner = self.runner(max_latency_ms=10000)
+        deadline = asyncio.get_running_loop().time() + 0.2
+        # Run in time for its deadline, rather than after max_latency_ms. The slack
+        # covers the latency of the timers of a loaded test machine.
+        with patch("batch_runner.DEADLINE_SLACK", 0.1):
+            self.assertEqual(await asyncio.wait_for(runner.submit(1, deadline=deadline), 1), 2)
+
+
+class TestBatchRunnerFailures(BatchRunnerTestCase):
+    def poisoned_run_fn(self, inputs: List[int]) -> List[int]:
+        self.batches.append(list(inputs))
+        if 3 in inputs:
+            raise ValueError("Poison input")
+        return double(inputs)
+
+    async def test_poison_input_fails_its_request_only(self):
+        runner = self.runner(self.poisoned_run_fn, max_batch_size=8, isolate_failures=True)
+        results = await asyncio.wait_for(
+            asyncio.gather(*(runner.submit(i) for i in range(8)), return_exceptions=True), 5
+        )
+        self.assertIsInstance(results[3], Exception)
+        self.assertEqual(results[:3] + results[4:], [0, 2, 4, 8, 10, 12, 14])
+        self.assertEqual(runner.metrics.poison_inputs.value, 1)
+
+    async def test_failed_batch_without_isolation(self):
+        runner = self.runner(self.poisoned_run_fn, max_batch_size=8)
+        results = await asyncio.wait_for(
+            asyncio.gather(*(runner.submit(i) for i in range(8)), return_exceptions=True), 5
+        )
+        for result in results:
+            self.assertIsInstance(result, Exception)
+        self.assertEqual(len(self.batches), 1)
+
+    async def test_out_of_memory_is_not_blamed_on_inputs(self):
+        def run_fn(inputs):
+            self.batches.append(list(inputs))
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+
+        runner = self.runner(run_fn, max_batch_size=8, isolate_failures=True)
+        results = await asyncio.wait_for(
+            asyncio.gather(*(runner.submit(i) for i in range(8)), return_exceptions=True), 5
+        )
+        for result in results:
+            self.assertIsInstance(result, Exception)
+        # The halves of the batch would run out of memory too
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(runner.metrics.poison_inputs.value, 0)
+
+
+class TestBatchRunnerDrain(BatchRunnerTestCase):
+    async def test_drain_runs_pending_requests(self):
+        runner = self.runner(max_latency_ms=10000)
+        tasks = [asyncio.ensure_future(runner.submit(i)) for i in range(2)]
+        await asyncio.sleep(0.01)
+        # The partial batch is run without waiting for max_latency_ms
+        await asyncio.wait_for(runner.drain(), 1)
+        self.assertEqual([task.result() for task in tasks], [0, 2])
+        with self.assertRaises(RunnerStopped):
+            await runner.submit(2)
+
+    async def test_drain_timeout(self):
+        runner = self.runner(self.blocking_run_fn, max_batch_size=1)
+        running = asyncio.ensure_future(runner.submit(0))
+        await self.wait_for_batches(1)
+        pending = asyncio.ensure_future(runner.submit(1))
+        await asyncio.sleep(0.01)
+        await runner.drain(timeout=0.05)
+        for task in (running, pending):
+            with self.assertRaises(RunnerStopped):
+                await task
+        self.assertEqual(self.batches, [[0]])
+
+    async def test_submitters_waiting_for_room_are_rejected(self):
+        runner = self.runner(self.blocking_run_fn, max_batch_size=1)
+        tasks = [asyncio.ensure_future(runner.submit(i)) for i in range(4)]
+        await self.wait_for_batches(1)
+        # Request 3 waits for room in the queue
+        drain = asyncio.ensure_future(runner.drain(timeout=5))
+        await asyncio.sleep(0.01)
+        self.release.set()
+        await asyncio.wait_for(drain, 5)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertEqual(results[:3], [0, 2, 4])
+        self.assertIsInstance(results[3], RunnerStopped)
+
+    async def test_stop(self):
+        runner = self.runner()
+        self.assertEqual(await runner.submit(1), 2)
+        await runner.stop()
+        self.assertIsNone(runner.main_task)
+        self.assertEqual(runner.tasks, set())
+        with self.assertRaises(RunnerStopped):
+            await runner.submit(1)
+
+
+class TestBatchRunnerCoalescing(BatchRunnerTestCase):
+    def tensor_run_fn(self, inputs: List[torch.Tensor]) -> List[torch.Tensor]:
+        self.batches.append(list(inputs))
+        return [2 * x for x in inputs]
+
+    async def test_identical_requests_are_coalesced(self):
+        runner = self.runner(self.tensor_run_fn, coalesce=True)
+        inputs = [torch.arange(4), torch.arange(4), torch.arange(4, dtype=torch.float32), torch.ones(4)]
+        outputs = await asyncio.wait_for(asyncio.gather(*(runner.submit(x) for x in inputs)), 5)
+        for x, y in zip(inputs, outputs):
+            self.assertTrue(torch.equal(y, 2 * x))
+        # Inputs of different dtypes are not identical
+        self.assertEqual(sum(len(batch) for batch in self.batches), 3)
+        self.assertEqual(runner.metrics.coalesced.value, 1)
+        self.assertEqual(runner.in_flight, {})
+
+    async def test_cancelled_waiter_does_not_cancel_shared_request(self):
+        runner = self.runner(self.blocking_run_fn, coalesce=True)
+        first = asyncio.ensure_future(runner.submit(1))
+        second = asyncio.ensure_future(runner.submit(1))
+        await self.wait_for_batches(1)
+        first.cancel()
+        self.release.set()
+        self.assertEqual(await asyncio.wait_for(second, 5), 2)
+        self.assertTrue(first.cancelled())
+        self.assertEqual(self.batches, [[1]])
+
+    async def test_request_is_cancelled_with_its_last_waiter(self):
+        runner = self.runner(coalesce=True, max_latency_ms=10000)
+        task = asyncio.ensure_future(runner.submit(1))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.sleep(0.01)
+        self.assertEqual(runner.in_flight, {})
+        # The cancelled request is not run
+        await runner.drain()
+        self.assertEqual(self.batches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
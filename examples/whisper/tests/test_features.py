@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+import torch
+from transformers import WhisperFeatureExtractor
+
+from collators import BucketingCollator, WaveformCollator
+from features import LogMelExtractor
+
+
+class TestLogMelExtractor(unittest.TestCase):
+    def test_matches_feature_extractor(self):
+        feature_extractor = WhisperFeatureExtractor()
+        extractor = LogMelExtractor(feature_extractor)
+        rng = np.random.default_rng(0)
+        waveforms = [rng.uniform(-0.5, 0.5, n).astype(np.float32) for n in (16000, 5 * 16000, 30 * 16000)]
+
+        collator = WaveformCollator(extractor.n_samples)
+        features = collator.uncollate(extractor(collator.collate(waveforms)))
+        for waveform, x in zip(waveforms, features):
+            expected = feature_extractor(waveform, sampling_rate=16000, return_tensors="pt").input_features
+            self.assertEqual(x.shape, expected.shape)
+            torch.testing.assert_close(x, expected, atol=1e-3, rtol=0)
+
+
+class TestWaveformCollator(unittest.TestCase):
+    def test_padded_and_truncated(self):
+        collator = WaveformCollator(4)
+        batch = collator.collate([np.ones(2, dtype=np.float32), torch.arange(6, dtype=torch.float32)])
+        self.assertTrue(torch.equal(batch, torch.tensor([[1.0, 1, 0, 0], [0, 1, 2, 3]])))
+
+
+class TestBucketingCollator(unittest.TestCase):
+    def test_buckets(self):
+        collator = BucketingCollator(pad_token_id=0, bucket_width=4)
+        self.assertEqual(collator.bucket(torch.ones(1, 3)), collator.bucket(torch.ones(1, 4)))
+        self.assertNotEqual(collator.bucket(torch.ones(1, 4)), collator.bucket(torch.ones(1, 5)))
+
+    def test_left_padded(self):
+        collator = BucketingCollator(pad_token_id=0)
+        batch = collator.collate([torch.tensor([[5, 6, 7]]), torch.tensor([[8]])])
+        self.assertTrue(torch.equal(batch["input_ids"], torch.tensor([[5, 6, 7], [0, 0, 8]])))
+        self.assertTrue(torch.equal(batch["attention_mask"], torch.tensor([[1, 1, 1], [0, 0, 1]])))
+        outputs = collator.uncollate(torch.tensor([[5, 6, 7, 9], [0, 0, 8, 9]]))
+        self.assertEqual([x.tolist() for x in outputs], [[[5, 6, 7, 9]], [[8, 9]]])
+
+
+if __name__ == '__main__':
+    unittest.main()
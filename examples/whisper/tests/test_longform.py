@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+
+import numpy as np
+
+from longform import stitch, transcribe_long
+
+
+class TestStitch(unittest.TestCase):
+    def test_overlap_is_kept_once(self):
+        transcripts = [
+            "the quick brown fox jumps over",
+            "fox jumps over the lazy dog.",
+            "Lazy dog, sleeps in the sun",
+        ]
+        self.assertEqual(stitch(transcripts), "the quick brown fox jumps over the lazy dog, sleeps in the sun")
+
+    def test_cut_in_the_middle_of_the_overlap(self):
+        # The words of the edges of the windows are taken from the other window
+        self.assertEqual(stitch(["one two three four fiv", "wo three four five six"]), "one two three four five six")
+
+    def test_transcripts_without_overlap_are_concatenated(self):
+        self.assertEqual(stitch(["hello there", "general kenobi"]), "hello there general kenobi")
+        self.assertEqual(stitch(["a b", "b c"]), "a b b c")
+        self.assertEqual(stitch([]), "")
+        self.assertEqual(stitch(["", "hello world", ""]), "hello world")
+
+
+class TestTranscribeLong(unittest.TestCase):
+    def test_windows_are_transcribed_concurrently(self):
+        in_flight = 0
+        max_in_flight = 0
+
+        async def windows():
+            for i in range(10):
+                yield np.full(4, i, dtype=np.float32)
+
+        async def transcribe(window):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return f"window {int(window[0])}"
+
+        text = asyncio.run(transcribe_long(windows(), transcribe, max_in_flight=3))
+        self.assertEqual(text, " ".join(f"window {i}" for i in range(10)))
+        self.assertEqual(max_in_flight, 3)
+
+    def test_failure_cancels_the_other_windows(self):
+        cancelled = []
+
+        async def windows():
+            for i in range(3):
+                yield i
+
+        async def transcribe(i):
+            try:
+                if i == 1:
+                    raise ValueError("Could not transcribe")
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(i)
+                raise
+            return ""
+
+        with self.assertRaises(ValueError):
+            asyncio.run(transcribe_long(windows(), transcribe))
+        self.assertEqual(sorted(cancelled), [0, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
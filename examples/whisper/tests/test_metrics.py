@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+
+from batch_runner import BatchRunner
+from metrics import Gauge, Registry
+from test_batch_runner import ListCollator, double
+
+
+class FakeSpan:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.events = []
+        self.ended = False
+
+    def add_event(self, name, attributes):
+        self.events.append(name)
+
+    def record_exception(self, e):
+        self.events.append(type(e).__name__)
+
+    def end(self):
+        self.ended = True
+
+
+class FakeTracer:
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, attributes):
+        self.spans.append(FakeSpan(name, attributes))
+        return self.spans[-1]
+
+
+class TestRegistry(unittest.TestCase):
+    def test_render(self):
+        registry = Registry()
+        requests = registry.counter("requests", "Number of requests.", ("runner",))
+        requests.labels("whisper").inc()
+        requests.labels(runner="whisper").inc(2)
+        registry.gauge("queue_depth", "Queue depth.").set_child(Gauge(lambda: 3))
+        registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0)).labels().observe(0.5)
+
+        self.assertEqual(
+            registry.render().splitlines(),
+            [
+                "# HELP requests Number of requests.",
+                "# TYPE requests counter",
+                'requests_total{runner="whisper"} 3',
+                "# HELP queue_depth Queue depth.",
+                "# TYPE queue_depth gauge",
+                "queue_depth 3",
+                "# HELP latency_seconds Latency.",
+                "# TYPE latency_seconds histogram",
+                'latency_seconds_bucket{le="0.1"} 0',
+                'latency_seconds_bucket{le="1"} 1',
+                'latency_seconds_bucket{le="+Inf"} 1',
+                "latency_seconds_sum 0.5",
+                "latency_seconds_count 1",
+            ],
+        )
+
+    def test_label_values_are_escaped(self):
+        registry = Registry()
+        registry.counter("requests", "Number of requests.", ("runner",)).labels('a "b"\n').inc()
+        self.assertIn('requests_total{runner="a \\"b\\"\\n"} 1', registry.render())
+
+
+class TestBatchRunnerMetrics(unittest.IsolatedAsyncioTestCase):
+    async def test_requests_are_counted_and_traced(self):
+        tracer = FakeTracer()
+        runner = BatchRunner(double, 4, 10000, ListCollator(), name=self.id(), tracer=tracer)
+        runner.start()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(runner.submit(i) for i in range(8))), 5)
+        finally:
+            await runner.stop()
+        self.assertEqual(runner.metrics.requests.value, 8)
+        self.assertEqual(runner.metrics.batches.value, 2)
+        self.assertEqual(runner.metrics.batch_size.counts[runner.metrics.batch_size.buckets.index(4)], 2)
+        self.assertEqual(len(tracer.spans), 8)
+        for span in tracer.spans:
+            self.assertEqual(span.events, ["dispatched", "computed"])
+            self.assertTrue(span.ended)
+        self.assertEqual(runner.spans, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
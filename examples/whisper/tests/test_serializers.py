@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+import torch
+from fastapi import HTTPException
+
+from serializers import ArraySerializer
+
+
+class TestArraySerializer(unittest.TestCase):
+    def test_array_round_trip(self):
+        serializer = ArraySerializer()
+        for x in [
+            np.arange(12, dtype=np.float32).reshape(3, 4),
+            np.arange(12, dtype=np.int64).reshape(3, 4).T,
+            np.asfortranarray(np.ones((2, 3), dtype=np.float16)),
+            np.array(3.5),
+            np.zeros((0, 4), dtype=np.uint8),
+        ]:
+            y = serializer.deserialize(serializer.serialize(x))
+            self.assertEqual(y.dtype, x.dtype)
+            np.testing.assert_array_equal(y, x)
+
+    def test_array_is_not_copied(self):
+        serializer = ArraySerializer()
+        data = serializer.serialize(np.arange(1000, dtype=np.float32))
+        x = serializer.deserialize(data)
+        # A read-only view of the request body
+        self.assertTrue(np.shares_memory(x, np.frombuffer(data, dtype=np.uint8)))
+        self.assertFalse(x.flags.writeable)
+
+        serializer = ArraySerializer(torch_format=True)
+        x = serializer.deserialize(data)
+        self.assertTrue(torch.is_tensor(x))
+        self.assertTrue(np.shares_memory(x.numpy(), np.frombuffer(data, dtype=np.uint8)))
+
+    def test_contiguous_array_is_serialized_without_copy(self):
+        x = np.arange(1000, dtype=np.float32)
+        parts = ArraySerializer().serialize_parts(x)
+        self.assertTrue(np.shares_memory(np.frombuffer(parts[-1], dtype=np.uint8), x))
+
+    def test_tensor_round_trip(self):
+        serializer = ArraySerializer(torch_format=True)
+        x = torch.arange(12, dtype=torch.float32).reshape(3, 4)
+        self.assertTrue(torch.equal(serializer.deserialize(serializer.serialize(x)), x))
+
+    def test_dtype_and_size_checks(self):
+        serializer = ArraySerializer()
+        data = serializer.serialize(np.zeros((2, 3), dtype=np.float32))
+        self.assertEqual(serializer.deserialize(data, dtype=np.float32, size=(-1, 3)).shape, (2, 3))
+        for kwargs in [{"dtype": np.int64}, {"size": (2, 4)}, {"size": (2, 3, 1)}]:
+            with self.assertRaises(HTTPException) as cm:
+                serializer.deserialize(data, **kwargs)
+            self.assertEqual(cm.exception.status_code, 400)
+
+    def test_invalid_data(self):
+        serializer = ArraySerializer()
+        data = serializer.serialize(np.zeros(100, dtype=np.float32))
+        for invalid in [data[:-4], b"not an array"]:
+            with self.assertRaises(HTTPException) as cm:
+                serializer.deserialize(invalid)
+            self.assertEqual(cm.exception.status_code, 400)
+
+    def test_arrays_of_objects_are_not_unpickled(self):
+        serializer = ArraySerializer()
+        data = serializer.serialize(np.array([{"a": 1}], dtype=object))
+        with self.assertRaises(HTTPException):
+            serializer.deserialize(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import torch
+from fastapi import HTTPException
+
+from serializers import ArraySerializer
+from wire_formats import (
+    ENCODINGS,
+    FORMATS,
+    DecompressedSizeError,
+    NpyFormat,
+    RawFormat,
+    SafetensorsFormat,
+    TorchFormat,
+    negotiate_encoding,
+    negotiate_format,
+)
+
+ARRAYS = [
+    np.arange(24, dtype=np.float32).reshape(2, 3, 4),
+    np.arange(12, dtype=np.int64).reshape(3, 4).T,
+    np.arange(6, dtype=">i4"),
+    np.array([True, False]),
+    np.array(7, dtype=np.uint8),
+    np.zeros((0, 3), dtype=np.float64),
+]
+
+
+def encode(format, value) -> bytes:
+    return b"".join(bytes(part) for part in format.encode(value))
+
+
+class TestWireFormats(unittest.TestCase):
+    def test_round_trip(self):
+        for format in (NpyFormat(), RawFormat(), SafetensorsFormat()):
+            for x in ARRAYS:
+                y = format.decode(encode(format, x))
+                self.assertEqual(y.dtype.newbyteorder("<"), x.dtype.newbyteorder("<"))
+                np.testing.assert_array_equal(y, x)
+
+    def test_tensor_round_trip(self):
+        format = TorchFormat()
+        for x in ARRAYS:
+            y = format.decode(encode(format, x))
+            self.assertTrue(torch.is_tensor(y))
+            np.testing.assert_array_equal(y.numpy(), x)
+        x = torch.arange(6).reshape(2, 3)
+        self.assertTrue(torch.equal(format.decode(encode(format, x)), x))
+
+    def test_numpy_objects_are_loaded_as_tensors(self):
+        format = TorchFormat()
+        value = {"score": np.float32(0.5), "tokens": [np.int64(3), np.arange(2)]}
+        y = format.decode(encode(format, value))
+        self.assertEqual(y["score"].item(), 0.5)
+        self.assertEqual(y["tokens"][0].item(), 3)
+        self.assertTrue(torch.equal(y["tokens"][1], torch.arange(2)))
+
+    def test_torch_format_reads_npy(self):
+        x = np.arange(4, dtype=np.float32)
+        np.testing.assert_array_equal(TorchFormat().decode(encode(NpyFormat(), x)), x)
+
+    def test_invalid_data(self):
+        x = np.arange(10, dtype=np.float32)
+        for format in (RawFormat(), SafetensorsFormat()):
+            with self.assertRaises(ValueError):
+                format.decode(encode(format, x)[:-4])
+        with self.assertRaises(ValueError):
+            RawFormat().decode(b"\x93NOT a raw tensor")
+        with self.assertRaises(ValueError):
+            RawFormat().encode(np.array([object()]))
+        with self.assertRaises(ValueError):
+            SafetensorsFormat().encode(np.array(["text"]))
+
+    def test_negotiate_format(self):
+        npy = FORMATS["application/x-npy"]
+        raw = FORMATS["application/x-raw-tensor"]
+        self.assertIs(negotiate_format(None, npy), npy)
+        self.assertIs(negotiate_format("application/x-raw-tensor", npy), raw)
+        self.assertIs(negotiate_format("application/x-npy;q=0.5, application/x-raw-tensor", npy), raw)
+        self.assertIs(negotiate_format("application/x-raw-tensor;q=0, */*", npy), npy)
+        self.assertIsNone(negotiate_format("text/html", npy))
+
+    def test_negotiate_encoding(self):
+        self.assertIsNone(negotiate_encoding(None))
+        self.assertIsNone(negotiate_encoding("gzip, identity"))
+        for encoding in ENCODINGS:
+            self.assertEqual(negotiate_encoding(f"gzip, {encoding}"), encoding)
+            self.assertIsNone(negotiate_encoding(f"{encoding};q=0"))
+
+
+class TestCompression(unittest.TestCase):
+    def test_round_trip(self):
+        data = np.arange(10000, dtype=np.int32).tobytes()
+        for encoding, (compress, decompress) in ENCODINGS.items():
+            self.assertEqual(decompress(compress(data), len(data)), data, encoding)
+
+    def test_decompressed_size_is_bounded(self):
+        data = bytes(10000)
+        for encoding, (compress, decompress) in ENCODINGS.items():
+            with self.assertRaises(DecompressedSizeError, msg=encoding):
+                decompress(compress(data), len(data) - 1)
+
+    def test_serializer(self):
+        x = np.arange(1000, dtype=np.float32)
+        for encoding in ENCODINGS:
+            serializer = ArraySerializer(media_type="application/x-raw-tensor", content_encoding=encoding)
+            np.testing.assert_array_equal(serializer.deserialize(serializer.serialize(x)), x)
+
+    def test_serializer_rejects_truncated_data(self):
+        for encoding in ENCODINGS:
+            serializer = ArraySerializer(content_encoding=encoding)
+            data = serializer.serialize(np.arange(1000, dtype=np.float32))
+            with self.assertRaises(HTTPException) as cm:
+                serializer.deserialize(data[: len(data) // 2])
+            self.assertEqual(cm.exception.status_code, 400)
+
+    def test_serializer_rejects_bombs(self):
+        for encoding in ENCODINGS:
+            serializer = ArraySerializer(content_encoding=encoding)
+            data = serializer.serialize(np.zeros(1000))
+            with patch("serializers.MAX_DECOMPRESSED_SIZE", 1000):
+                with self.assertRaises(HTTPException) as cm:
+                    serializer.deserialize(data)
+            self.assertEqual(cm.exception.status_code, 413)
+
+    def test_unsupported(self):
+        for kwargs in [{"media_type": "text/csv"}, {"content_encoding": "br"}, {"media_type": "application/x-torch"}]:
+            with self.assertRaises(HTTPException) as cm:
+                ArraySerializer(**kwargs)
+            self.assertEqual(cm.exception.status_code, 415)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,354 @@
+import json
+import struct
+from io import BytesIO
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import numpy.lib.format as npy_format
+import torch
+
+# Compressions are optional, only offered when their library is installed
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+Buffer = Union[bytes, memoryview]
+
+
+def npy_header(x: np.ndarray) -> bytes:
+    """The .npy header of the C-contiguous array x."""
+    buff = BytesIO()
+    npy_format.write_array_header_1_0(buff, npy_format.header_data_from_array_1_0(x))
+    return buff.getvalue()
+
+
+def frombuffer_npy(data: Buffer) -> Optional[np.ndarray]:
+    """Parse the .npy file in data without copying it: the array returned is a
+    read-only view of data. None is returned if data is not a .npy file of version
+    1 or 2 holding plain data (e.g. an array of objects, which has to be unpickled).
+    """
+    view = memoryview(data)
+    if len(view) < 10 or view[: len(npy_format.MAGIC_PREFIX)] != npy_format.MAGIC_PREFIX:
+        return None
+    major = view[len(npy_format.MAGIC_PREFIX)]
+    if major not in (1, 2):
+        return None
+    length_size = 2 if major == 1 else 4
+    start = npy_format.MAGIC_LEN + length_size
+    offset = start + int.from_bytes(view[npy_format.MAGIC_LEN : start], "little")
+
+    # Only the header is copied, to be parsed by numpy
+    header = BytesIO(view[:offset])
+    npy_format.read_magic(header)
+    if major == 1:
+        shape, fortran_order, dtype = npy_format.read_array_header_1_0(header)
+    else:
+        shape, fortran_order, dtype = npy_format.read_array_header_2_0(header)
+    if dtype.hasobject:
+        return None
+
+    count = int(np.prod(shape))
+    if len(view) - offset < count * dtype.itemsize:
+        raise ValueError("The .npy file is truncated")
+    x = np.frombuffer(view, dtype=dtype, count=count, offset=offset)
+    return x.reshape(shape, order="F" if fortran_order else "C")
+
+
+def _plain_array(value) -> np.ndarray:
+    """value as a C-contiguous little-endian array of plain data."""
+    x = value.detach().cpu().numpy() if torch.is_tensor(value) else np.asarray(value)
+    if x.dtype.hasobject:
+        raise ValueError("Arrays of objects can not be serialized in this format")
+    if x.dtype.byteorder == ">":
+        x = x.astype(x.dtype.newbyteorder("<"))
+    # Unlike np.ascontiguousarray, this keeps 0-d arrays as they are
+    return x if x.flags.c_contiguous else x.copy(order="C")
+
+
+def _data(x: np.ndarray) -> memoryview:
+    return x.reshape(-1).view(np.uint8).data
+
+
+class WireFormat:
+    """A serialization of arrays, selected by its media type."""
+
+    media_type: str
+    # The name of the format in error messages
+    name: str
+
+    def encode(self, value) -> List[Buffer]:
+        """Serialize value in parts, to be sent one after the other."""
+        raise NotImplementedError()
+
+    def decode(self, data: Buffer):
+        """Deserialize an array or a tensor from data, raising ValueError if it is
+        not valid."""
+        raise NotImplementedError()
+
+
+class NpyFormat(WireFormat):
+    """.npy files, whose arrays of plain data are written and read without copies."""
+
+    media_type = "application/x-npy"
+    name = "numpy"
+
+    def encode(self, value) -> List[Buffer]:
+        x = value.detach().cpu().numpy() if torch.is_tensor(value) else np.asarray(value)
+        if x.dtype.hasobject:
+            buff = BytesIO()
+            np.save(buff, x)
+            return [buff.getbuffer()]
+        x = x if x.flags.c_contiguous else x.copy(order="C")
+        return [npy_header(x), _data(x)]
+
+    def decode(self, data: Buffer) -> np.ndarray:
+        x = frombuffer_npy(data)
+        # BytesIO shares the memory of the bytes it is initialized with
+        return x if x is not None else np.load(BytesIO(data))
+
+
+def _numpy_to_tensors(value):
+    """value with the numpy arrays and scalars in it, including in lists, tuples and
+    dicts, converted to tensors. Unlike numpy objects, tensors are unpickled by
+    torch.load with weights_only."""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return torch.from_numpy(_plain_array(value))
+    if type(value) in (list, tuple):
+        return type(value)(_numpy_to_tensors(v) for v in value)
+    if type(value) is dict:
+        return {k: _numpy_to_tensors(v) for k, v in value.items()}
+    return value
+
+
+class TorchFormat(WireFormat):
+    """torch.save pickles. .npy files are accepted too, and read without copies."""
+
+    media_type = "application/x-torch"
+    name = "torch"
+
+    def encode(self, value) -> List[Buffer]:
+        buff = BytesIO()
+        torch.save(_numpy_to_tensors(value), buff)
+        return [buff.getbuffer()]
+
+    def decode(self, data: Buffer):
+        x = frombuffer_npy(data)
+        # Only tensors are unpickled, as other objects could run arbitrary code
+        return x if x is not None else torch.load(BytesIO(data), weights_only=True)
+
+
+class RawFormat(WireFormat):
+    """The little-endian data of the array after a compact header.
+
+    The header is the magic string, the version, the length and the characters of
+    the numpy type string of the dtype (e.g. <f4), the number of dimensions and the
+    dimensions as 64-bit integers, all little-endian, zero-padded to a multiple of
+    8 bytes so that the data is aligned.
+    """
+
+    media_type = "application/x-raw-tensor"
+    name = "raw tensor"
+    magic = b"\x93RAW"
+    version = 1
+
+    def encode(self, value) -> List[Buffer]:
+        x = _plain_array(value)
+        dtype = x.dtype.str.encode()
+        header = self.magic + struct.pack(
+            f"<BB{len(dtype)}sB{x.ndim}Q", self.version, len(dtype), dtype, x.ndim, *x.shape
+        )
+        header += b"\0" * (-len(header) % 8)
+        return [header, _data(x)]
+
+    def decode(self, data: Buffer) -> np.ndarray:
+        view = memoryview(data)
+        if view[:4] != self.magic or view[4] != self.version:
+            raise ValueError("Not a raw tensor")
+        dtype_length = view[5]
+        dtype = np.dtype(bytes(view[6 : 6 + dtype_length]).decode())
+        ndim = view[6 + dtype_length]
+        start = 7 + dtype_length
+        shape = struct.unpack_from(f"<{ndim}Q", view, start)
+        offset = start + 8 * ndim
+        offset += -offset % 8
+        if dtype.hasobject:
+            raise ValueError("Arrays of objects can not be deserialized")
+        count = int(np.prod(shape))
+        if len(view) - offset != count * dtype.itemsize:
+            raise ValueError("The size of the data does not match its shape")
+        return np.frombuffer(view, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+class SafetensorsFormat(WireFormat):
+    """The layout of safetensors files, holding one tensor named "tensor": the length
+    of a JSON header, the header, giving the dtype, the shape and the offsets of the
+    data, then the data."""
+
+    media_type = "application/x-safetensors"
+    name = "safetensors"
+    dtypes = {
+        "F64": "<f8",
+        "F32": "<f4",
+        "F16": "<f2",
+        "I64": "<i8",
+        "I32": "<i4",
+        "I16": "<i2",
+        "I8": "i1",
+        "U64": "<u8",
+        "U32": "<u4",
+        "U16": "<u2",
+        "U8": "u1",
+        "BOOL": "?",
+    }
+    names = {np.dtype(dtype): name for name, dtype in dtypes.items()}
+
+    def encode(self, value) -> List[Buffer]:
+        x = _plain_array(value)
+        if x.dtype not in self.names:
+            raise ValueError(f"The dtype {x.dtype} is not supported by safetensors")
+        header = json.dumps(
+            {
+                "tensor": {
+                    "dtype": self.names[x.dtype],
+                    "shape": list(x.shape),
+                    "data_offsets": [0, x.nbytes],
+                }
+            },
+            separators=(",", ":"),
+        ).encode()
+        # The header is padded with spaces so that the data is aligned on 8 bytes
+        header += b" " * (-len(header) % 8)
+        return [struct.pack("<Q", len(header)) + header, _data(x)]
+
+    def decode(self, data: Buffer) -> np.ndarray:
+        view = memoryview(data)
+        (length,) = struct.unpack_from("<Q", view)
+        if length > len(view) - 8:
+            raise ValueError("The safetensors header is truncated")
+        header = json.loads(bytes(view[8 : 8 + length]))
+        tensors = {k: v for k, v in header.items() if k != "__metadata__"}
+        if "tensor" in tensors:
+            info = tensors["tensor"]
+        elif len(tensors) == 1:
+            (info,) = tensors.values()
+        else:
+            raise ValueError("Expected one tensor")
+        dtype = np.dtype(self.dtypes[info["dtype"]])
+        shape = tuple(int(n) for n in info["shape"])
+        begin, end = info["data_offsets"]
+        count = int(np.prod(shape))
+        if end - begin != count * dtype.itemsize or 8 + length + end > len(view):
+            raise ValueError("The size of the data does not match its shape")
+        x = np.frombuffer(view, dtype=dtype, count=count, offset=8 + length + begin)
+        return x.reshape(shape)
+
+
+FORMATS: Dict[str, WireFormat] = {}
+
+
+def register_format(format: WireFormat) -> None:
+    FORMATS[format.media_type] = format
+
+
+for _format in (NpyFormat(), TorchFormat(), RawFormat(), SafetensorsFormat()):
+    register_format(_format)
+
+
+# The size above which compressed data is not decompressed
+MAX_DECOMPRESSED_SIZE = 256 * 2**20
+
+
+class DecompressedSizeError(ValueError):
+    """Compressed data which would be larger than the limit once decompressed."""
+
+
+def _decompress_lz4(data: Buffer, max_size: int) -> bytes:
+    decompressor = lz4_frame.LZ4FrameDecompressor()
+    # One more byte than allowed is decompressed, to tell the limit is exceeded
+    x = decompressor.decompress(data, max_length=max_size + 1)
+    if len(x) > max_size:
+        raise DecompressedSizeError(f"More than {max_size} bytes once decompressed")
+    if not decompressor.eof:
+        raise ValueError("The lz4 frame is truncated")
+    return x
+
+
+def _compress_zstd(data: Buffer) -> bytes:
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _decompress_zstd(data: Buffer, max_size: int) -> bytes:
+    # Frames written without their content size are decompressed too, and the
+    # content size, when given, is not trusted
+    with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+        x = reader.read(max_size + 1)
+    if len(x) > max_size:
+        raise DecompressedSizeError(f"More than {max_size} bytes once decompressed")
+    return x
+
+
+# Content-Encoding: (compress, decompress), decompress taking the maximum size of
+# the decompressed data
+ENCODINGS = {}
+if lz4_frame is not None:
+    ENCODINGS["lz4"] = (lz4_frame.compress, _decompress_lz4)
+if zstandard is not None:
+    ENCODINGS["zstd"] = (_compress_zstd, _decompress_zstd)
+
+
+def media_type(content_type: Optional[str]) -> Optional[str]:
+    """The media type of a Content-Type header, without its parameters."""
+    if not content_type:
+        return None
+    return content_type.split(";")[0].strip().lower()
+
+
+def _preferences(header: str) -> List[str]:
+    """The values of an Accept or Accept-Encoding header, the preferred first, the
+    refused ones (q=0) left out."""
+    values = []
+    for i, item in enumerate(header.split(",")):
+        value, *params = [part.strip() for part in item.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if value and q > 0:
+            values.append((-q, i, value.lower()))
+    return [value for _, _, value in sorted(values)]
+
+
+def negotiate_format(
+    accept: Optional[str], default: WireFormat, formats: Optional[Dict[str, WireFormat]] = None
+) -> Optional[WireFormat]:
+    """The format of a response from the Accept header of the request, None if none
+    of formats (the registered formats by default) is acceptable."""
+    formats = FORMATS if formats is None else formats
+    if not accept:
+        return default
+    for value in _preferences(accept):
+        if value in formats:
+            return formats[value]
+        if value in ("*/*", "application/*", "application/octet-stream"):
+            return default
+    return None
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The compression of a response from the Accept-Encoding header of the request,
+    None for no compression."""
+    for value in _preferences(accept_encoding or ""):
+        if value == "identity":
+            return None
+        if value in ENCODINGS:
+            return value
+    return None